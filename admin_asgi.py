@@ -0,0 +1,219 @@
+"""ASGI-режим админки: один процесс, конкурентные запросы к API каталога.
+
+    uvicorn admin_asgi:application --host 127.0.0.1 --port 5000
+
+JSON API каталога (/api/categories, /api/categories/<id>/items,
+/api/items/<id>) обслуживается асинхронно: запросы к БД идут через
+shop_db.AsyncDatabase, и пока один запрос ждет SQLite, цикл событий
+принимает следующие. Данные ответа, ETag и кэш каталога — те же функции,
+что и у маршрутов Flask в app.py.
+
+Остальные страницы (HTML, формы, загрузки) передаются приложению Flask как
+WSGI в пуле потоков ASGI_WSGI_THREADS; тело запроса предварительно
+читается во временный файл, ответ отдается по мере формирования.
+
+ASGI-сервер (uvicorn, hypercorn) не входит в зависимости: основной режим —
+gunicorn -c gunicorn.conf.py. Настройки окружения: ASGI_DB_WORKERS (8),
+ASGI_WSGI_THREADS (8).
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import app as admin
+import shop_db
+
+logger = logging.getLogger(__name__)
+
+DB_WORKERS = int(os.getenv('ASGI_DB_WORKERS', 8))
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 8))
+BODY_SPOOL_SIZE = 1024 * 1024  # тело запроса больше этого пишется на диск
+NOT_MODIFIED = object()
+
+
+def parse_etags(header):
+    """Значения If-None-Match без кавычек и префикса W/"""
+    return {tag.strip().removeprefix('W/').strip('"') for tag in header.split(',') if tag.strip()}
+
+
+def api_lookup(cursor, key, etags, builder, args):
+    """Выполняется в потоке БД: ETag и данные ответа (NOT_MODIFIED, если у клиента актуальная копия)"""
+    version, etag = admin.api_version_etag(cursor, key)
+    if etag in etags:
+        return etag, NOT_MODIFIED
+    return etag, admin.catalog_cache.get(key, version, lambda: builder(cursor, *args))
+
+
+class AsgiAdmin:
+    """ASGI-приложение: API каталога — асинхронно, остальное — через WSGI-приложение Flask"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.database = shop_db.AsyncDatabase(admin.Config.DATABASE_PATH, workers=DB_WORKERS, foreign_keys=True)
+        self.wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+        self.routes = [
+            (re.compile(r'/api/categories'), self.api_categories),
+            (re.compile(r'/api/categories/(\d+)/items'), self.api_category_items),
+            (re.compile(r'/api/items/(\d+)'), self.api_item_details),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if scope['method'] in ('GET', 'HEAD'):
+            for pattern, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await handler(scope, send, *(int(group) for group in match.groups()))
+                    return
+        await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_running_loop().run_in_executor(self.wsgi_executor, admin.create_app)
+                admin.job_runner.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.wsgi_executor.shutdown(wait=True)
+                admin.job_runner.stop()
+                self.database.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # API каталога
+
+    async def api_categories(self, scope, send):
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        after, limit = admin.get_api_page_params(args)
+        await self.api_response(scope, send, admin.categories_payload, after, limit,
+                                admin.get_api_fields(args, admin.API_CATEGORY_FIELDS))
+
+    async def api_category_items(self, scope, send, category_id):
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        after, limit = admin.get_api_page_params(args)
+        currency = args.get('currency', 'RUB').upper()
+        await self.api_response(scope, send, admin.category_items_payload, category_id, currency, after, limit,
+                                admin.get_api_fields(args, admin.API_ITEM_FIELDS))
+
+    async def api_item_details(self, scope, send, item_id):
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        currency = args.get('currency', 'RUB').upper()
+        await self.api_response(scope, send, admin.item_payload, item_id, currency,
+                                admin.get_api_fields(args, admin.API_ITEM_FIELDS))
+
+    async def api_response(self, scope, send, builder, *args):
+        # Ключ кэша совпадает с request.full_path во Flask: ответы общие для обоих режимов
+        key = f"{scope['path']}?{scope['query_string'].decode('latin-1')}"
+        headers = dict(scope['headers'])
+        etags = parse_etags(headers.get(b'if-none-match', b'').decode('latin-1'))
+        etag, payload = await self.database.run(api_lookup, key, etags, builder, args)
+
+        response_headers = [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'public, no-cache')]
+        if payload is NOT_MODIFIED:
+            await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        status = 200
+        if payload is None:
+            status, payload, response_headers = 404, {'error': 'Не найдено'}, []
+        body = admin.app.json.dumps(payload).encode()
+        response_headers += [(b'content-type', b'application/json'),
+                             (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    # Остальные страницы — приложение Flask
+
+    async def call_wsgi(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE)
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.wsgi_executor, self.run_wsgi, scope, body, send, loop)
+        finally:
+            body.close()
+
+    def run_wsgi(self, scope, body, send, loop):
+        """Выполняется в потоке пула: вызывает WSGI-приложение и передает ответ в цикл событий"""
+        response_start = {}
+
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+
+        result = self.wsgi_app(wsgi_environ(scope, body), start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not started:
+                    send_message(response_start)
+                    started = True
+                if chunk:
+                    send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                send_message(response_start)
+            send_message({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def wsgi_environ(scope, body):
+    """Окружение WSGI (PEP 3333) для HTTP-запроса ASGI"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+application = AsgiAdmin(admin.app)
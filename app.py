@@ -1,18 +1,94 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, \
+    stream_with_context, send_from_directory, make_response, g, has_request_context, \
+    before_render_template, template_rendered
 import sqlite3
 import os
+import click
 from werkzeug.utils import secure_filename
 import logging
-from contextlib import contextmanager
-from functools import wraps
+from contextlib import contextmanager, suppress
+from functools import wraps, lru_cache
+from collections import OrderedDict
+import threading
 import shutil
+import hashlib
+import tempfile
+import re
+import json
+import queue
+import uuid
 import time
-
-app = Flask(__name__)
+import hmac
+import cProfile
+import gzip
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+import catalog_io
+import jobs
+import log_pipeline
+import metrics
+import pricing
+import rates
+import shop_db
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+@lru_cache(maxsize=4096)
+def file_content_hash(full_path, mtime_ns, size):
+    """sha256 содержимого файла; кэшируется по (путь, mtime, размер)"""
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ShopFlask(Flask):
+    """Flask с кэшированием статики: ETag по содержимому, immutable для
+    загрузок по хешу и отдача заранее сжатых .br/.gz версий CSS и JS"""
+
+    def send_static_file(self, filename):
+        static_folder = self.static_folder
+        full_path = os.path.join(static_folder, filename)
+
+        if filename.endswith(PRECOMPRESSED_EXTENSIONS):
+            accepted = request.accept_encodings
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if accepted[encoding] and os.path.isfile(full_path + suffix):
+                    mimetype = mimetypes.guess_type(filename)[0]
+                    response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+                    response.headers['Content-Encoding'] = encoding
+                    response.vary.add('Accept-Encoding')
+                    return response
+            response = super().send_static_file(filename)
+            response.vary.add('Accept-Encoding')
+            return response
+
+        if not filename.startswith('uploads/') or not os.path.isfile(full_path):
+            return super().send_static_file(filename)
+
+        if OBJECT_PATH_RE.match(filename):
+            # Имя файла — хеш содержимого, значит файл по этому адресу никогда не меняется
+            etag = os.path.splitext(os.path.basename(filename))[0]
+            response = send_from_directory(static_folder, filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+
+        stat = os.stat(full_path)
+        etag = file_content_hash(full_path, stat.st_mtime_ns, stat.st_size)
+        return send_from_directory(static_folder, filename, etag=etag)
+
+
+app = ShopFlask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Настройка логирования: вывод в отдельном потоке, не в потоках запросов
+log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -21,36 +97,298 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
     DATABASE_PATH = 'shop.db'
+    OBJECTS_FOLDER = 'uploads/objects'  # относительно static
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+    MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 16 * 1024 * 1024))
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 200 * 1024 * 1024))
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))  # соединений на процесс (воркер gunicorn)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))  # потоков фоновых заданий на процесс
+    FILE_DELETE_GRACE = 3600  # секунд: файл, с которым недавно совпала загрузка, удаляется не раньше
+    IMPORT_FOLDER = os.getenv('IMPORT_FOLDER', 'imports')  # файлы импорта каталога до обработки заданием
+    SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 0.5))  # секунд
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')  # ?profile=<токен>; без токена профилирование выключено
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', 'profiles')
 
 
 app.config.from_object(Config)
 os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
 
+# Пул потоков для проверки изображений и построения миниатюр
+upload_executor = ThreadPoolExecutor(max_workers=Config.UPLOAD_WORKERS, thread_name_prefix='upload')
+
+
+def _recreate_upload_executor():
+    # Потоки не переживают fork: воркеру gunicorn нужен собственный пул
+    global upload_executor
+    upload_executor = ThreadPoolExecutor(max_workers=Config.UPLOAD_WORKERS, thread_name_prefix='upload')
+
+
+os.register_at_fork(after_in_child=_recreate_upload_executor)
+
+UPLOAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+OBJECT_PATH_RE = re.compile(r'^uploads/objects/[0-9a-f]{2}/[0-9a-f]{64}\.(png|jpg|jpeg|webp)$')
+
+IMAGE_SIGNATURES = (
+    (0, b'\xff\xd8\xff'),  # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),  # PNG
+    (8, b'WEBP'),  # WEBP (RIFF....WEBP)
+)
+
+
+SCHEMA_VERSION_KEY = 'admin_schema_version'
+SCHEMA_VERSION = 3  # увеличить при любом изменении init_db или migrate_database
+
+SEARCH_LIMIT = 50
+
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 200
+API_CATEGORY_FIELDS = ('id', 'name', 'image_path')
+API_ITEM_FIELDS = ('id', 'category_id', 'name', 'description', 'sizes', 'stock_quantity',
+                   'price', 'currency', 'images')
+
+
+class UploadError(Exception):
+    """Загруженный файл не прошел проверку"""
+
+
+def is_image_header(header):
+    return any(header[offset:offset + len(signature)] == signature for offset, signature in IMAGE_SIGNATURES)
+
+
+# Метрики запросов: время маршрута, соединения, SQL и шаблоны
+metrics_registry = metrics.Registry()
+REQUEST_DURATION = metrics_registry.histogram(
+    'admin_request_duration_seconds', 'Request latency', ('endpoint', 'method'))
+REQUESTS = metrics_registry.counter(
+    'admin_requests_total', 'Requests by response status', ('endpoint', 'status'))
+DB_CONNECTIONS = metrics_registry.histogram(
+    'admin_db_connections_per_request', 'create_connection() calls per request', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20))
+DB_QUERIES = metrics_registry.histogram(
+    'admin_db_queries_per_request', 'SQL statements per request', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+DB_DURATION = metrics_registry.histogram(
+    'admin_db_duration_seconds', 'Time spent executing SQL per request', ('endpoint',))
+TEMPLATE_DURATION = metrics_registry.histogram(
+    'admin_template_render_seconds', 'Template render time', ('template',))
+
+
+class RequestStats:
+    """Счетчики одного запроса, хранятся в g.request_stats"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connections = 0
+        self.queries = []  # (sql, секунды)
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_started = None
+
+    def record_query(self, sql, elapsed):
+        self.queries.append((sql, elapsed))
+        self.db_time += elapsed
+
+
+def current_request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий выполнение каждого SQL-выражения"""
+
+    def _timed(self, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            stats = current_request_stats()
+            if stats is not None:
+                stats.record_query(sql, time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(super().executescript, sql_script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, у которого все курсоры — TimedCursor"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None:
+        stats.template_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None and stats.template_started is not None:
+        elapsed = time.perf_counter() - stats.template_started
+        stats.template_time += elapsed
+        stats.template_started = None
+        TEMPLATE_DURATION.observe(elapsed, template=template.name)
+
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = RequestStats()
+    token = request.args.get('profile')
+    if token and Config.PROFILE_TOKEN and hmac.compare_digest(token, Config.PROFILE_TOKEN):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_request_stats(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers['X-Profile'] = dump_profile(profiler)
+
+    total = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_DURATION.observe(total, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    DB_CONNECTIONS.observe(stats.connections, endpoint=endpoint)
+    DB_QUERIES.observe(len(stats.queries), endpoint=endpoint)
+    DB_DURATION.observe(stats.db_time, endpoint=endpoint)
+
+    response.headers['Server-Timing'] = ', '.join((
+        f'app;dur={total * 1000:.1f}',
+        f'db;dur={stats.db_time * 1000:.1f};desc="{len(stats.queries)} queries, {stats.connections} connections"',
+        f'tpl;dur={stats.template_time * 1000:.1f}',
+    ))
+    if total >= Config.SLOW_REQUEST_THRESHOLD:
+        slowest_sql, slowest = max(stats.queries, key=lambda query: query[1], default=('', 0.0))
+        logger.warning(
+            "Slow request: %s %s endpoint=%s total=%.0fms db=%d queries/%.0fms in %d connections "
+            "template=%.0fms slowest query %.0fms: %s",
+            request.method, request.path, endpoint, total * 1000, len(stats.queries), stats.db_time * 1000,
+            stats.connections, stats.template_time * 1000, slowest * 1000, ' '.join(slowest_sql.split())[:200],
+            extra={'endpoint': endpoint, 'total_ms': round(total * 1000, 1), 'db_queries': len(stats.queries),
+                   'db_ms': round(stats.db_time * 1000, 1), 'db_connections': stats.connections,
+                   'template_ms': round(stats.template_time * 1000, 1)}
+        )
+    return response
+
+
+def dump_profile(profiler):
+    """Сохраняет профиль запроса в PROFILE_FOLDER; открывается snakeviz или pstats"""
+    os.makedirs(Config.PROFILE_FOLDER, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:8]}.prof"
+    path = os.path.join(Config.PROFILE_FOLDER, filename)
+    profiler.dump_stats(path)
+    logger.info(f"Profile for {request.method} {request.full_path} saved to {path}")
+    return filename
+
+
+class ConnectionPool:
+    """Открытые соединения с БД, общие для потоков одного процесса.
+
+    Соединение SQLite нельзя использовать после fork, поэтому в дочернем
+    процессе (воркере gunicorn) пул начинается с нуля.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = queue.LifoQueue(size)
+        os.register_at_fork(after_in_child=self.reset)
+
+    def connect(self):
+        conn = sqlite3.connect(Config.DATABASE_PATH, factory=TimedConnection, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
-# Функция для создания соединения с БД
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def reset(self):
+        # Унаследованные от родителя соединения не закрываем: это затронуло бы его файлы
+        self.idle = queue.LifoQueue(self.size)
+
+
+connection_pool = ConnectionPool(Config.DB_POOL_SIZE)
+
+
+# Функция для создания соединения с БД (из пула процесса)
 def create_connection():
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.row_factory = sqlite3.Row
-    return conn
+    stats = current_request_stats()
+    if stats is not None:
+        stats.connections += 1
+    return connection_pool.acquire()
 
 
-# Контекстный менеджер для работы с БД
+# Контекстный менеджер для работы с БД: одна транзакция на блок
 @contextmanager
 def get_db_connection():
-    conn = None
+    conn = create_connection()
     try:
-        conn = create_connection()
         yield conn
+        conn.commit()
     except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
-        logger.error(f"Database error: {e}")
+        conn.rollback()
+        logger.error("Database error: %s", e)
+        raise
+    except Exception:
+        conn.rollback()
         raise
     finally:
-        if conn:
-            conn.commit()
-            conn.close()
+        connection_pool.release(conn)
+
+
+# Использует уже открытое соединение или берет из пула только для чтения
+@contextmanager
+def use_connection(conn=None):
+    if conn is not None:
+        yield conn
+        return
+    conn = create_connection()
+    try:
+        yield conn
+    finally:
+        connection_pool.release(conn)
 
 
 # Декоратор для обработки ошибок
@@ -60,13 +398,38 @@ def handle_errors(f):
         try:
             return f(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Error in {f.__name__}: {e}")
+            logger.error("Error in %s: %s", f.__name__, e)
             flash('Произошла ошибка. Попробуйте снова.', 'error')
             return redirect(url_for('home'))
 
     return decorated_function
 
 
+# Декоратор условного GET для страниц каталога: ETag по версии каталога и валюте
+def conditional_catalog_page(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Страницы с flash-сообщениями не кэшируем
+        if session.get('_flashes'):
+            return f(*args, **kwargs)
+
+        key = f"{f.__name__}:{sorted(kwargs.items())}:{session.get('currency', 'RUB')}:" \
+              f"{DatabaseService.get_catalog_version()}"
+        etag = hashlib.sha256(key.encode()).hexdigest()[:32]
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    return decorated_function
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
@@ -137,10 +500,27 @@ def migrate_database():
                 except sqlite3.Error as e:
                     logger.warning(f"Failed to add column {migration['column']} to {migration['table']}: {e}")
 
+        # Шаг округления цен, выведенных из курса
+        pricing.migrate(c)
+
+        # Последовательность папок категорий: один раз засеваем по существующим ctN
+        c.execute(catalog_io.SEQUENCES_TABLE_SQL)
+        catalog_io.seed_folder_sequence(c, 'static')
+
+        # Ход импортов каталога, запущенных из админки
+        c.execute(catalog_io.IMPORTS_TABLE_SQL)
+
+        # Очередь фоновых заданий: удаление файлов, миниатюры
+        jobs.migrate(c)
+
+        # Версия каталога и полнотекстовый поиск: триггеры общие с ботом (shop_db)
+        shop_db.migrate_catalog_triggers(c)
+
         # Обновляем символы валют если они пустые
         c.execute("UPDATE currencies SET symbol = '₽' WHERE name = 'RUB' AND (symbol = '' OR symbol IS NULL)")
         c.execute("UPDATE currencies SET symbol = 'Br' WHERE name = 'BYN' AND (symbol = '' OR symbol IS NULL)")
 
+        c.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (SCHEMA_VERSION_KEY, SCHEMA_VERSION))
         conn.commit()
         logger.info("Database migration completed")
     except sqlite3.Error as e:
@@ -382,6 +762,7 @@ def init_db():
 
         for table in tables:
             c.execute(table)
+        c.execute(catalog_io.SEQUENCES_TABLE_SQL)
 
         conn.commit()
 
@@ -400,6 +781,7 @@ def init_db():
         indexes = [
             'CREATE INDEX IF NOT EXISTS idx_items_category ON items(category_id)',
             'CREATE INDEX IF NOT EXISTS idx_item_images_item ON item_images(item_id)',
+            'CREATE INDEX IF NOT EXISTS idx_item_images_path ON item_images(image_path)',
             'CREATE INDEX IF NOT EXISTS idx_item_prices_item ON item_prices(item_id)',
             'CREATE INDEX IF NOT EXISTS idx_carts_user ON carts(user_id)'
         ]
@@ -424,6 +806,44 @@ def init_db():
     migrate_database()
 
 
+def schema_is_current():
+    """Схема админки уже создана и мигрирована: одно чтение по ключу из sequences"""
+    try:
+        conn = sqlite3.connect(f'file:{Config.DATABASE_PATH}?mode=ro', uri=True)
+    except sqlite3.OperationalError:
+        return False  # базы еще нет
+    try:
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (SCHEMA_VERSION_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    return bool(row) and row[0] >= SCHEMA_VERSION
+
+
+def prepare_startup():
+    """Подготовка к запуску: схема — только если версия отстала, placeholder — в фоне (Pillow грузится там же)"""
+    if schema_is_current():
+        logger.info("Database schema is up to date")
+    else:
+        init_db()
+    if not os.path.exists(os.path.join(Config.UPLOAD_FOLDER, 'placeholder.jpg')):
+        upload_executor.submit(create_placeholder_if_needed)
+
+
+def create_app(prepare=True):
+    """Точка входа WSGI: gunicorn -c gunicorn.conf.py (wsgi_app = 'app:create_app()').
+
+    Маршруты регистрируются при импорте модуля, здесь выполняется подготовка
+    к запуску. С preload_app она проходит один раз в мастере gunicorn, до
+    fork воркеров; соединения мастера закрываются, чтобы не попасть в воркеры.
+    """
+    if prepare:
+        prepare_startup()
+    connection_pool.close_all()
+    return app
+
+
 def create_placeholder_if_needed():
     """Создает placeholder изображение если его нет"""
     placeholder_path = os.path.join(Config.UPLOAD_FOLDER, 'placeholder.jpg')
@@ -464,185 +884,472 @@ def create_placeholder_if_needed():
             logger.warning(f"Failed to create placeholder image: {e}")
 
 
-class DatabaseService:
-    """Сервис для работы с базой данных"""
+class CatalogCache:
+    """Кэш данных каталога в памяти процесса.
+
+    Целиком сбрасывается, когда меняется версия каталога в БД.
+    """
+
+    def __init__(self, max_entries=1024, load_timeout=10):
+        self.max_entries = max_entries
+        self.load_timeout = load_timeout
+        self.version = None
+        self.entries = OrderedDict()
+        self.loading = {}  # (key, version) -> Event: ключ уже загружает другой поток
+        self.lock = threading.Lock()
+
+    def get(self, key, version, loader):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            pending = self.loading.get((key, version))
+            if pending is None:
+                self.loading[(key, version)] = threading.Event()
+
+        # После смены версии все потоки промахиваются одновременно —
+        # загружает один, остальные ждут его результат
+        if pending is not None:
+            pending.wait(self.load_timeout)
+            with self.lock:
+                if version == self.version and key in self.entries:
+                    return self.entries[key]
+            return loader()
 
-    @staticmethod
-    def get_categories():
-        conn = None
         try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM categories ORDER BY name")
-            return cursor.fetchall()
+            value = loader()
+            with self.lock:
+                if version == self.version:
+                    self.entries[key] = value
+                    if len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            return value
         finally:
-            if conn:
-                conn.close()
+            with self.lock:
+                self.loading.pop((key, version)).set()
+
+
+catalog_cache = CatalogCache()
+
+class DatabaseService:
+    """Сервис для работы с базой данных (запросы — в shop_db)"""
 
     @staticmethod
-    def get_category_by_id(category_id):
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM categories WHERE id = ?", (category_id,))
-            return cursor.fetchone()
-        finally:
-            if conn:
-                conn.close()
+    def get_catalog_version(conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_catalog_version(conn.cursor())
 
     @staticmethod
-    def get_item_by_id(item_id):
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM items WHERE id = ?", (item_id,))
-            return cursor.fetchone()
-        finally:
-            if conn:
-                conn.close()
+    def get_categories(conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_categories(conn.cursor())
 
     @staticmethod
-    def get_item_images(item_id):
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM item_images WHERE item_id = ? ORDER BY is_primary DESC", (item_id,))
-            return cursor.fetchall()
-        finally:
-            if conn:
-                conn.close()
+    def get_category_by_id(category_id, conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_category(conn.cursor(), category_id)
 
     @staticmethod
-    def get_item_prices(item_id):
-        conn = None
-        try:
-            conn = create_connection()
+    def search_items(query, currency_code='RUB', limit=SEARCH_LIMIT, conn=None):
+        """Поиск товаров по названию и описанию, лучшие совпадения первыми"""
+        with use_connection(conn) as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                           SELECT ip.*, c.name as currency_name, c.symbol
-                           FROM item_prices ip
-                                    JOIN currencies c ON ip.currency_id = c.id
-                           WHERE ip.item_id = ?
-                           """, (item_id,))
-            return cursor.fetchall()
-        finally:
-            if conn:
-                conn.close()
+            item_ids = shop_db.search_item_ids(cursor, query, limit)
+            return shop_db.get_items_details(cursor, item_ids, currency_code) if item_ids else []
 
     @staticmethod
-    def get_items_by_category(category_id, currency_code='RUB'):
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            query = '''
-                    SELECT i.*,
-                           GROUP_CONCAT(ii.image_path ORDER BY ii.is_primary DESC) as images,
-                           COALESCE(ip.price, 0)                                   as price
-                    FROM items i
-                             LEFT JOIN item_images ii ON i.id = ii.item_id
-                             LEFT JOIN item_prices ip ON i.id = ip.item_id
-                             LEFT JOIN currencies c ON ip.currency_id = c.id AND c.name = ?
-                    WHERE i.category_id = ?
-                    GROUP BY i.id
-                    ORDER BY i.name \
-                    '''
-            cursor.execute(query, (currency_code, category_id))
-            items = cursor.fetchall()
-            result = []
-            for item in items:
-                item_dict = dict(item)
-                if item_dict['images']:
-                    image_paths = item_dict['images'].split(',')
-                    valid_images = []
-                    for img_path in image_paths:
-                        if img_path and img_path.strip():
-                            full_path = os.path.join('static', img_path.replace('/', os.sep))
-                            if os.path.exists(full_path):
-                                valid_images.append(img_path.strip())
-                            else:
-                                logger.warning(f"Image not found: {full_path}")
-                    item_dict['images'] = ','.join(valid_images) if valid_images else None
-                result.append(item_dict)
-            return result
-        finally:
-            if conn:
-                conn.close()
+    def get_item_by_id(item_id, conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_item(conn.cursor(), item_id)
 
     @staticmethod
-    def get_currencies():
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            try:
-                # Пробуем запрос с is_active
-                cursor.execute("SELECT * FROM currencies WHERE is_active = 1 ORDER BY name")
-                currencies = cursor.fetchall()
-                if currencies:
-                    return currencies
-                # Если нет активных валют, возвращаем все
-                cursor.execute("SELECT * FROM currencies ORDER BY name")
-                return cursor.fetchall()
-            except sqlite3.OperationalError:
-                # Если колонки is_active нет, используем базовый запрос
-                cursor.execute("SELECT * FROM currencies ORDER BY name")
-                return cursor.fetchall()
-        finally:
-            if conn:
-                conn.close()
+    def get_item_images(item_id, conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_item_images(conn.cursor(), item_id)
+
+    @staticmethod
+    def get_item_prices(item_id, conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_item_prices(conn.cursor(), item_id)
+
+    @staticmethod
+    def get_items_by_category(category_id, currency_code='RUB', conn=None):
+        with use_connection(conn) as conn:
+            items = shop_db.get_category_items(conn.cursor(), category_id, currency_code)
+        result = []
+        for item in items:
+            item_dict = dict(item)
+            if item_dict['images']:
+                image_paths = item_dict['images'].split(',')
+                valid_images = []
+                for img_path in image_paths:
+                    if img_path and img_path.strip():
+                        full_path = os.path.join('static', img_path.replace('/', os.sep))
+                        if os.path.exists(full_path):
+                            valid_images.append(img_path.strip())
+                        else:
+                            logger.warning("Image not found: %s", full_path)
+                item_dict['images'] = ','.join(valid_images) if valid_images else None
+            result.append(item_dict)
+        return result
+
+    @staticmethod
+    def get_currencies(conn=None):
+        with use_connection(conn) as conn:
+            return shop_db.get_active_currencies(conn.cursor())
 
 
 class FileService:
     """Сервис для работы с файлами"""
 
     @staticmethod
-    def get_next_folder_name(base_path, prefix='ct'):
-        if not os.path.exists(base_path):
-            os.makedirs(base_path, exist_ok=True)
-            return f'{prefix}1'
+    def allocate_folder_name(conn):
+        """Имя папки для новой категории из последовательности в БД (O(1), внутри транзакции)"""
+        return catalog_io.allocate_folder_name(conn.cursor(), 'static')
 
-        existing_folders = [f for f in os.listdir(base_path)
-                            if f.startswith(prefix) and f[len(prefix):].isdigit()]
-        next_number = max([int(f[len(prefix):]) for f in existing_folders] + [0]) + 1
-        return f'{prefix}{next_number}'
+    @staticmethod
+    def incoming_path(upload_id):
+        """Путь к временному файлу загрузки (по нему же считается прогресс)"""
+        return os.path.join('static', Config.OBJECTS_FOLDER.replace('/', os.sep), '.incoming', f'{upload_id}.part')
 
     @staticmethod
-    def save_uploaded_file(file, folder_path):
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{int(time.time())}{ext}"
-            clean_folder_path = folder_path.replace('static' + os.sep, '').replace('static/', '')
-            file_path = os.path.join('static', clean_folder_path, filename)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            logger.info(f"Saving file to: {file_path}")
-            file.save(file_path)
-            if os.path.exists(file_path):
-                logger.info(f"File saved successfully: {file_path}")
-                relative_path = os.path.join(clean_folder_path, filename).replace(os.sep, '/')
-                return relative_path
-            else:
-                logger.error(f"Failed to save file: {file_path}")
-        logger.warning(f"File not saved: {file.filename if file else 'No file'}")
-        return None
+    def upload_status_path(upload_id):
+        """Файл с результатом завершенной загрузки"""
+        return FileService.incoming_path(upload_id)[:-len('.part')] + '.json'
+
+    @staticmethod
+    def write_upload_status(upload_id, **status):
+        """Результат загрузки для /upload/<id>: done с путем или failed с ошибкой"""
+        with open(FileService.upload_status_path(upload_id), 'w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False)
+
+    @staticmethod
+    def receive_stream(stream, filename, upload_id=None):
+        """Принимает поток во временный файл в .incoming.
+
+        Данные пишутся на диск кусками по UPLOAD_CHUNK_SIZE, без буферизации
+        в памяти, с проверкой сигнатуры изображения и лимита MAX_UPLOAD_SIZE.
+        Возвращает (путь в хранилище по sha256 содержимого, временный файл).
+        FileExistsError, если загрузка с тем же upload_id еще идет.
+        """
+        ext = os.path.splitext(secure_filename(filename))[1].lower()
+        incoming_path = os.path.join('static', Config.OBJECTS_FOLDER.replace('/', os.sep), '.incoming')
+        os.makedirs(incoming_path, exist_ok=True)
+
+        if upload_id:
+            tmp_path = FileService.incoming_path(upload_id)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            # Результат прошлой загрузки с тем же id не должен выдавать эту за завершенную
+            with suppress(FileNotFoundError):
+                os.remove(FileService.upload_status_path(upload_id))
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=incoming_path, suffix='.part')
+
+        digest = hashlib.sha256()
+        header = b''
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(Config.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > Config.MAX_UPLOAD_SIZE:
+                        raise UploadError(f"Файл больше {Config.MAX_UPLOAD_SIZE} байт")
+                    if len(header) < 12:
+                        header += chunk[:12 - len(header)]
+                        if len(header) == 12 and not is_image_header(header):
+                            raise UploadError("Файл не является изображением JPEG, PNG или WEBP")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if not is_image_header(header):
+                raise UploadError("Файл не является изображением JPEG, PNG или WEBP")
+
+            content_hash = digest.hexdigest()
+            return f"{Config.OBJECTS_FOLDER}/{content_hash[:2]}/{content_hash}{ext}", tmp_path
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def publish(relative_path, tmp_path):
+        """Кладет принятый файл в хранилище; True, если файл создан, False — если такой уже был.
+
+        Одинаковые изображения хранятся один раз. У совпавшего файла
+        обновляется mtime: uploads_gc не трогает файлы моложе --min-age, пока
+        ссылка на него еще не закоммичена.
+        """
+        file_path = os.path.join('static', relative_path.replace('/', os.sep))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        while True:
+            try:
+                os.link(tmp_path, file_path)
+                return True
+            except FileExistsError:
+                try:
+                    os.utime(file_path)
+                    return False
+                except FileNotFoundError:
+                    continue  # файл удалили между link и utime — кладем заново
+
+    @staticmethod
+    def store_stream(stream, filename, upload_id=None):
+        """Сохраняет поток под именем sha256 его содержимого.
+
+        Возвращает (относительный путь, создан ли файл).
+        """
+        relative_path, tmp_path = FileService.receive_stream(stream, filename, upload_id)
+        try:
+            return relative_path, FileService.publish(relative_path, tmp_path)
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def file_age(file_path):
+        """Секунд с последнего изменения файла (None, если файла нет)"""
+        try:
+            return time.time() - os.path.getmtime(os.path.join('static', file_path.replace('/', os.sep)))
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def is_stored_object(file_path):
+        """Проверяет, что путь указывает на уже сохраненный файл из хранилища"""
+        return bool(OBJECT_PATH_RE.match(file_path or '')) and \
+            os.path.exists(os.path.join('static', file_path.replace('/', os.sep)))
+
+    @staticmethod
+    def count_references(file_path, conn=None):
+        """Сколько строк в item_images и categories ссылаются на файл"""
+        with use_connection(conn) as conn:
+            return shop_db.count_image_references(conn.cursor(), file_path)
+
+    @staticmethod
+    def remove_unreferenced(file_path, conn):
+        """Удаляет файл, его миниатюру и file_id в Telegram, если на файл не осталось ссылок.
+
+        Проверка и удаление идут под блокировкой записи (BEGIN IMMEDIATE),
+        поэтому закоммиченная ссылка на файл всегда видна. Загрузка, которая
+        совпала с файлом до его удаления, пишет ссылку позже: такие
+        транзакции сами проверяют файлы под своей блокировкой записи перед
+        commit (StagedFiles.ensure_files) и при необходимости кладут файл
+        заново. Блокировку снимает commit вызывающего get_db_connection.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        if FileService.count_references(file_path, conn):
+            logger.info("File still referenced, kept: %s", file_path)
+            return False
+        for relative_path in (file_path, catalog_io.thumbnail_path(file_path)):
+            try:
+                os.remove(os.path.join('static', relative_path.replace('/', os.sep)))
+            except FileNotFoundError:
+                pass
+        shop_db.forget_telegram_file(conn.cursor(), file_path)
+        logger.info("Deleted file: %s", file_path)
+        return True
 
     @staticmethod
     def delete_file_safe(file_path):
+        """Удаляет файл, только если на него больше не осталось ссылок; ошибки только логируются"""
         try:
-            full_path = os.path.join('static', file_path.replace('/', os.sep))
-            if os.path.exists(full_path):
-                os.remove(full_path)
-                logger.info(f"Deleted file: {file_path}")
-        except OSError as e:
-            logger.warning(f"Failed to delete file {file_path}: {e}")
+            with get_db_connection() as conn:
+                return FileService.remove_unreferenced(file_path, conn)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Failed to delete file %s: %s", file_path, e)
+        return False
+
+
+class StagedFiles:
+    """Файловые операции, которые применяются или откатываются вместе с транзакцией.
+
+    Миниатюры новых файлов и удаление замененных выполняются фоновыми
+    заданиями: schedule() ставит их в очередь курсором транзакции перед commit.
+    Временные файлы загрузок хранятся до конца транзакции, чтобы ensure_files
+    мог положить файл заново, если его удалили до записи ссылки.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.pending_deletes = []
+        self.sources = {}  # путь в хранилище -> временный файл загрузки
+        self.referenced = []  # файлы, загруженные раньше через /upload
+
+    def save(self, file):
+        return self.save_all([file])[0]
+
+    def save_all(self, files):
+        """Сохраняет файлы параллельно в пуле потоков.
+
+        Возвращает пути в том же порядке, что и files (None для пропущенных).
+        """
+        results = list(upload_executor.map(process_upload, files))
+        for relative_path, created, tmp_path in results:
+            if relative_path is None:
+                continue
+            if created:
+                self.created.append(relative_path)
+            if relative_path in self.sources:
+                os.remove(tmp_path)  # тот же файл дважды в одной форме
+            else:
+                self.sources[relative_path] = tmp_path
+        return [relative_path for relative_path, _, _ in results]
+
+    def reference(self, file_paths):
+        self.referenced.extend(file_paths)
+
+    def delete_on_commit(self, file_path):
+        if file_path:
+            self.pending_deletes.append(file_path)
+
+    def ensure_files(self):
+        """Проверяет, что файлы, на которые ссылается транзакция, на месте.
+
+        Вызывается, когда ссылки уже записаны и транзакция держит блокировку
+        записи: задание delete_file, удалившее файл с тем же содержимым после
+        дедупликации, но до записи ссылки, больше ничего не удалит. Пропавший
+        файл кладется заново из временного; файл из /upload восстановить не из чего.
+        """
+        for relative_path, tmp_path in self.sources.items():
+            if FileService.publish(relative_path, tmp_path) and relative_path not in self.created:
+                logger.warning("File was deleted before its reference was saved, restored: %s", relative_path)
+                self.created.append(relative_path)
+        for file_path in self.referenced:
+            if not FileService.is_stored_object(file_path):
+                raise UploadError(f"Изображение {file_path} было удалено, загрузите его заново")
+
+    def schedule(self, cursor):
+        self.ensure_files()
+        for file_path in self.created:
+            jobs.enqueue(cursor, 'make_thumbnail', {'path': file_path})
+        for file_path in dict.fromkeys(self.pending_deletes):
+            jobs.enqueue(cursor, 'delete_file', {'path': file_path})
+
+    def commit(self):
+        self.discard_sources()
+        self.created, self.pending_deletes, self.referenced = [], [], []
+        job_runner.notify()
+
+    def rollback(self):
+        # Удаляются только созданные этой операцией файлы, на которые никто не ссылается
+        for file_path in self.created:
+            FileService.delete_file_safe(file_path)
+        self.discard_sources()
+        self.created, self.pending_deletes, self.referenced = [], [], []
+
+    def discard_sources(self):
+        for tmp_path in self.sources.values():
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        self.sources = {}
+
+
+def process_upload(file):
+    """Проверяет и сохраняет один загруженный файл (миниатюра — в StagedFiles.schedule).
+
+    Возвращает (путь, создан ли файл, временный файл); временный файл
+    удаляет StagedFiles после commit или rollback.
+    """
+    if not file or not file.filename:
+        return None, False, None
+    if not allowed_file(file.filename):
+        logger.warning("File not saved: %s", file.filename)
+        return None, False, None
+    try:
+        relative_path, tmp_path = FileService.receive_stream(file.stream, file.filename)
+        try:
+            created = FileService.publish(relative_path, tmp_path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    except (UploadError, OSError) as e:
+        logger.warning("Failed to save file %s: %s", file.filename, e)
+        return None, False, None
+    logger.info("File %s: %s", 'saved' if created else 'deduplicated', relative_path)
+    return relative_path, created, tmp_path
+
+
+def delete_file_job(payload):
+    """Задание delete_file: удаляет файл и его миниатюру, если на файл не осталось ссылок.
+
+    Заодно забывает file_id этого файла в Telegram (таблица бота telegram_files).
+    Ошибки пробрасываются, чтобы очередь повторила задание.
+    """
+    file_path = payload['path']
+    with get_db_connection() as conn:
+        age = FileService.file_age(file_path)
+        if age is not None and age < Config.FILE_DELETE_GRACE:
+            # С файлом недавно совпала загрузка через /upload: ссылка на него может появиться позже
+            jobs.enqueue(conn.cursor(), 'delete_file', payload, delay=Config.FILE_DELETE_GRACE - age)
+            logger.info("File changed %.0fs ago, delete postponed: %s", age, file_path)
+            return
+        FileService.remove_unreferenced(file_path, conn)
+
+
+def make_thumbnail_job(payload):
+    """Задание make_thumbnail (без Pillow ничего не делает)"""
+    catalog_io.make_thumbnail(payload['path'])
+
+
+def import_catalog_job(payload):
+    """Задание import_catalog: импорт файла, загруженного через /import_catalog.
+
+    Каждая пачка коммитится отдельно вместе с прогрессом в catalog_imports,
+    поэтому повтор задания продолжает импорт, а не начинает заново.
+    Миниатюры ставятся отдельными заданиями make_thumbnail.
+    """
+    path = payload['path']
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            catalog_io.import_catalog(f, payload['format'], Config.DATABASE_PATH, 'static',
+                                      import_id=payload['import_id'], thumbnail_jobs=True)
+    except FileNotFoundError:
+        with use_connection() as conn:
+            state = catalog_io.get_import(conn.cursor(), payload['import_id'])
+        if state is None or state[0] != 'done':
+            raise
+        return  # файл удален после завершения импорта, задание выдано повторно
+    except catalog_io.ImportTakenOver as e:
+        logger.warning("Catalog import %s: %s", payload['import_id'], e)
+        return
+    job_runner.notify()
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+
+job_runner = jobs.JobRunner({'delete_file': delete_file_job, 'make_thumbnail': make_thumbnail_job,
+                             'import_catalog': import_catalog_job},
+                            Config.DATABASE_PATH, workers=Config.JOB_WORKERS)
+
+
+def get_primary_image_index():
+    try:
+        return int(request.form.get('primary_image', '0'))
+    except (ValueError, TypeError):
+        return 0
+
+
+def stage_item_images(staged):
+    """Собирает изображения товара: заранее загруженные через /upload и файлы формы.
+
+    Возвращает список (путь, is_primary).
+    """
+    paths = [path for path in request.form.getlist('uploaded_images') if FileService.is_stored_object(path)]
+    staged.reference(paths)
+    paths += staged.save_all(request.files.getlist('images'))
+    primary_image_index = get_primary_image_index()
+    return [(path, i == primary_image_index) for i, path in enumerate(paths) if path]
+
 
 # Маршруты
 @app.route('/')
 @handle_errors
+@conditional_catalog_page
 def home():
     selected_currency = session.get('currency', 'RUB')
     categories = DatabaseService.get_categories()
@@ -655,6 +1362,7 @@ def home():
 
 @app.route('/category/<int:category_id>')
 @handle_errors
+@conditional_catalog_page
 def category(category_id):
     selected_currency = session.get('currency', 'RUB')
     category = DatabaseService.get_category_by_id(category_id)
@@ -673,103 +1381,99 @@ def category(category_id):
                            selected_currency=selected_currency)
 
 
+@app.route('/search')
+@handle_errors
+def search():
+    query = request.args.get('q', '').strip()
+    selected_currency = session.get('currency', 'RUB')
+    with use_connection() as conn:
+        items = DatabaseService.search_items(query, selected_currency, conn=conn) if query else []
+        currencies = DatabaseService.get_currencies(conn)
+    return render_template('search.html',
+                           query=query,
+                           items=items,
+                           currencies=currencies,
+                           selected_currency=selected_currency)
+
+
 @app.route('/edit_item/<int:item_id>', methods=['GET', 'POST'])
 @handle_errors
 def edit_item(item_id):
-    item = DatabaseService.get_item_by_id(item_id)
-    if not item:
-        flash('Товар не найден', 'error')
-        return redirect(url_for('home'))
-
-    if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        category_id = request.form.get('category_id')
-        description = request.form.get('description', '').strip()
-        sizes = request.form.get('sizes', '').strip()
-        stock_quantity = request.form.get('stock_quantity', 0)
+    with get_db_connection() as conn:
+        item = DatabaseService.get_item_by_id(item_id, conn)
+        if not item:
+            flash('Товар не найден', 'error')
+            return redirect(url_for('home'))
 
-        if not name or not category_id or not sizes:
-            flash('Заполните все обязательные поля', 'error')
-            return redirect(url_for('edit_item', item_id=item_id))
+        if request.method == 'POST':
+            name = request.form.get('name', '').strip()
+            category_id = request.form.get('category_id')
+            description = request.form.get('description', '').strip()
+            sizes = request.form.get('sizes', '').strip()
+            stock_quantity = request.form.get('stock_quantity', 0)
 
-        try:
-            category_id = int(category_id)
-            stock_quantity = int(stock_quantity)
-        except ValueError:
-            flash('Некорректные данные', 'error')
-            return redirect(url_for('edit_item', item_id=item_id))
-
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE items SET category_id = ?, name = ?, description = ?, sizes = ?, stock_quantity = ? WHERE id = ?",
-                (category_id, name, description, sizes, stock_quantity, item_id)
-            )
-
-            # Обновляем цены
-            currencies = DatabaseService.get_currencies()
-            for currency in currencies:
-                price_field = f'price_{currency["id"]}'
-                price = request.form.get(price_field)
-                if price:
-                    try:
-                        price = float(price)
-                        cursor.execute(
-                            "INSERT OR REPLACE INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
-                            (item_id, currency['id'], price)
-                        )
-                    except ValueError:
-                        logger.warning(f"Invalid price for currency {currency['name']}: {price}")
-
-            # Обрабатываем новые изображения
-            uploaded_files = request.files.getlist('images')
-            if uploaded_files and any(f.filename for f in uploaded_files):
-                category = DatabaseService.get_category_by_id(category_id)
-                category_folder = category['folder_name']
-                if not category_folder:
-                    flash('Ошибка: у категории нет папки для файлов', 'error')
-                    return redirect(url_for('add_item'))
-                    category_path = os.path.join('uploads', category_folder)
-                    os.makedirs(os.path.join('static', category_path), exist_ok=True)
-
-                    primary_image_index = request.form.get('primary_image', '0')
-                    try:
-                        primary_image_index = int(primary_image_index)
-                    except (ValueError, TypeError):
-                        primary_image_index = 0
+            if not name or not category_id or not sizes:
+                flash('Заполните все обязательные поля', 'error')
+                return redirect(url_for('edit_item', item_id=item_id))
 
+            try:
+                category_id = int(category_id)
+                stock_quantity = int(stock_quantity)
+            except ValueError:
+                flash('Некорректные данные', 'error')
+                return redirect(url_for('edit_item', item_id=item_id))
+
+            category = DatabaseService.get_category_by_id(category_id, conn)
+            if not category:
+                flash('Выбранная категория не существует', 'error')
+                return redirect(url_for('edit_item', item_id=item_id))
+
+            staged = StagedFiles()
+            try:
+                # Файлы сохраняются до начала записи, чтобы не держать блокировку БД
+                images = stage_item_images(staged)
+                cursor = conn.cursor()
+                shop_db.update_item(cursor, item_id, category_id, name, description, sizes, stock_quantity)
+
+                # Обновляем цены; пустое поле — цена будет выводиться из курса
+                prices = {}
+                derived = []
+                for currency in DatabaseService.get_currencies(conn):
+                    price = request.form.get(f'price_{currency["id"]}')
+                    if price:
+                        try:
+                            prices[currency['id']] = float(price)
+                        except ValueError:
+                            logger.warning("Invalid price for currency %s: %s", currency['name'], price)
+                    elif price is not None:
+                        derived.append(currency['id'])
+                shop_db.set_item_prices(cursor, item_id, prices, derived)
+
+                # Обрабатываем новые изображения
+                if images:
                     if request.form.get('replace_images') == 'true':
-                        old_images = DatabaseService.get_item_images(item_id)
-                        for img in old_images:
-                            FileService.delete_file_safe(img['image_path'])
-                        cursor.execute("DELETE FROM item_images WHERE item_id = ?", (item_id,))
-
-                    for i, file in enumerate(uploaded_files):
-                        if file and file.filename and allowed_file(file.filename):
-                            relative_path = FileService.save_uploaded_file(file, category_path, i)
-                            if relative_path:
-                                is_primary = (i == primary_image_index)
-                                cursor.execute(
-                                    "INSERT INTO item_images (item_id, image_path, is_primary) VALUES (?, ?, ?)",
-                                    (item_id, relative_path, is_primary)
-                                )
+                        for img in DatabaseService.get_item_images(item_id, conn):
+                            staged.delete_on_commit(img['image_path'])
+                        shop_db.delete_item_images(cursor, item_id)
+                    shop_db.add_item_images(cursor, item_id, images)
+
+                staged.schedule(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                staged.rollback()
+                raise
+            staged.commit()
 
-            conn.commit()
             flash('Товар успешно обновлен!', 'success')
-        finally:
-            if conn:
-                conn.close()
+            return redirect(url_for('category', category_id=category_id))
 
-        return redirect(url_for('category', category_id=item['category_id']))
+        categories = DatabaseService.get_categories(conn)
+        currencies = DatabaseService.get_currencies(conn)
+        item_images = DatabaseService.get_item_images(item_id, conn)
+        item_prices = DatabaseService.get_item_prices(item_id, conn)
 
-    categories = DatabaseService.get_categories()
-    currencies = DatabaseService.get_currencies()
-    item_images = DatabaseService.get_item_images(item_id)
-    item_prices = DatabaseService.get_item_prices(item_id)
     selected_currency = session.get('currency', 'RUB')
-
     prices_dict = {}
     for price in item_prices:
         prices_dict[price['currency_id']] = price['price']
@@ -793,25 +1497,20 @@ def add_category():
             flash('Недопустимое название категории', 'error')
             return redirect(url_for('add_category'))
 
-        folder_name = FileService.get_next_folder_name(Config.UPLOAD_FOLDER)
-        category_path = os.path.join('uploads', folder_name)
-        os.makedirs(os.path.join('static', category_path), exist_ok=True)
-        image_path = None
-        if 'image' in request.files:
-            image_path = FileService.save_uploaded_file(request.files['image'], category_path)
-
-        conn = None
+        staged = StagedFiles()
         try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO categories (name, image_path, folder_name) VALUES (?, ?, ?)",
-                           (name, image_path, folder_name))
-            conn.commit()
-            flash('Категория успешно добавлена', 'success')
-        finally:
-            if conn:
-                conn.close()
-
+            with get_db_connection() as conn:
+                image_path = staged.save(request.files.get('image'))
+                folder_name = FileService.allocate_folder_name(conn)
+                cursor = conn.cursor()
+                shop_db.add_category(cursor, name, image_path, folder_name)
+                staged.schedule(cursor)
+                os.makedirs(os.path.join(Config.UPLOAD_FOLDER, folder_name), exist_ok=True)
+        except Exception:
+            staged.rollback()
+            raise
+        staged.commit()
+        flash('Категория успешно добавлена', 'success')
         return redirect(url_for('home'))
 
     currencies = DatabaseService.get_currencies()
@@ -824,43 +1523,41 @@ def add_category():
 @app.route('/edit_category/<int:category_id>', methods=['GET', 'POST'])
 @handle_errors
 def edit_category(category_id):
-    category = DatabaseService.get_category_by_id(category_id)
-    if not category:
-        flash('Категория не найдена', 'error')
-        return redirect(url_for('home'))
-
-    if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-
-        if not name or any(c in name for c in '<>:"/\\|?*'):
-            flash('Недопустимое название категории', 'error')
-            return redirect(url_for('edit_category', category_id=category_id))
+    with get_db_connection() as conn:
+        category = DatabaseService.get_category_by_id(category_id, conn)
+        if not category:
+            flash('Категория не найдена', 'error')
+            return redirect(url_for('home'))
 
-        image_path = category['image_path']
+        if request.method == 'POST':
+            name = request.form.get('name', '').strip()
 
-        if 'image' in request.files and request.files['image'].filename:
-            if image_path:
-                FileService.delete_file_safe(image_path)
-            folder_name = category['folder_name']
-            category_path = os.path.join('uploads', folder_name)
-            os.makedirs(os.path.join('static', category_path), exist_ok=True)
-            image_path = FileService.save_uploaded_file(request.files['image'], category_path)
+            if not name or any(c in name for c in '<>:"/\\|?*'):
+                flash('Недопустимое название категории', 'error')
+                return redirect(url_for('edit_category', category_id=category_id))
 
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE categories SET name = ?, image_path = ? WHERE id = ?",
-                           (name, image_path, category_id))
-            conn.commit()
+            image_path = category['image_path']
+            staged = StagedFiles()
+            try:
+                if 'image' in request.files and request.files['image'].filename:
+                    new_image_path = staged.save(request.files['image'])
+                    if new_image_path and new_image_path != image_path:
+                        staged.delete_on_commit(image_path)
+                        image_path = new_image_path
+
+                cursor = conn.cursor()
+                shop_db.update_category(cursor, category_id, name, image_path)
+                staged.schedule(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                staged.rollback()
+                raise
+            staged.commit()
             flash('Категория успешно обновлена', 'success')
-        finally:
-            if conn:
-                conn.close()
-
-        return redirect(url_for('home'))
+            return redirect(url_for('home'))
 
-    currencies = DatabaseService.get_currencies()
+        currencies = DatabaseService.get_currencies(conn)
     selected_currency = session.get('currency', 'RUB')
     return render_template('edit_category.html',
                            category=category,
@@ -871,79 +1568,111 @@ def edit_category(category_id):
 @app.route('/add_item', methods=['GET', 'POST'])
 @handle_errors
 def add_item():
-    if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        category_id = request.form.get('category_id')
-        description = request.form.get('description', '').strip()
-        sizes = request.form.get('sizes', '').strip()
-        stock_quantity = request.form.get('stock_quantity', 0)
-        if not name or not category_id or not sizes:
-            flash('Заполните все обязательные поля', 'error')
-            return redirect(url_for('add_item'))
-        try:
-            category_id = int(category_id)
-            stock_quantity = int(stock_quantity)
-        except ValueError:
-            flash('Некорректные данные', 'error')
-            return redirect(url_for('add_item'))
-        category = DatabaseService.get_category_by_id(category_id)
-        if not category:
-            flash('Выбранная категория не существует', 'error')
-            return redirect(url_for('add_item'))
-        category_folder = category['folder_name']
-        if not category_folder:
-            flash('Ошибка: у категории нет папки для файлов', 'error')
-            return redirect(url_for('add_item'))
-        category_path = os.path.join('uploads', category_folder)
-        os.makedirs(os.path.join('static', category_path), exist_ok=True)
-        conn = None
-        try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO items (category_id, name, description, sizes, stock_quantity) VALUES (?, ?, ?, ?, ?)",
-                (category_id, name, description, sizes, stock_quantity)
-            )
-            item_id = cursor.lastrowid
-            currencies = DatabaseService.get_currencies()
-            for currency in currencies:
-                price_field = f'price_{currency[1].lower()}'  # Соответствует шаблону
-                price = request.form.get(price_field)
-                if price:
-                    try:
-                        price = float(price)
-                        cursor.execute(
-                            "INSERT INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
-                            (item_id, currency[0], price)  # currency[0] — ID валюты
-                        )
-                    except ValueError:
-                        logger.warning(f"Invalid price for currency {currency[1]}: {price}")
-            uploaded_files = request.files.getlist('images')
-            primary_image_index = request.form.get('primary_image', '0')
+    with get_db_connection() as conn:
+        if request.method == 'POST':
+            name = request.form.get('name', '').strip()
+            category_id = request.form.get('category_id')
+            description = request.form.get('description', '').strip()
+            sizes = request.form.get('sizes', '').strip()
+            stock_quantity = request.form.get('stock_quantity', 0)
+            if not name or not category_id or not sizes:
+                flash('Заполните все обязательные поля', 'error')
+                return redirect(url_for('add_item'))
             try:
-                primary_image_index = int(primary_image_index)
-            except (ValueError, TypeError):
-                primary_image_index = 0
-            for i, file in enumerate(uploaded_files):
-                if file and file.filename and allowed_file(file.filename):
-                    relative_path = FileService.save_uploaded_file(file, category_path)
-                    is_primary = (i == primary_image_index)
-                    cursor.execute(
-                        "INSERT INTO item_images (item_id, image_path, is_primary) VALUES (?, ?, ?)",
-                        (item_id, relative_path, is_primary)
-                    )
-            conn.commit()
+                category_id = int(category_id)
+                stock_quantity = int(stock_quantity)
+            except ValueError:
+                flash('Некорректные данные', 'error')
+                return redirect(url_for('add_item'))
+            category = DatabaseService.get_category_by_id(category_id, conn)
+            if not category:
+                flash('Выбранная категория не существует', 'error')
+                return redirect(url_for('add_item'))
+
+            staged = StagedFiles()
+            try:
+                # Файлы сохраняются до начала записи, чтобы не держать блокировку БД
+                images = stage_item_images(staged)
+                cursor = conn.cursor()
+                item_id = shop_db.add_item(cursor, category_id, name, description, sizes, stock_quantity)
+
+                prices = {}
+                for currency in DatabaseService.get_currencies(conn):
+                    price = request.form.get(f'price_{currency["name"].lower()}')  # Соответствует шаблону
+                    if price:
+                        try:
+                            prices[currency['id']] = float(price)
+                        except ValueError:
+                            logger.warning("Invalid price for currency %s: %s", currency['name'], price)
+                shop_db.set_item_prices(cursor, item_id, prices)
+                shop_db.add_item_images(cursor, item_id, images)
+                staged.schedule(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                staged.rollback()
+                raise
+            staged.commit()
+
             flash('Товар успешно добавлен!', 'success')
             return redirect(url_for('home'))
-        finally:
-            if conn:
-                conn.close()
-    categories = DatabaseService.get_categories()
-    currencies = DatabaseService.get_currencies()
+
+        categories = DatabaseService.get_categories(conn)
+        currencies = DatabaseService.get_currencies(conn)
     selected_currency = session.get('currency', 'RUB')
     return render_template('add_item.html', categories=categories, currencies=currencies, selected_currency=selected_currency)
 
 
+@app.route('/upload', methods=['POST'])
+def upload_image():
+    """Потоковая загрузка одного изображения (тело запроса — содержимое файла).
+
+    Админка загружает файлы параллельно и передает полученные пути в форму
+    товара полем uploaded_images.
+    """
+    upload_id = request.args.get('upload_id') or uuid.uuid4().hex
+    filename = request.args.get('filename', '')
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify(error='Некорректный upload_id'), 400
+    if not allowed_file(filename):
+        return jsonify(error='Недопустимый тип файла'), 400
+    if request.content_length and request.content_length > Config.MAX_UPLOAD_SIZE:
+        return jsonify(error='Файл слишком большой'), 413
+
+    try:
+        relative_path, created = FileService.store_stream(request.stream, filename, upload_id)
+    except FileExistsError:
+        return jsonify(error='Загрузка с таким upload_id уже идет'), 409
+    except UploadError as e:
+        logger.warning("Upload %s rejected: %s", upload_id, e)
+        FileService.write_upload_status(upload_id, status='failed', error=str(e))
+        return jsonify(error=str(e)), 400
+
+    if created:
+        with get_db_connection() as conn:
+            jobs.enqueue(conn.cursor(), 'make_thumbnail', {'path': relative_path})
+        job_runner.notify()
+    FileService.write_upload_status(upload_id, status='done', path=relative_path)
+    return jsonify(upload_id=upload_id, path=relative_path)
+
+
+@app.route('/upload/<upload_id>')
+def upload_progress(upload_id):
+    """Прогресс загрузки: размер временного файла на диске, поэтому работает с любым воркером"""
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify(error='Некорректный upload_id'), 400
+    part_path = FileService.incoming_path(upload_id)
+    status_path = FileService.upload_status_path(upload_id)
+    if os.path.exists(status_path):
+        with open(status_path, encoding='utf-8') as f:
+            return jsonify(upload_id=upload_id, **json.load(f))
+    try:
+        received = os.path.getsize(part_path)
+    except OSError:
+        return jsonify(upload_id=upload_id, status='unknown', received=0), 404
+    return jsonify(upload_id=upload_id, status='uploading', received=received)
+
+
 @app.route('/about')
 @handle_errors
 def about():
@@ -961,18 +1690,211 @@ def set_currency(code):
 
 @app.route('/manage_bans')
 def manage_bans():
-    cursors = get_db_connection.cursor()
-    cursors.execute('SELECT user_id, banned_at FROM banned_users')
-    banned_users = cursors.fetchall()
-    cursors.execute('SELECT id, name FROM items WHERE is_blocked = 1')
-    blocked_items = cursors.fetchall()
+    with use_connection() as conn:
+        cursor = conn.cursor()
+        banned_users = shop_db.get_banned_users(cursor)
+        blocked_items = shop_db.get_blocked_items(cursor)
     return render_template('manage_bans.html', banned_users=banned_users, blocked_items=blocked_items)
 
+@app.route('/import_catalog', methods=['GET', 'POST'])
+@handle_errors
+def import_catalog():
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Выберите файл для импорта', 'error')
+            return redirect(url_for('import_catalog'))
+
+        fmt = request.form.get('format') or catalog_io.detect_format(file.filename)
+        # Импорт идет заданием в фоне: запрос только сохраняет файл и ставит задание в очередь
+        os.makedirs(Config.IMPORT_FOLDER, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=Config.IMPORT_FOLDER, suffix=f'.{fmt}')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(file.stream, out, Config.UPLOAD_CHUNK_SIZE)
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                import_id = catalog_io.create_import(cursor, file.filename)
+                jobs.enqueue(cursor, 'import_catalog', {'import_id': import_id, 'path': path, 'format': fmt})
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            raise
+        job_runner.notify()
+        flash(f"Импорт №{import_id} поставлен в очередь, его ход виден на этой странице", 'success')
+        return redirect(url_for('import_catalog'))
+
+    with use_connection() as conn:
+        currencies = DatabaseService.get_currencies(conn)
+        imports = catalog_io.recent_imports(conn.cursor())
+    selected_currency = session.get('currency', 'RUB')
+    return render_template('import_catalog.html',
+                           currencies=currencies,
+                           selected_currency=selected_currency,
+                           imports=imports)
+
+
+@app.route('/export_catalog')
+def export_catalog():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        fmt = 'csv'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(catalog_io.iter_export(fmt, Config.DATABASE_PATH)),
+                    mimetype=f'{mimetype}; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'})
+
+
+def get_api_page_params(args):
+    try:
+        limit = min(max(int(args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+        after = int(args.get('after', 0))
+    except ValueError:
+        limit, after = API_DEFAULT_LIMIT, 0
+    return after, limit
+
+
+def get_api_fields(args, allowed):
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip() in allowed]
+    return fields or list(allowed)
+
+
+def select_fields(row, fields):
+    return {field: row[field] for field in fields}
+
+
+def api_version_etag(cursor, key):
+    """Версия каталога и ETag ответа API: меняется вместе с версией"""
+    version = shop_db.get_catalog_version(cursor)
+    return version, hashlib.sha256(f"{version}:{key}".encode()).hexdigest()[:32]
+
+
+def cached_api_response(builder, *args):
+    """Отдает JSON из кэша каталога с ETag; при совпадении If-None-Match — 304.
+
+    builder(cursor, *args) строит данные ответа; та же функция используется в admin_asgi.
+    """
+    key = request.full_path
+    with use_connection() as conn:
+        cursor = conn.cursor()
+        version, etag = api_version_etag(cursor, key)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            payload = catalog_cache.get(key, version, lambda: builder(cursor, *args))
+            if payload is None:
+                return jsonify(error='Не найдено'), 404
+            response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def categories_payload(cursor, after, limit, fields):
+    rows = shop_db.get_categories_page(cursor, after, limit + 1)
+    return {
+        'data': [select_fields(row, fields) for row in rows[:limit]],
+        'next_cursor': rows[limit - 1]['id'] if len(rows) > limit else None,
+    }
+
+
+def category_items_payload(cursor, category_id, currency, after, limit, fields):
+    if not shop_db.get_category(cursor, category_id):
+        return None
+    rows = shop_db.get_items_page(cursor, category_id, currency, after, limit + 1)
+    return {
+        'data': [select_fields(api_item(row, currency), fields) for row in rows[:limit]],
+        'next_cursor': rows[limit - 1]['id'] if len(rows) > limit else None,
+    }
+
+
+def item_payload(cursor, item_id, currency, fields):
+    row = shop_db.get_item_details(cursor, item_id, currency)
+    return select_fields(api_item(row, currency), fields) if row else None
+
+
 @app.route('/api/categories')
 def api_categories():
-    """API endpoint для получения категорий"""
-    categories = DatabaseService.get_categories()
-    return jsonify([dict(cat) for cat in categories])
+    """API endpoint для получения категорий (keyset-пагинация по id)"""
+    after, limit = get_api_page_params(request.args)
+    return cached_api_response(categories_payload, after, limit, get_api_fields(request.args, API_CATEGORY_FIELDS))
+
+
+@app.route('/api/categories/<int:category_id>/items')
+def api_category_items(category_id):
+    """API endpoint для товаров категории (keyset-пагинация по id)"""
+    after, limit = get_api_page_params(request.args)
+    currency = request.args.get('currency', 'RUB').upper()
+    return cached_api_response(category_items_payload, category_id, currency, after, limit,
+                               get_api_fields(request.args, API_ITEM_FIELDS))
+
+
+@app.route('/api/items/<int:item_id>')
+def api_item_details(item_id):
+    """API endpoint для одного товара"""
+    currency = request.args.get('currency', 'RUB').upper()
+    return cached_api_response(item_payload, item_id, currency, get_api_fields(request.args, API_ITEM_FIELDS))
+
+
+def api_item(row, currency):
+    item = dict(row)
+    item['sizes'] = [size.strip() for size in (item['sizes'] or '').split(',') if size.strip()]
+    item['images'] = item['images'].split(';') if item['images'] else []
+    item['currency'] = currency
+    return item
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics_registry.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+metrics_registry.gauge('admin_catalog_cache_entries', 'Entries in the catalog cache',
+                       lambda: len(catalog_cache.entries))
+
+
+@app.cli.command('precompress-static')
+def precompress_static():
+    """Создает .gz (и .br, если установлен brotli) рядом с CSS/JS в static"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    count = 0
+    for root, _, files in os.walk(app.static_folder):
+        for filename in files:
+            if not filename.endswith(PRECOMPRESSED_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9))
+            if brotli:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+            count += 1
+    logger.info(f"Precompressed {count} static files")
+
+
+@app.cli.command('refresh-rates')
+@click.option('--url', help='JSON с курсами по HTTP')
+@click.option('--file', 'path', help='JSON с курсами из файла')
+@click.option('--min-interval', default=0, help='не обновлять, если курсы обновлялись раньше, секунд')
+def refresh_rates(url, path, min_interval):
+    """Обновляет курсы валют; цены, выведенные из курса, меняются сразу"""
+    source = rates.source_from_config(url or os.getenv('RATES_URL'), path or os.getenv('RATES_FILE'))
+    if source is None:
+        raise click.UsageError('Укажите --url или --file (или RATES_URL / RATES_FILE)')
+    try:
+        changed = rates.refresh_rates(source, Config.DATABASE_PATH, min_interval)
+    except rates.RateSourceError as e:
+        raise click.ClickException(str(e))
+    if changed is None:
+        logger.info("Exchange rates were refreshed recently, skipped")
+    elif not changed:
+        logger.info("Exchange rates are unchanged")
 
 
 # Обработчик ошибок
@@ -999,6 +1921,7 @@ def internal_error(error):
 
 
 if __name__ == '__main__':
-    init_db()
-    create_placeholder_if_needed()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Сервер разработки; в продакшене — gunicorn -c gunicorn.conf.py
+    prepare_startup()
+    job_runner.start()
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
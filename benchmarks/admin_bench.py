@@ -0,0 +1,232 @@
+"""Бенчмарк админки: задержка и память основных страниц на каталогах разного размера.
+
+Для каждой точки сетки (товаров в категории x изображений у товара)
+отдельный процесс создает каталог во временной папке и гоняет через
+тестовый клиент Flask: главную, категорию, edit_item GET/POST и add_item
+с загрузкой изображений. Память — пик tracemalloc за один запрос.
+
+    python benchmarks/admin_bench.py --items 10,100,1000 --images 1,5
+    python benchmarks/admin_bench.py --baseline benchmarks/results/admin_bench-1c759b1-20261019-120000.json
+
+С --baseline скрипт завершается с ошибкой, если медиана задержки или пик
+памяти какого-либо сценария выросли больше чем на --max-regression.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(REPO_PATH, 'benchmarks', 'results')
+CATEGORIES = 3
+IMAGE_SIZE = 32 * 1024
+SCENARIOS = ('home', 'category', 'edit_item_get', 'edit_item_post', 'add_item')
+
+
+def create_catalog(items_per_category, images_per_item):
+    conn = sqlite3.connect('shop.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM currencies WHERE rate = 1")
+    base_currency_id = cursor.fetchone()[0]
+    for category_id in range(1, CATEGORIES + 1):
+        cursor.execute("INSERT INTO categories (id, name, folder_name) VALUES (?, ?, ?)",
+                       (category_id, f'Категория {category_id}', f'ct{category_id}'))
+        for number in range(items_per_category):
+            cursor.execute("INSERT INTO items (category_id, name, description, sizes, stock_quantity) "
+                           "VALUES (?, ?, 'Описание товара', 'S,M,L,XL', 10)",
+                           (category_id, f'Товар {category_id}-{number}'))
+            item_id = cursor.lastrowid
+            cursor.execute("INSERT INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
+                           (item_id, base_currency_id, 1000 + number))
+            cursor.executemany(
+                "INSERT INTO item_images (item_id, image_path, is_primary) VALUES (?, ?, ?)",
+                [(item_id, f'uploads/ct{category_id}/item{item_id}_{image}.jpg', int(image == 0))
+                 for image in range(images_per_item)]
+            )
+    conn.commit()
+    cursor.execute("SELECT id, name FROM currencies")
+    currencies = cursor.fetchall()
+    cursor.execute("SELECT MIN(id) FROM items WHERE category_id = 1")
+    item_id = cursor.fetchone()[0]
+    conn.close()
+    return currencies, base_currency_id, item_id
+
+
+def image_file(rng):
+    """Уникальный JPEG, чтобы загрузки не схлопывались дедупликацией"""
+    import io
+    return io.BytesIO(b'\xff\xd8\xff\xe0' + rng.randbytes(IMAGE_SIZE)), f'photo{rng.randrange(10 ** 9)}.jpg'
+
+
+def requests_for(currencies, base_currency_id, item_id, images_per_item, rng):
+    """Сценарий -> функция, выполняющая один запрос через тестовый клиент"""
+    item_form = {'name': 'Товар', 'category_id': '1', 'description': 'Описание', 'sizes': 'S,M,L',
+                 'stock_quantity': '5'}
+
+    def edit_item_post(client):
+        form = dict(item_form, **{f'price_{currency_id}': '' for currency_id, _ in currencies})
+        form[f'price_{base_currency_id}'] = '1500'
+        return client.post(f'/edit_item/{item_id}', data=form)
+
+    def add_item(client):
+        form = dict(item_form, price_rub='1500')
+        form['images'] = [image_file(rng) for _ in range(images_per_item)]
+        return client.post('/add_item', data=form, content_type='multipart/form-data')
+
+    return {
+        'home': lambda client: client.get('/'),
+        'category': lambda client: client.get('/category/1'),
+        'edit_item_get': lambda client: client.get(f'/edit_item/{item_id}'),
+        'edit_item_post': edit_item_post,
+        'add_item': add_item,
+    }
+
+
+def measure(items_per_category, images_per_item, repeat):
+    """Одна точка сетки; запускается в отдельном процессе (см. main)"""
+    sys.path.insert(0, REPO_PATH)
+    import app as admin
+    import logging
+    logging.disable(logging.INFO)
+
+    admin.init_db()
+    currencies, base_currency_id, item_id = create_catalog(items_per_category, images_per_item)
+    rng = random.Random(1)
+    scenarios = requests_for(currencies, base_currency_id, item_id, images_per_item, rng)
+    client = admin.app.test_client()
+
+    results = {}
+    for name in SCENARIOS:
+        run = scenarios[name]
+        response = run(client)  # прогрев: кэши каталога, шаблоны
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} returned {response.status_code}")
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run(client)
+            durations.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        peaks = []
+        for _ in range(max(3, repeat // 5)):
+            tracemalloc.reset_peak()
+            run(client)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        durations.sort()
+        results[name] = {
+            'p50_ms': round(statistics.median(durations) * 1000, 2),
+            'p95_ms': round(durations[min(len(durations) - 1, int(0.95 * len(durations)))] * 1000, 2),
+            'peak_kib': round(statistics.median(peaks) / 1024, 1),
+        }
+    admin.upload_executor.shutdown(wait=True)
+    return results
+
+
+def run_point(items_per_category, images_per_item, repeat):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', str(items_per_category), str(images_per_item),
+             '--repeat', str(repeat)],
+            cwd=workdir, capture_output=True, text=True
+        )
+    if output.returncode:
+        raise RuntimeError(f"Benchmark for {items_per_category} items x {images_per_item} images failed:\n"
+                           f"{output.stderr}")
+    return json.loads(output.stdout)
+
+
+def regressions(report, baseline, max_regression):
+    """Сценарии, у которых медиана задержки или пик памяти выросли сильнее порога"""
+    previous_points = {(point['items'], point['images']): point for point in baseline['points']}
+    found = []
+    for point in report['points']:
+        previous = previous_points.get((point['items'], point['images']))
+        if not previous:
+            continue
+        for name, current in point['scenarios'].items():
+            old = previous['scenarios'].get(name)
+            if not old:
+                continue
+            for metric in ('p50_ms', 'peak_kib'):
+                if old[metric] and current[metric] > old[metric] * (1 + max_regression):
+                    found.append(f"{name} @ {point['items']} items x {point['images']} images: "
+                                 f"{metric} {old[metric]} -> {current[metric]}")
+    return found
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Задержка и память страниц админки')
+    parser.add_argument('--items', type=parse_sizes, default=[10, 100, 1000], help='товаров в категории')
+    parser.add_argument('--images', type=parse_sizes, default=[1, 5], help='изображений у товара')
+    parser.add_argument('--repeat', type=int, default=20, help='запросов на сценарий')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию benchmarks/results/)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для проверки регрессий')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='допустимый рост медианы задержки и пика памяти (0.25 = 25%%)')
+    parser.add_argument('--worker', nargs=2, type=int, metavar=('ITEMS', 'IMAGES'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(measure(*args.worker, args.repeat)))
+        return 0
+
+    points = []
+    for items_per_category in args.items:
+        for images_per_item in args.images:
+            scenarios = run_point(items_per_category, images_per_item, args.repeat)
+            points.append({'items': items_per_category, 'images': images_per_item, 'scenarios': scenarios})
+            print(f"{items_per_category:>6} items x {images_per_item} images: " +
+                  ', '.join(f"{name} {result['p50_ms']}ms/{result['peak_kib']}KiB"
+                            for name, result in scenarios.items()), file=sys.stderr)
+
+    revision = git_revision()
+    timestamp = datetime.now()
+    report = {
+        'revision': revision,
+        'timestamp': timestamp.isoformat(timespec='seconds'),
+        'repeat': args.repeat,
+        'points': points,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        output = os.path.join(RESULTS_PATH, f"admin_bench-{revision}-{timestamp:%Y%m%d-%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Saved to {output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print(f"Regression: {line}", file=sys.stderr)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
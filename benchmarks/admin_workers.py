@@ -0,0 +1,219 @@
+"""Сравнение моделей воркеров gunicorn на типичной смеси страниц админки.
+
+Для каждой модели (sync, gthread и gevent, если установлен) поднимается
+gunicorn с gunicorn.conf.py на одном и том же временном каталоге, после чего
+параллельные клиенты в течение --duration секунд запрашивают страницы в
+пропорции PAGE_MIX: главная, категория, edit_item GET и POST.
+
+    python benchmarks/admin_workers.py
+    python benchmarks/admin_workers.py --models sync,gthread --workers 2 --threads 8 --concurrency 32
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from admin_bench import RESULTS_PATH, git_revision
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ('sync', 'gthread', 'gevent')
+PAGE_MIX = {'home': 30, 'category': 40, 'edit_item_get': 20, 'edit_item_post': 10}
+
+
+def prepare_catalog(workdir, items_per_category, images_per_item):
+    """Схема и каталог создаются заранее в отдельном процессе, как при обычном перезапуске"""
+    script = (f'import sys, json; sys.path[:0] = [{REPO_PATH!r}, {os.path.dirname(__file__)!r}]; '
+              f'import app; from admin_bench import create_catalog; app.prepare_startup(); '
+              f'print(json.dumps(create_catalog({items_per_category}, {images_per_item})))')
+    output = subprocess.run([sys.executable, '-c', script], cwd=workdir, capture_output=True, text=True,
+                            env=dict(os.environ, LOG_LEVEL='WARNING'))
+    if output.returncode:
+        raise RuntimeError(f"Catalog setup failed:\n{output.stderr}")
+    currencies, base_currency_id, item_id = json.loads(output.stdout.splitlines()[-1])
+    return currencies, base_currency_id, item_id
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(model, workdir, args):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_PATH, ADMIN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKER_CLASS=model,
+               GUNICORN_WORKERS=str(args.workers), GUNICORN_THREADS=str(args.threads),
+               GUNICORN_WORKER_CONNECTIONS=str(args.concurrency), LOG_LEVEL='WARNING')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_PATH, 'gunicorn.conf.py')],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn ({model}) exited:\n{process.stderr.read()}")
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({model}) did not start in time")
+
+
+def page_requests(base_url, currencies, base_currency_id, item_id):
+    """Страница смеси -> urllib.request.Request"""
+    form = {'name': 'Товар', 'category_id': '1', 'description': 'Описание', 'sizes': 'S,M,L',
+            'stock_quantity': '5', **{f'price_{currency_id}': '' for currency_id, _ in currencies}}
+    form[f'price_{base_currency_id}'] = '1500'
+    return {
+        'home': lambda: urllib.request.Request(base_url + '/'),
+        'category': lambda: urllib.request.Request(base_url + '/category/1'),
+        'edit_item_get': lambda: urllib.request.Request(f'{base_url}/edit_item/{item_id}'),
+        'edit_item_post': lambda: urllib.request.Request(f'{base_url}/edit_item/{item_id}',
+                                                         data=urllib.parse.urlencode(form).encode()),
+    }
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Редирект после POST — это успешный ответ, переходить по нему не нужно
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def run_load(requests, duration, concurrency, seed):
+    opener = urllib.request.build_opener(NoRedirect)
+    pages = list(PAGE_MIX)
+    weights = [PAGE_MIX[page] for page in pages]
+    durations = {page: [] for page in pages}
+    errors = []
+    stop_at = time.monotonic() + duration
+
+    def client(number):
+        rng = random.Random(seed + number)
+        while time.monotonic() < stop_at:
+            page = rng.choices(pages, weights)[0]
+            started = time.perf_counter()
+            try:
+                opener.open(requests[page](), timeout=30).read()
+            except urllib.error.HTTPError as e:
+                if e.code >= 400:
+                    errors.append(f'{page}: {e.code}')
+                    continue
+            except OSError as e:
+                errors.append(f'{page}: {e}')
+                continue
+            durations[page].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return durations, errors, elapsed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(durations, errors, elapsed):
+    everything = sorted(value for values in durations.values() for value in values)
+    if not everything:
+        return {'requests': 0, 'errors': len(errors), 'error_samples': errors[:5]}
+    summary = {
+        'requests': len(everything),
+        'errors': len(errors),
+        'rps': round(len(everything) / elapsed, 1),
+        'p50_ms': round(statistics.median(everything) * 1000, 1),
+        'p95_ms': round(percentile(everything, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(everything, 0.99) * 1000, 1),
+        'pages': {page: round(statistics.median(values) * 1000, 1) for page, values in durations.items() if values},
+    }
+    if errors:
+        summary['error_samples'] = errors[:5]
+    return summary
+
+
+def available_models(requested):
+    models = []
+    for model in requested:
+        if model == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print("gevent is not installed, skipping", file=sys.stderr)
+            continue
+        models.append(model)
+    return models
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Модели воркеров gunicorn на смеси страниц админки')
+    parser.add_argument('--models', default=','.join(MODELS), help='через запятую: sync, gthread, gevent')
+    parser.add_argument('--workers', type=int, default=2, help='процессов gunicorn')
+    parser.add_argument('--threads', type=int, default=4, help='потоков воркера gthread')
+    parser.add_argument('--concurrency', type=int, default=16, help='одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='секунд нагрузки на модель')
+    parser.add_argument('--items', type=int, default=100, help='товаров в категории')
+    parser.add_argument('--images', type=int, default=3, help='изображений у товара')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию benchmarks/results/)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as catalog_dir:
+        catalog = prepare_catalog(catalog_dir, args.items, args.images)
+        for model in available_models([model for model in args.models.split(',') if model]):
+            # Каждая модель начинает с одинаковой копии каталога: POST не накапливают изменения
+            with tempfile.TemporaryDirectory() as workdir:
+                shutil.copy(os.path.join(catalog_dir, 'shop.db'), workdir)
+                process, base_url = start_gunicorn(model, workdir, args)
+                try:
+                    durations, errors, elapsed = run_load(page_requests(base_url, *catalog), args.duration,
+                                                          args.concurrency, seed=1)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+            results[model] = summarize(durations, errors, elapsed)
+            print(f"{model:>8}: {results[model].get('rps', 0)} req/s, p95 {results[model].get('p95_ms')}ms, "
+                  f"{results[model]['errors']} errors", file=sys.stderr)
+
+    revision = git_revision()
+    timestamp = datetime.now()
+    report = {
+        'revision': revision,
+        'timestamp': timestamp.isoformat(timespec='seconds'),
+        'workers': args.workers,
+        'threads': args.threads,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'catalog': {'items': args.items, 'images': args.images},
+        'page_mix': PAGE_MIX,
+        'models': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        output = os.path.join(RESULTS_PATH, f"admin_workers-{revision}-{timestamp:%Y%m%d-%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report['models'], indent=2))
+    print(f"Saved to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""Нагрузочный тест бота против локального поддельного Bot API.
+
+Создает во временной папке синтетический каталог (категории, товары,
+изображения, валюты), запускает диспетчер bochka.py с настоящей
+aiohttp-сессией, направленной на FakeBotApiServer, и прогоняет
+одновременных пользователей: /start -> каталог -> категория -> товар ->
+размер (в корзину) -> корзина -> оформление -> подтверждение.
+
+Отчет: пропускная способность, p50/p95/p99 по обработчикам, обращения к
+Bot API и ожидание блокировок SQLite. Результат сохраняется в JSON, чтобы
+сравнивать прогоны между коммитами:
+
+    python benchmarks/bot_load.py --users 50 --latency 0.03
+    python benchmarks/bot_load.py --admin-writes 5 --admin-hold 0.02  # с конкурирующими записями админки
+    python benchmarks/bot_load.py --compare benchmarks/results/bot_load-1c759b1-20261019-120000.json
+
+Ожидание блокировок SQLite измеряется так: соединения процесса открываются
+с timeout=0, а «database is locked» ожидает и повторяет сам LockProbe — так
+же, как встроенный обработчик занятости, но с замером времени.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from fake_bot_api import BENCH_BOT_TOKEN, FakeBotApiServer
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(REPO_PATH, 'benchmarks', 'results')
+JPEG_STUB = b'\xff\xd8\xff\xe0' + b'\x00' * 64
+SIZES = ('S', 'M', 'L', 'XL')
+FIRST_USER_ID = 100000
+BUSY_TIMEOUT = 5.0  # как timeout по умолчанию в sqlite3.connect
+BUSY_RETRY_INTERVAL = 0.001
+
+
+def is_locked(error):
+    return 'locked' in str(error)
+
+
+class LockProbe:
+    """Ожидание блокировок во всех соединениях процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.waits = []
+
+    def call(self, operation, *args):
+        with self.lock:
+            self.statements += 1
+        try:
+            return operation(*args)
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+        started = time.perf_counter()
+        while True:
+            time.sleep(BUSY_RETRY_INTERVAL)
+            try:
+                result = operation(*args)
+            except sqlite3.OperationalError as e:
+                if is_locked(e) and time.perf_counter() - started < BUSY_TIMEOUT:
+                    continue
+                self.record(time.perf_counter() - started)
+                raise
+            self.record(time.perf_counter() - started)
+            return result
+
+    def record(self, elapsed):
+        with self.lock:
+            self.waits.append(elapsed)
+
+    def connection_factory(self):
+        probe = self
+
+        class ProbeCursor(sqlite3.Cursor):
+            def execute(self, sql, parameters=()):
+                return probe.call(sqlite3.Cursor.execute, self, sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return probe.call(sqlite3.Cursor.executemany, self, sql, list(seq_of_parameters))
+
+        class ProbeConnection(sqlite3.Connection):
+            def __init__(self, *args, **kwargs):
+                kwargs['timeout'] = 0
+                super().__init__(*args, **kwargs)
+
+            def cursor(self, factory=ProbeCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return self.cursor().executemany(sql, seq_of_parameters)
+
+            def commit(self):
+                return probe.call(sqlite3.Connection.commit, self)
+
+        return ProbeConnection
+
+    def report(self):
+        waits = sorted(self.waits)
+        return {
+            'statements': self.statements,
+            'waits': len(waits),
+            'total_wait_ms': round(sum(waits, 0.0) * 1000, 1),
+            'p95_wait_ms': round(percentile(waits, 0.95) * 1000, 1) if waits else 0.0,
+            'max_wait_ms': round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+def create_catalog(categories, items, images, currencies):
+    """N категорий, M товаров поровну между ними, K изображений у товара, C валют"""
+    conn = sqlite3.connect('shop.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM currencies")
+    for number in range(cursor.fetchone()[0], currencies):
+        cursor.execute("INSERT INTO currencies (name, rate) VALUES (?, ?)",
+                       (f'C{number:02d}', round(0.5 + number * 0.25, 4)))
+    cursor.execute("SELECT id FROM currencies WHERE rate = 1")
+    base_currency_id = cursor.fetchone()[0]
+
+    catalog = {}
+    paths = []
+    for category_id in range(1, categories + 1):
+        folder = f'ct{category_id}'
+        os.makedirs(os.path.join('static', 'uploads', folder), exist_ok=True)
+        image_path = f'uploads/{folder}/category.jpg'
+        paths.append(image_path)
+        cursor.execute("INSERT INTO categories (id, name, image_path, folder_name) VALUES (?, ?, ?, ?)",
+                       (category_id, f'Категория {category_id}', image_path, folder))
+        catalog[category_id] = []
+    for number in range(items):
+        category_id = number % categories + 1
+        cursor.execute("INSERT INTO items (category_id, name, description, sizes, stock_quantity) "
+                       "VALUES (?, ?, 'Синтетический товар', ?, 100)",
+                       (category_id, f'Товар {number}', ','.join(SIZES)))
+        item_id = cursor.lastrowid
+        catalog[category_id].append(item_id)
+        # Явная цена только в базовой валюте, остальные выводятся из курса
+        cursor.execute("INSERT INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
+                       (item_id, base_currency_id, 500 + number % 50 * 100))
+        for image_number in range(images):
+            path = f'uploads/ct{category_id}/item{item_id}_{image_number}.jpg'
+            cursor.execute("INSERT INTO item_images (item_id, image_path) VALUES (?, ?)", (item_id, path))
+            paths.append(path)
+    conn.commit()
+    conn.close()
+    for path in paths:
+        with open(os.path.join('static', path), 'wb') as f:
+            f.write(JPEG_STUB)
+    return {category_id: item_ids for category_id, item_ids in catalog.items() if item_ids}
+
+
+def admin_writer(stop, writes_per_second, hold, item_count, connect):
+    """Имитация админки: короткие транзакции записи, меняющие каталог"""
+    rng = random.Random(1)
+    while not stop.wait(1 / writes_per_second):
+        conn = connect('shop.db', timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE items SET stock_quantity = stock_quantity WHERE id = ?",
+                         (rng.randint(1, item_count),))
+            time.sleep(hold)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+def user_route(rng, catalog):
+    """Шаги одного покупателя: список данных callback (None — команда /start)"""
+    category_id = rng.choice(list(catalog))
+    items = catalog[category_id]
+    route = [None, 'catalog', f'category_{category_id}']
+    for _ in range(rng.randint(1, 3)):
+        item_id = rng.choice(items)
+        route += [f'item_{item_id}', f'size_{item_id}_{rng.choice(SIZES)}', f'category_{category_id}']
+    route += ['cart', 'checkout', 'confirm_order', 'main']
+    return route
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+
+def callback_update(update_id, user_id, data, message):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message,
+        },
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    durations = [sample['total'] for sample in samples]
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(durations) * 1000, 2),
+        'db_ms': round(statistics.fmean(sample['db'] for sample in samples) * 1000, 2),
+        'db_queries': round(statistics.fmean(sample['queries'] for sample in samples), 1),
+        'api_calls': round(statistics.fmean(sample['api'] for sample in samples), 1),
+    }
+
+
+async def run(args, server, connect):
+    import bochka
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+
+    bochka.init_db()
+    catalog = create_catalog(args.categories, args.items, args.images, args.currencies)
+    stop = threading.Event()
+    writer = None
+    if args.admin_writes:
+        writer = threading.Thread(target=admin_writer, daemon=True,
+                                  args=(stop, args.admin_writes, args.admin_hold, args.items, connect))
+        writer.start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(server.base_url))
+    session.middleware(bochka.ApiMetricsMiddleware())
+    bochka.bot.session = session
+
+    samples = defaultdict(list)
+    errors = Counter()
+
+    async def probe_middleware(handler, event, data):
+        # Внутри MetricsMiddleware: current_update_stats уже заполняется для этого update
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            stats = bochka.current_update_stats.get()
+            samples[stats.handler].append({
+                'total': time.perf_counter() - started,
+                'db': stats.db_time,
+                'queries': stats.db_queries,
+                'api': len(stats.api_calls),
+            })
+
+    bochka.dp.update.outer_middleware(probe_middleware)
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def shopper(number):
+        rng = random.Random(args.seed + number)
+        user_id = FIRST_USER_ID + number
+        await asyncio.sleep(rng.uniform(0, args.ramp_up))
+        for data in user_route(rng, catalog):
+            if data is None:
+                update = message_update(next(update_ids), user_id, '/start')
+            else:
+                screen = server.last_screen.get(user_id)
+                update = callback_update(next(update_ids), user_id, data, screen)
+            try:
+                await bochka.dp.feed_update(bochka.bot, Update.model_validate(update, context={'bot': bochka.bot}))
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            if args.think:
+                await asyncio.sleep(rng.expovariate(1 / args.think))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(shopper(number) for number in range(args.users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await bochka.background_tasks.drain()
+    if writer:
+        writer.join()
+    await session.close()
+
+    updates = sum(len(handler_samples) for handler_samples in samples.values())
+    all_samples = [sample for handler_samples in samples.values() for sample in handler_samples]
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'updates': updates,
+        'throughput_ups': round(updates / elapsed, 1),
+        'overall': summarize(all_samples),
+        'handlers': {name: summarize(handler_samples) for name, handler_samples in sorted(samples.items())},
+        'api_calls': dict(sorted(server.calls.items())),
+        'errors': dict(errors),
+        'orders': count_orders(),
+    }
+
+
+def count_orders():
+    conn = sqlite3.connect('shop.db')
+    try:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(report, baseline_path):
+    """Печатает изменение p95 по обработчикам относительно сохраненного прогона"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"vs {baseline['revision']} ({baseline['timestamp']}): "
+          f"throughput {baseline['throughput_ups']} -> {report['throughput_ups']} updates/s", file=sys.stderr)
+    for name, current in report['handlers'].items():
+        previous = baseline['handlers'].get(name)
+        if previous:
+            change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            print(f"  {name:28} p95 {previous['p95_ms']:8.2f} -> {current['p95_ms']:8.2f} ms ({change:+.0f}%)",
+                  file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с поддельным Bot API')
+    parser.add_argument('--categories', type=int, default=20, help='категорий (N)')
+    parser.add_argument('--items', type=int, default=2000, help='товаров всего (M)')
+    parser.add_argument('--images', type=int, default=2, help='изображений у товара (K)')
+    parser.add_argument('--currencies', type=int, default=3, help='валют (C)')
+    parser.add_argument('--users', type=int, default=50, help='одновременных покупателей')
+    parser.add_argument('--latency', type=float, default=0.03, help='задержка ответа Bot API, секунд')
+    parser.add_argument('--think', type=float, default=0.0, help='средняя пауза пользователя между шагами, секунд')
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='пользователи начинают в течение, секунд')
+    parser.add_argument('--admin-writes', type=float, default=0.0, help='записей админки в секунду')
+    parser.add_argument('--admin-hold', type=float, default=0.01, help='сколько админка держит блокировку, секунд')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию benchmarks/results/)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_PATH)
+    os.environ['BOT_TOKEN'] = BENCH_BOT_TOKEN
+    os.environ['SLOW_UPDATE_THRESHOLD'] = os.environ.get('SLOW_UPDATE_THRESHOLD', '10')
+    output = os.path.abspath(args.output) if args.output else None
+
+    probe = LockProbe()
+    connect = sqlite3.connect
+    sqlite3.connect = functools.partial(connect, factory=probe.connection_factory())
+    server = FakeBotApiServer(args.latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            results = asyncio.run(run(args, server, connect))
+            os.chdir(REPO_PATH)
+    finally:
+        sqlite3.connect = connect
+        server.stop()
+
+    revision = git_revision()
+    timestamp = datetime.now()
+    report = {
+        'revision': revision,
+        'timestamp': timestamp.isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        **results,
+        'sqlite_lock': probe.report(),
+    }
+    if output is None:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        output = os.path.join(RESULTS_PATH, f"bot_load-{revision}-{timestamp:%Y%m%d-%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"Saved to {output}", file=sys.stderr)
+    if args.compare:
+        compare(report, args.compare)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Сколько обращений к Bot API стоит один переход по каталогу.
+
+Создает небольшой каталог во временной папке, запускает диспетчер бота
+с поддельным Bot API и проходит по экранам: каталог -> категория -> товар ->
+категория -> каталог -> главное меню.
+
+    python benchmarks/bot_navigation.py --max-calls 3
+    python benchmarks/bot_navigation.py --latency 0.05  # время обработчика при RTT 50 мс
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fake_bot_api import BENCH_BOT_TOKEN, FakeBotSession
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JPEG_STUB = b'\xff\xd8\xff\xe0' + b'\x00' * 64
+
+USER_ID = 42
+ROUTE = ['catalog', 'category_1', 'item_1', 'item_2', 'category_1', 'catalog', 'main']
+
+
+def create_catalog(images_per_item):
+    """Категория с картинкой и два товара с несколькими изображениями"""
+    os.makedirs(os.path.join('static', 'uploads', 'ct1'), exist_ok=True)
+    conn = sqlite3.connect('shop.db')
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO categories (id, name, image_path, folder_name) VALUES (1, 'Футболки', ?, 'ct1')",
+                   ('uploads/ct1/category.jpg',))
+    paths = ['uploads/ct1/category.jpg']
+    for item_id in (1, 2):
+        cursor.execute("INSERT INTO items (id, category_id, name, description, sizes, stock_quantity) "
+                       "VALUES (?, 1, ?, 'Хлопок', 'S,M,L', 10)", (item_id, f'Футболка {item_id}'))
+        cursor.execute("INSERT INTO item_prices (item_id, currency_id, price) "
+                       "SELECT ?, id, 1000 * rate FROM currencies", (item_id,))
+        for number in range(images_per_item):
+            path = f'uploads/ct1/item{item_id}_{number}.jpg'
+            cursor.execute("INSERT INTO item_images (item_id, image_path) VALUES (?, ?)", (item_id, path))
+            paths.append(path)
+    conn.commit()
+    conn.close()
+    for path in paths:
+        with open(os.path.join('static', path), 'wb') as f:
+            f.write(JPEG_STUB)
+
+
+def callback_update(update_id, data, message):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Bench'},
+            'chat_instance': 'bench',
+            'data': data,
+            'message': message.model_dump(exclude_none=True),
+        },
+    }
+
+
+async def run(images_per_item, latency):
+    import bochka
+    from aiogram.types import Update
+
+    session = FakeBotSession(latency)
+    session.middleware(bochka.ApiMetricsMiddleware())
+    bochka.bot.session = session
+    bochka.init_db()
+    create_catalog(images_per_item)
+
+    # Исходный экран — главное меню, как после /start
+    screen = session.message(USER_ID, text='🏠 Главное меню', reply_markup=bochka.Keyboards.main_menu())
+    steps = []
+    for update_id, data in enumerate(ROUTE, start=1):
+        session.reset()
+        update = Update.model_validate(callback_update(update_id, data, screen), context={'bot': bochka.bot})
+        started = time.perf_counter()
+        await bochka.dp.feed_update(bochka.bot, update)
+        # Время, которое пользователь ждет ответа обработчика; фоновые вызовы досчитываем отдельно
+        handler_ms = (time.perf_counter() - started) * 1000
+        await bochka.background_tasks.drain()
+        # Ответ на callback (answerCallbackQuery) не относится к отрисовке экрана
+        calls = dict(session.calls)
+        render_calls = session.total_calls - calls.get('AnswerCallbackQuery', 0)
+        steps.append({
+            'callback': data,
+            'api_calls': render_calls,
+            'handler_ms': round(handler_ms, 1),
+            'methods': calls,
+        })
+        screen = session.last_screen.get(USER_ID, screen)
+    cache_stats = {'currency_cache_hit_rate': round(bochka.currency_cache.hit_rate, 3)}
+    return steps, cache_stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обращения к Bot API на один переход')
+    parser.add_argument('--images', type=int, default=1, help='изображений у товара')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа Bot API, секунд')
+    parser.add_argument('--max-calls', type=int, default=None,
+                        help='завершиться с ошибкой, если переход без альбома дороже')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_PATH)
+    os.environ['BOT_TOKEN'] = BENCH_BOT_TOKEN
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        steps, cache_stats = asyncio.run(run(args.images, args.latency))
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'images_per_item': args.images,
+        'latency': args.latency,
+        'steps': steps,
+        'max_calls': max(step['api_calls'] for step in steps),
+        **cache_stats,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.max_calls is not None and args.images <= 1 and report['max_calls'] > args.max_calls:
+        print(f"Navigation costs {report['max_calls']} API calls, limit is {args.max_calls}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Микробенчмарк построения экранов бота: без кэша и из render_cache.
+
+    python benchmarks/bot_render.py --items 100 --categories 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from fake_bot_api import BENCH_BOT_TOKEN
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_catalog(categories, items_per_category):
+    conn = sqlite3.connect('shop.db')
+    cursor = conn.cursor()
+    for category_id in range(1, categories + 1):
+        cursor.execute("INSERT INTO categories (id, name) VALUES (?, ?)", (category_id, f'Категория {category_id}'))
+        for number in range(items_per_category):
+            cursor.execute("INSERT INTO items (category_id, name, description, sizes, stock_quantity) "
+                           "VALUES (?, ?, 'Описание', 'S,M,L,XL', 5)", (category_id, f'Товар {category_id}-{number}'))
+            cursor.execute("INSERT INTO item_prices (item_id, currency_id, price) "
+                           "SELECT ?, id, 1500 * rate FROM currencies", (cursor.lastrowid,))
+    conn.commit()
+    conn.close()
+
+
+def measure(func, repeat):
+    """Среднее время одного вызова в микросекундах"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def measure_async(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def run(args):
+    import bochka
+
+    bochka.init_db()
+    create_catalog(args.categories, args.items)
+    categories = await bochka.DatabaseService.get_categories()
+    items = await bochka.DatabaseService.get_items_by_category(1)
+    version = await bochka.DatabaseService.get_catalog_version()
+    cache = bochka.render_cache
+    results = {}
+
+    static_menus = ('main_menu', 'back_to_main', 'confirm_order', 'order_success')
+    results['static_menus_build_us'] = sum(
+        measure(getattr(bochka.Keyboards, name).__wrapped__, args.repeat) for name in static_menus
+    )
+    results['static_menus_cached_us'] = sum(
+        measure(getattr(bochka.Keyboards, name), args.repeat) for name in static_menus
+    )
+
+    results['categories_menu_build_us'] = measure(lambda: bochka.Keyboards.categories_menu(categories), args.repeat)
+    results['items_menu_build_us'] = measure(lambda: bochka.Keyboards.items_menu(items, 1), args.repeat)
+
+    async def catalog_view():
+        return await cache.get(('catalog',), version, None, bochka.Views.catalog)
+
+    async def category_view():
+        return await cache.get(('category', 1), version, 'RUB', lambda: bochka.Views.category(1, 'RUB'))
+
+    # Первое обращение заполняет кэш; дальше измеряем только попадания
+    await catalog_view()
+    await category_view()
+    results['catalog_view_build_us'] = await measure_async(bochka.Views.catalog, args.repeat)
+    results['catalog_view_cached_us'] = await measure_async(catalog_view, args.repeat)
+    results['category_view_build_us'] = await measure_async(lambda: bochka.Views.category(1, 'RUB'), args.repeat)
+    results['category_view_cached_us'] = await measure_async(category_view, args.repeat)
+    results['cache_hits'] = cache.hits
+    results['cache_misses'] = cache.misses
+    return {key: round(value, 1) if isinstance(value, float) else value for key, value in results.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Стоимость построения экранов бота')
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--items', type=int, default=100, help='товаров в категории')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_PATH)
+    os.environ['BOT_TOKEN'] = BENCH_BOT_TOKEN
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run(args))
+    print(json.dumps({'categories': args.categories, 'items_per_category': args.items, **results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Проверка: add_item и edit_item открывают одно соединение с БД на запрос.
+
+Для каждой точки сетки (изображений у товара x валют) отдельный процесс
+создает каталог во временной папке и гоняет через тестовый клиент Flask
+edit_item GET/POST и add_item GET/POST. Считаются вызовы create_connection()
+за запрос; то же число сверяется с полем "N connections" заголовка
+Server-Timing.
+
+    python benchmarks/connection_count.py
+    python benchmarks/connection_count.py --images 1,10,50 --currencies 2,10,30
+
+Завершается с ошибкой, если какой-либо запрос открыл не одно соединение
+или число соединений зависит от числа изображений и валют.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from admin_bench import REPO_PATH, create_catalog, image_file, parse_sizes
+
+ITEMS_PER_CATEGORY = 5
+SCENARIOS = ('edit_item_get', 'edit_item_post', 'add_item_get', 'add_item_post')
+SERVER_TIMING_RE = re.compile(r'(\d+) connections')
+
+
+def add_currencies(count):
+    """Добавляет валюты до count (init_db создает RUB и BYN)"""
+    conn = sqlite3.connect('shop.db')
+    existing = conn.execute("SELECT COUNT(*) FROM currencies").fetchone()[0]
+    conn.executemany("INSERT INTO currencies (name, rate) VALUES (?, ?)",
+                     [(f'C{number:02d}', 1.0 + number) for number in range(count - existing)])
+    conn.commit()
+    conn.close()
+
+
+def requests_for(currencies, item_id, images_per_item, rng):
+    """Сценарий -> функция, выполняющая один запрос через тестовый клиент"""
+    item_form = {'name': 'Товар', 'category_id': '1', 'description': 'Описание', 'sizes': 'S,M,L',
+                 'stock_quantity': '5'}
+
+    def edit_item_post(client):
+        form = dict(item_form, **{f'price_{currency_id}': '1500' for currency_id, _ in currencies})
+        form['images'] = [image_file(rng) for _ in range(images_per_item)]
+        return client.post(f'/edit_item/{item_id}', data=form, content_type='multipart/form-data')
+
+    def add_item_post(client):
+        form = dict(item_form, **{f'price_{name.lower()}': '1500' for _, name in currencies})
+        form['images'] = [image_file(rng) for _ in range(images_per_item)]
+        return client.post('/add_item', data=form, content_type='multipart/form-data')
+
+    return {
+        'edit_item_get': lambda client: client.get(f'/edit_item/{item_id}'),
+        'edit_item_post': edit_item_post,
+        'add_item_get': lambda client: client.get('/add_item'),
+        'add_item_post': add_item_post,
+    }
+
+
+def check_saved(item_id, currency_count, images_per_item, repeat):
+    """Ошибка в обработчике тоже отвечает редиректом (handle_errors): проверяем, что формы записались"""
+    conn = sqlite3.connect('shop.db')
+    query = ("SELECT (SELECT COUNT(*) FROM item_prices WHERE item_id = i.id), "
+             "(SELECT COUNT(*) FROM item_images WHERE item_id = i.id) FROM items i ")
+    edited = conn.execute(query + "WHERE i.id = ?", (item_id,)).fetchone()
+    added = conn.execute(query + "WHERE i.id > (SELECT MAX(id) - ? FROM items)", (repeat,)).fetchall()
+    conn.close()
+    # create_catalog дает товару images_per_item изображений, каждый edit_item POST добавляет еще столько же
+    if edited != (currency_count, images_per_item * (repeat + 1)) \
+            or added != [(currency_count, images_per_item)] * repeat:
+        raise RuntimeError(f"Forms were not saved: edited item {edited}, added items {added}")
+
+
+def measure(images_per_item, currency_count, repeat):
+    """Одна точка сетки; запускается в отдельном процессе (см. main)"""
+    sys.path.insert(0, REPO_PATH)
+    import app as admin
+    import logging
+    logging.disable(logging.INFO)
+
+    admin.init_db()
+    add_currencies(currency_count)
+    currencies, _, item_id = create_catalog(ITEMS_PER_CATEGORY, images_per_item)
+    scenarios = requests_for(currencies, item_id, images_per_item, random.Random(1))
+    client = admin.app.test_client()
+
+    calls = []
+    create_connection = admin.create_connection
+
+    def counting_create_connection():
+        calls.append(1)
+        return create_connection()
+
+    admin.create_connection = counting_create_connection
+    results = {}
+    try:
+        for name in SCENARIOS:
+            counts, reported = set(), set()
+            for _ in range(repeat):
+                calls.clear()
+                response = scenarios[name](client)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name} returned {response.status_code}")
+                counts.add(len(calls))
+                match = SERVER_TIMING_RE.search(response.headers.get('Server-Timing', ''))
+                reported.add(int(match.group(1)) if match else None)
+            results[name] = {'connections': sorted(counts), 'server_timing': sorted(reported, key=str)}
+        check_saved(item_id, len(currencies), images_per_item, repeat)
+    finally:
+        admin.create_connection = create_connection
+        admin.upload_executor.shutdown(wait=True)
+    return results
+
+
+def run_point(images_per_item, currency_count, repeat):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', str(images_per_item), str(currency_count),
+             '--repeat', str(repeat)],
+            cwd=workdir, capture_output=True, text=True
+        )
+    if output.returncode:
+        raise RuntimeError(f"Check for {images_per_item} images x {currency_count} currencies failed:\n"
+                           f"{output.stderr}")
+    return json.loads(output.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Число соединений с БД на запрос add_item и edit_item')
+    parser.add_argument('--images', type=parse_sizes, default=[1, 5, 20], help='изображений у товара')
+    parser.add_argument('--currencies', type=parse_sizes, default=[2, 10, 30], help='валют в справочнике')
+    parser.add_argument('--repeat', type=int, default=3, help='запросов на сценарий')
+    parser.add_argument('--worker', nargs=2, type=int, metavar=('IMAGES', 'CURRENCIES'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(measure(*args.worker, args.repeat)))
+        return 0
+
+    points = []
+    failures = []
+    for images_per_item in args.images:
+        for currency_count in args.currencies:
+            scenarios = run_point(images_per_item, currency_count, args.repeat)
+            points.append({'images': images_per_item, 'currencies': currency_count, 'scenarios': scenarios})
+            for name, result in scenarios.items():
+                if result['connections'] != [1] or result['server_timing'] != [1]:
+                    failures.append(f"{name} @ {images_per_item} images x {currency_count} currencies: "
+                                    f"create_connection() {result['connections']}, "
+                                    f"Server-Timing {result['server_timing']}")
+
+    print(json.dumps({'points': points}, ensure_ascii=False, indent=2))
+    for failure in failures:
+        print(f"Not one connection per request: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""Поддельный Telegram Bot API для офлайн-замеров бота.
+
+FakeBotSession подменяет HTTP-клиент aiogram: каждый вызов метода API
+считается, при желании задерживается на заданное время и получает
+правдоподобный ответ. FakeBotApiServer — то же самое по HTTP на локальном
+порту, в отдельном потоке: бот работает со своей настоящей aiohttp-сессией,
+и в замер входят сериализация запросов и загрузка файлов.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageText,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+)
+from aiogram.types import Chat, Message, PhotoSize
+from aiohttp import web
+
+BENCH_BOT_TOKEN = '123456:fake-token-for-benchmarks'
+
+
+class FakeBotSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.call_time = 0.0
+        self.message_ids = itertools.count(1000)
+        self.file_ids = itertools.count(1)
+        self.last_screen = {}  # chat_id -> последнее сообщение с клавиатурой
+        self.photo_messages = set()  # (chat_id, message_id) сообщений с фото
+
+    def reset(self):
+        self.calls.clear()
+        self.call_time = 0.0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def make_request(self, bot, method, timeout=None):
+        started = time.perf_counter()
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self.respond(method)
+        self.call_time += time.perf_counter() - started
+        return result
+
+    def photo(self):
+        file_id = f'file-{next(self.file_ids)}'
+        return [PhotoSize(file_id=file_id, file_unique_id=file_id, width=800, height=800)]
+
+    def message(self, chat_id, message_id=None, text=None, caption=None, photo=None, reply_markup=None):
+        message = Message(
+            message_id=message_id or next(self.message_ids),
+            date=datetime.now(),
+            chat=Chat(id=int(chat_id), type='private'),
+            text=text,
+            caption=caption,
+            photo=photo,
+            reply_markup=reply_markup,
+        )
+        key = (int(chat_id), message.message_id)
+        if photo:
+            self.photo_messages.add(key)
+        else:
+            self.photo_messages.discard(key)
+        if reply_markup is not None:
+            self.last_screen[int(chat_id)] = message
+        return message
+
+    def respond(self, method):
+        if isinstance(method, SendMessage):
+            return self.message(method.chat_id, text=method.text, reply_markup=method.reply_markup)
+        if isinstance(method, SendPhoto):
+            return self.message(method.chat_id, caption=method.caption, photo=self.photo(),
+                                reply_markup=method.reply_markup)
+        if isinstance(method, EditMessageText):
+            # Как и настоящий API: у сообщения с фото нет текста для редактирования
+            if (int(method.chat_id), method.message_id) in self.photo_messages:
+                raise TelegramBadRequest(method, 'Bad Request: there is no text in the message to edit')
+            return self.message(method.chat_id, method.message_id, text=method.text,
+                                reply_markup=method.reply_markup)
+        if isinstance(method, EditMessageCaption):
+            return self.message(method.chat_id, method.message_id, caption=method.caption, photo=self.photo(),
+                                reply_markup=method.reply_markup)
+        if isinstance(method, EditMessageMedia):
+            return self.message(method.chat_id, method.message_id, caption=method.media.caption,
+                                photo=self.photo(), reply_markup=method.reply_markup)
+        if isinstance(method, SendMediaGroup):
+            return [self.message(method.chat_id, photo=self.photo()) for _ in method.media]
+        return True
+
+
+class FakeBotApiServer:
+    """Bot API по HTTP: http://127.0.0.1:<port>/bot<token>/<method>"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1000)
+        self.file_ids = itertools.count(1)
+        self.last_screen = {}  # chat_id -> последнее сообщение с клавиатурой (dict, как в ответе API)
+        self.photo_messages = set()
+        self.lock = threading.Lock()
+        self.loop = None
+        self.runner = None
+        self.port = None
+        self.started = threading.Event()
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        """Запускает сервер в отдельном потоке со своим циклом событий"""
+        self.thread = threading.Thread(target=self.serve, name='fake-bot-api', daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def serve(self):
+        self.loop = asyncio.new_event_loop()
+        application = web.Application(client_max_size=64 * 1024 * 1024)
+        application.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(application, access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        form = await request.post()
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            result = self.respond(method, params)
+        except LookupError as e:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    def photo(self):
+        file_id = f'file-{next(self.file_ids)}'
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 800}]
+
+    def message(self, chat_id, message_id=None, text=None, caption=None, photo=None, reply_markup=None):
+        message = {
+            'message_id': int(message_id) if message_id else next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }
+        if text is not None:
+            message['text'] = text
+        if caption is not None:
+            message['caption'] = caption
+        if photo:
+            message['photo'] = photo
+        if reply_markup:
+            message['reply_markup'] = json.loads(reply_markup)
+        key = (int(chat_id), message['message_id'])
+        with self.lock:
+            if photo:
+                self.photo_messages.add(key)
+            else:
+                self.photo_messages.discard(key)
+            if reply_markup:
+                self.last_screen[int(chat_id)] = message
+        return message
+
+    def respond(self, method, params):
+        chat_id = params.get('chat_id')
+        message_id = params.get('message_id')
+        markup = params.get('reply_markup')
+        if method == 'sendmessage':
+            return self.message(chat_id, text=params.get('text'), reply_markup=markup)
+        if method == 'sendphoto':
+            return self.message(chat_id, caption=params.get('caption'), photo=self.photo(), reply_markup=markup)
+        if method == 'editmessagetext':
+            if (int(chat_id), int(message_id)) in self.photo_messages:
+                raise LookupError('there is no text in the message to edit')
+            return self.message(chat_id, message_id, text=params.get('text'), reply_markup=markup)
+        if method == 'editmessagecaption':
+            return self.message(chat_id, message_id, caption=params.get('caption'), photo=self.photo(),
+                                reply_markup=markup)
+        if method == 'editmessagemedia':
+            media = json.loads(params.get('media', '{}'))
+            return self.message(chat_id, message_id, caption=media.get('caption'), photo=self.photo(),
+                                reply_markup=markup)
+        if method == 'sendmediagroup':
+            return [self.message(chat_id, photo=self.photo()) for _ in json.loads(params.get('media', '[]'))]
+        return True
@@ -0,0 +1,127 @@
+"""Время запуска бота и админки: импорт модулей и первое обработанное обновление.
+
+Импорт замеряется через python -X importtime, время до первого обновления —
+от запуска процесса до ответа бота на /start (схема уже создана, Bot API
+поддельный). Тяжелые необязательные модули (Pillow) не должны загружаться
+при старте.
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --max-first-update-ms 8000 --max-own-import-ms 150
+
+Завершается с ошибкой, если превышен любой из заданных порогов или при
+старте импортирован модуль из --forbid.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_bot_api import BENCH_BOT_TOKEN
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_MODULES = {'bochka', 'app', 'metrics', 'pricing', 'rates', 'catalog_io', 'log_pipeline', 'shop_db'}
+TARGETS = ('bochka', 'app')
+
+FIRST_UPDATE_SCRIPT = '''
+import asyncio, sys
+sys.path[:0] = [{repo!r}, {benchmarks!r}]
+import bochka
+from aiogram.types import Update
+from fake_bot_api import FakeBotSession
+
+async def first_update():
+    bochka.bot.session = FakeBotSession()
+    bochka.ensure_schema()
+    update = {{'update_id': 1, 'message': {{
+        'message_id': 1, 'date': 0, 'chat': {{'id': 42, 'type': 'private'}},
+        'from': {{'id': 42, 'is_bot': False, 'first_name': 'Bench'}}, 'text': '/start',
+        'entities': [{{'type': 'bot_command', 'offset': 0, 'length': 6}}]}}}}
+    await bochka.dp.feed_update(bochka.bot, Update.model_validate(update, context={{'bot': bochka.bot}}))
+    assert bochka.bot.session.calls['SendMessage'] == 1
+    await bochka.background_tasks.drain()
+
+asyncio.run(first_update())
+print('ready', flush=True)
+'''
+
+
+def environment():
+    env = dict(os.environ, BOT_TOKEN=BENCH_BOT_TOKEN, LOG_LEVEL='WARNING')
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    return env
+
+
+def import_profile(module, workdir):
+    """Время импорта модуля: всего, собственных модулей репозитория и список загруженных модулей"""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {REPO_PATH!r}); import {module}'],
+        cwd=workdir, env=environment(), capture_output=True, text=True, check=True
+    )
+    total = own = 0
+    loaded = set()
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        loaded.add(name)
+        if name == module:
+            total = int(cumulative_us)
+        if name in REPO_MODULES:
+            own += int(self_us)
+    return {'import_ms': round(total / 1000, 1), 'own_import_ms': round(own / 1000, 1)}, loaded
+
+
+def first_update_time(workdir):
+    """Миллисекунды от запуска процесса до ответа на /start"""
+    script = FIRST_UPDATE_SCRIPT.format(repo=REPO_PATH, benchmarks=os.path.join(REPO_PATH, 'benchmarks'))
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', script], cwd=workdir, env=environment(),
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if output.returncode or 'ready' not in output.stdout:
+        raise RuntimeError(f"First update failed:\n{output.stderr}")
+    return round(elapsed * 1000, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Время запуска бота и админки')
+    parser.add_argument('--runs', type=int, default=3, help='повторов; берется лучший результат')
+    parser.add_argument('--max-first-update-ms', type=float, help='порог времени до первого обновления бота')
+    parser.add_argument('--max-own-import-ms', type=float, help='порог импорта модулей репозитория')
+    parser.add_argument('--forbid', nargs='*', default=['PIL'], help='модули, которых не должно быть при старте')
+    args = parser.parse_args(argv)
+
+    report = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Схема создается заранее: замеряется обычный перезапуск, а не первый запуск
+        subprocess.run([sys.executable, '-c', f'import sys; sys.path.insert(0, {REPO_PATH!r}); '
+                                              f'import bochka, app; bochka.ensure_schema(); app.prepare_startup()'],
+                       cwd=workdir, env=environment(), check=True, capture_output=True)
+        for module in TARGETS:
+            profiles = []
+            for _ in range(args.runs):
+                profile, loaded = import_profile(module, workdir)
+                profiles.append(profile)
+            report[module] = {key: min(profile[key] for profile in profiles) for key in profiles[0]}
+            forbidden = sorted(name for name in args.forbid if name in loaded)
+            if forbidden:
+                failures.append(f"{module} imports {', '.join(forbidden)} at startup")
+            if args.max_own_import_ms and report[module]['own_import_ms'] > args.max_own_import_ms:
+                failures.append(f"{module}: own modules import in {report[module]['own_import_ms']}ms")
+
+        report['bochka']['first_update_ms'] = min(first_update_time(workdir) for _ in range(args.runs))
+        if args.max_first_update_ms and report['bochka']['first_update_ms'] > args.max_first_update_ms:
+            failures.append(f"first update after {report['bochka']['first_update_ms']}ms")
+
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"Startup budget exceeded: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,20 @@
 import asyncio
-import json
+import contextvars
+import heapq
 import logging
 import os
+import random
+import re
 import sqlite3
-from contextlib import asynccontextmanager
+import time
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Optional, Tuple
 
-from aiogram import Bot, Dispatcher, F, Router, types
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router, types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -17,15 +24,21 @@ from aiogram.types import (
     FSInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
     InputMediaPhoto,
+    InputTextMessageContent,
 )
 from dotenv import load_dotenv
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import log_pipeline
+import metrics
+import pricing
+import rates
+import shop_db
+
+# Настройка логирования: вывод в отдельном потоке, не в цикле событий
+log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
@@ -39,6 +52,22 @@ class Config:
     NOTIFICATIONS_CHANNEL_ID = os.getenv('NOTIFICATIONS_CHANNEL_ID')
     DATABASE_PATH = 'shop.db'
     STATIC_PATH = 'static'
+    SEARCH_LIMIT = 10
+    INLINE_SEARCH_LIMIT = 20
+    SEARCH_RANK_WINDOW = 1000
+    DB_WORKERS = int(os.getenv('DB_WORKERS', 4))  # потоков (и соединений) для запросов к БД
+    SEARCH_DEBOUNCE = 0.3  # секунд между нажатиями клавиш в inline-режиме
+    INLINE_CACHE_TIME = 300  # сколько секунд Telegram может кэшировать ответ на inline-запрос
+    BACKGROUND_API_CONCURRENCY = 8  # одновременных фоновых вызовов Bot API (удаления, альбомы)
+    RENDER_CACHE_SIZE = 1024  # готовых экранов каталога в памяти
+    CURRENCY_CACHE_SIZE = 10000  # пользователей, чья валюта хранится в памяти
+    SHOWN_PHOTOS_SIZE = 10000  # сообщений с фото, для которых помним показанное изображение
+    RATES_URL = os.getenv('RATES_URL')
+    RATES_FILE = os.getenv('RATES_FILE')
+    RATES_REFRESH_INTERVAL = int(os.getenv('RATES_REFRESH_INTERVAL', 3600))
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # 0 — не поднимать /metrics
+    SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', 0.5))  # секунд
+    DEFAULT_CURRENCY = ('BYN', 0.037)
 
 # Проверка конфигурации
 if not Config.BOT_TOKEN:
@@ -58,23 +87,125 @@ class OrderStates(StatesGroup):
     SELECT_ORDER_ITEMS = State()
     CONFIRM_ORDER = State()
 
-# Контекстный менеджер для работы с БД
-@asynccontextmanager
-async def get_db():
-    conn = None
+# Метрики: время обработки update, запросы к БД и к Bot API
+metrics_registry = metrics.Registry()
+UPDATE_DURATION = metrics_registry.histogram(
+    'bot_update_duration_seconds', 'Update processing time', ('handler',))
+UPDATE_ERRORS = metrics_registry.counter(
+    'bot_update_errors_total', 'Updates whose handler raised', ('handler',))
+DB_QUERIES = metrics_registry.histogram(
+    'bot_db_queries_per_update', 'SQL statements per update', ('handler',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_DURATION = metrics_registry.histogram(
+    'bot_db_duration_seconds', 'Time spent in the database per update', ('handler',))
+API_CALLS = metrics_registry.histogram(
+    'bot_api_calls_per_update', 'Bot API requests awaited per update', ('handler',),
+    buckets=(0, 1, 2, 3, 4, 6, 10))
+API_DURATION = metrics_registry.histogram(
+    'bot_api_request_duration_seconds', 'Bot API request time', ('method',))
+
+class UpdateStats:
+    """Счетчики одного update; доступны обработчику через current_update_stats"""
+
+    def __init__(self):
+        self.handler = 'unhandled'
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.api_calls = []  # (метод, секунды)
+
+    def trace_statement(self, statement: str):
+        if not statement.startswith(('BEGIN', 'COMMIT', 'ROLLBACK')):
+            self.db_queries += 1
+
+    def observe(self, total: float):
+        api_calls = list(self.api_calls)
+        UPDATE_DURATION.observe(total, handler=self.handler)
+        DB_QUERIES.observe(self.db_queries, handler=self.handler)
+        DB_DURATION.observe(self.db_time, handler=self.handler)
+        API_CALLS.observe(len(api_calls), handler=self.handler)
+        if total >= Config.SLOW_UPDATE_THRESHOLD:
+            api_time = sum(elapsed for _, elapsed in api_calls)
+            breakdown = ', '.join(f"{method} {elapsed * 1000:.0f}ms" for method, elapsed in api_calls)
+            logger.warning(
+                "Slow update: handler=%s total=%.0fms db=%d queries/%.0fms api=%d calls/%.0fms [%s]",
+                self.handler, total * 1000, self.db_queries, self.db_time * 1000,
+                len(api_calls), api_time * 1000, breakdown,
+                extra={'handler': self.handler, 'total_ms': round(total * 1000, 1),
+                       'db_queries': self.db_queries, 'db_ms': round(self.db_time * 1000, 1),
+                       'api_calls': len(api_calls), 'api_ms': round(api_time * 1000, 1)}
+            )
+
+current_update_stats = contextvars.ContextVar('current_update_stats', default=None)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: замеряет обработку каждого update"""
+
+    async def __call__(self, handler, event, data):
+        stats = UpdateStats()
+        token = current_update_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.inc(handler=stats.handler)
+            raise
+        finally:
+            current_update_stats.reset(token)
+            stats.observe(time.perf_counter() - started)
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware: запоминает, какой обработчик выбран для update"""
+
+    async def __call__(self, handler, event, data):
+        stats = current_update_stats.get()
+        handler_object = data.get('handler')
+        if stats is not None and handler_object is not None:
+            stats.handler = handler_object.callback.__name__
+        return await handler(event, data)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Замеряет запросы к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            method_name = type(method).__name__
+            API_DURATION.observe(elapsed, method=method_name)
+            stats = current_update_stats.get()
+            if stats is not None:
+                stats.api_calls.append((method_name, elapsed))
+
+async def start_metrics_server(port: int):
+    """Отдает метрики в формате Prometheus на http://127.0.0.1:<port>/metrics"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(body=metrics_registry.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    metrics_app = web.Application()
+    metrics_app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(metrics_app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    logger.info(f"Metrics available at http://127.0.0.1:{port}/metrics")
+    return runner
+
+# Запросы к БД выполняются в потоках пула, не блокируя цикл событий
+database = shop_db.AsyncDatabase(Config.DATABASE_PATH, workers=Config.DB_WORKERS)
+
+async def run_query(query, *args):
+    """Выполняет функцию запроса из shop_db; учитывается в счетчиках текущего update"""
+    stats = current_update_stats.get()
+    if stats is None:
+        return await database.run(query, *args)
+    started = time.perf_counter()
     try:
-        conn = sqlite3.connect(Config.DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        yield conn
-    except sqlite3.Error as e:
-        logger.error(f"Database error: {e}")
-        if conn:
-            conn.rollback()
-        raise
+        return await database.run(query, *args, trace=stats.trace_statement)
     finally:
-        if conn:
-            conn.commit()
-            conn.close()
+        stats.db_time += time.perf_counter() - started
 
 # Сервис уведомлений
 class NotificationService:
@@ -177,6 +308,29 @@ class NotificationService:
 # Создаем экземпляр сервиса уведомлений
 notification_service = NotificationService(bot)
 
+SCHEMA_VERSION_KEY = 'bot_schema_version'
+SCHEMA_VERSION = 1  # увеличить при любом изменении init_db
+
+def schema_is_current() -> bool:
+    """Схема бота уже создана: одно чтение по ключу вместо всех CREATE при каждом запуске"""
+    try:
+        conn = sqlite3.connect(f'file:{Config.DATABASE_PATH}?mode=ro', uri=True)
+    except sqlite3.OperationalError:
+        return False  # базы еще нет
+    try:
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (SCHEMA_VERSION_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    return bool(row) and row[0] >= SCHEMA_VERSION
+
+def ensure_schema():
+    if schema_is_current():
+        logger.info("Database schema is up to date")
+        return
+    init_db()
+
 # Инициализация базы данных
 def init_db():
     logger.info("Starting init_db")
@@ -236,7 +390,13 @@ def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
             '''CREATE TABLE IF NOT EXISTS banned_users
                (user_id INTEGER PRIMARY KEY,
-                banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+                banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+            '''CREATE TABLE IF NOT EXISTS sequences
+               (name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL)''',
+            '''CREATE TABLE IF NOT EXISTS telegram_files
+               (image_path TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL)'''
         ]
 
         for table in tables:
@@ -253,6 +413,12 @@ def init_db():
             c.executemany("INSERT OR IGNORE INTO currencies (name, rate) VALUES (?, ?)", currencies)
             logger.info("Inserted currencies")
 
+        pricing.migrate(c)
+
+        # Версия каталога и полнотекстовый поиск: триггеры общие с админкой (shop_db)
+        shop_db.migrate_catalog_triggers(c)
+
+        c.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (SCHEMA_VERSION_KEY, SCHEMA_VERSION))
         conn.commit()
         logger.info("init_db completed successfully")
     except sqlite3.Error as e:
@@ -261,193 +427,211 @@ def init_db():
     finally:
         conn.close()
 
+# Валюта пользователей: user_id -> (код, курс), вытесняются давно не активные
+class CurrencyCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Tuple[str, float]]:
+        currency = self.entries.get(user_id)
+        if currency is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return currency
+
+    def put(self, user_id: int, currency: Tuple[str, float]):
+        self.entries[user_id] = currency
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+currency_cache = CurrencyCache(Config.CURRENCY_CACHE_SIZE)
+
 # Сервисы для работы с данными
 class DatabaseService:
     @staticmethod
     async def is_user_banned(user_id: int) -> bool:
         """Проверить, забанен ли пользователь"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,))
-            return bool(cursor.fetchone())
+        return await run_query(shop_db.is_user_banned, user_id)
 
     @staticmethod
     async def ban_user(user_id: int) -> bool:
         """Забанить пользователя"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("INSERT INTO banned_users (user_id) VALUES (?)", (user_id,))
-                return True
-            except sqlite3.IntegrityError:
-                return False  # Пользователь уже забанен
+        return await run_query(shop_db.ban_user, user_id)
 
     @staticmethod
     async def unban_user(user_id: int) -> bool:
         """Разбанить пользователя"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
-            return cursor.rowcount > 0
+        return await run_query(shop_db.unban_user, user_id)
 
     @staticmethod
     async def get_user_currency(user_id: int) -> Tuple[str, float]:
         """Получить валюту пользователя"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                           SELECT currencies.name, currencies.rate
-                           FROM user_preferences
-                                    JOIN currencies ON user_preferences.currency_id = currencies.id
-                           WHERE user_preferences.user_id = ?
-                           ''', (user_id,))
-            result = cursor.fetchone()
-            return (result['name'], result['rate']) if result else ('BYN', 0.037)
+        currency = currency_cache.get(user_id)
+        if currency is not None:
+            return currency
+
+        result = await run_query(shop_db.get_user_currency, user_id)
+        # Пользователи без сохраненной валюты тоже кэшируются — их большинство
+        currency = (result['name'], result['rate']) if result else Config.DEFAULT_CURRENCY
+        currency_cache.put(user_id, currency)
+        return currency
 
     @staticmethod
     async def get_categories() -> List[sqlite3.Row]:
         """Получить все категории"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name, image_path FROM categories ORDER BY name")
-            return cursor.fetchall()
+        return await run_query(shop_db.get_categories)
 
     @staticmethod
     async def get_category_by_id(category_id: int) -> Optional[sqlite3.Row]:
         """Получить категорию по ID"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM categories WHERE id = ?", (category_id,))
-            return cursor.fetchone()
+        return await run_query(shop_db.get_category, category_id)
 
     @staticmethod
     async def get_items_by_category(category_id: int) -> List[sqlite3.Row]:
         """Получить товары по категории"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM items WHERE category_id = ?", (category_id,))
-            return cursor.fetchall()
+        return await run_query(shop_db.get_category_item_names, category_id)
 
     @staticmethod
     async def get_item_by_id(item_id: int) -> Optional[sqlite3.Row]:
         """Получить товар по ID"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT name, description, stock_quantity, sizes, category_id FROM items WHERE id = ?",
-                (item_id,)
-            )
-            return cursor.fetchone()
+        return await run_query(shop_db.get_item, item_id)
 
     @staticmethod
     async def get_item_images(item_id: int) -> List[str]:
         """Получить изображения товара"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT image_path FROM item_images WHERE item_id = ? ORDER BY id",
-                (item_id,)
-            )
-            return [row['image_path'] for row in cursor.fetchall()]
+        return await run_query(shop_db.get_item_image_paths, item_id)
 
     @staticmethod
     async def get_item_price(item_id: int, currency_code: str) -> float:
         """Получить цену товара в указанной валюте"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                           SELECT price
-                           FROM item_prices
-                           WHERE item_id = ?
-                             AND currency_id = (SELECT id
-                                                FROM currencies
-                                                WHERE name = ?)
-                           ''', (item_id, currency_code))
-            result = cursor.fetchone()
-            return result['price'] if result else 0.0
+        prices = await DatabaseService.get_item_prices([item_id], currency_code)
+        return prices[item_id]
+
+    @staticmethod
+    async def get_item_prices(item_ids: List[int], currency_code: str) -> dict:
+        """Получить цены группы товаров (явные или выведенные из курса) одним запросом"""
+        prices = await run_query(pricing.prices_for, item_ids, currency_code)
+        missing = [item_id for item_id in item_ids if prices.get(item_id) is None]
+        if missing:
+            logger.warning("No price in %s for items %s", currency_code, missing)
+        return {item_id: prices.get(item_id) or 0.0 for item_id in item_ids}
+
+    @staticmethod
+    async def search_items(query: str, currency_code: str, limit: int = Config.SEARCH_LIMIT) -> List[sqlite3.Row]:
+        """Найти товары по названию и описанию (лучшие совпадения первыми)"""
+        return await run_query(search_summaries, query, currency_code, limit)
+
+    @staticmethod
+    async def get_catalog_version() -> int:
+        """Получить текущую версию каталога"""
+        return await run_query(shop_db.get_catalog_version)
+
+    @staticmethod
+    async def get_catalog_snapshot() -> Tuple[List[sqlite3.Row], List[tuple], List[sqlite3.Row]]:
+        """Получить товары, цены во всех валютах и изображения для индекса в памяти"""
+        return await run_query(shop_db.get_catalog_snapshot)
+
+    @staticmethod
+    async def get_telegram_file_ids() -> dict:
+        """Получить file_id уже загруженных в Telegram изображений"""
+        return await run_query(shop_db.get_telegram_file_ids)
+
+    @staticmethod
+    async def save_telegram_file_id(image_path: str, file_id: str):
+        """Запомнить file_id загруженного изображения"""
+        await run_query(shop_db.save_telegram_file_id, image_path, file_id)
 
     @staticmethod
     async def add_to_cart(user_id: int, item_id: int, size: str):
         """Добавить товар в корзину"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO carts (user_id, item_id, size) VALUES (?, ?, ?)",
-                (user_id, item_id, size)
-            )
+        await run_query(shop_db.add_to_cart, user_id, item_id, size)
 
     @staticmethod
     async def get_cart_items(user_id: int) -> List[sqlite3.Row]:
         """Получить товары из корзины"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                           SELECT items.id, items.name, carts.size
-                           FROM carts
-                                    JOIN items ON carts.item_id = items.id
-                           WHERE carts.user_id = ?
-                           ''', (user_id,))
-            return cursor.fetchall()
+        return await run_query(shop_db.get_cart_items, user_id)
 
     @staticmethod
     async def clear_cart(user_id: int):
         """Очистить корзину"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+        await run_query(shop_db.clear_cart, user_id)
 
     @staticmethod
     async def remove_from_cart(user_id: int, item_id: int, size: str):
         """Удалить конкретный товар из корзины"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM carts WHERE user_id = ? AND item_id = ? AND size = ? LIMIT 1",
-                (user_id, item_id, size)
-            )
+        await run_query(shop_db.remove_from_cart, user_id, item_id, size)
 
     @staticmethod
     async def get_currencies() -> List[sqlite3.Row]:
         """Получить все валюты"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM currencies ORDER BY name")
-            return cursor.fetchall()
+        return await run_query(shop_db.get_currencies)
 
     @staticmethod
     async def set_user_currency(user_id: int, currency_id: int):
         """Установить валюту пользователя"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO user_preferences (user_id, currency_id) VALUES (?, ?)",
-                (user_id, currency_id)
-            )
+        result = await run_query(shop_db.set_user_currency, user_id, currency_id)
+        if result:
+            currency_cache.put(user_id, (result['name'], result['rate']))
+        else:
+            currency_cache.entries.pop(user_id, None)
 
     @staticmethod
     async def get_currency_name(currency_id: int) -> str:
         """Получить название валюты по ID"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM currencies WHERE id = ?", (currency_id,))
-            result = cursor.fetchone()
-            return result['name'] if result else 'Unknown'
+        result = await run_query(shop_db.get_currency, currency_id)
+        return result['name'] if result else 'Unknown'
 
     @staticmethod
     async def create_order(user_id: int, order_items: List[dict], total_price: float, currency_code: str) -> int:
         """Создать заказ"""
-        async with get_db() as conn:
-            cursor = conn.cursor()
-            order_data = {
-                "items": order_items,
-                "user_id": user_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            cursor.execute('''
-                           INSERT INTO orders (user_id, order_data, total_price, currency_code, status, created_at)
-                           VALUES (?, ?, ?, ?, 'pending', CURRENT_TIMESTAMP)
-                           ''', (user_id, json.dumps(order_data, ensure_ascii=False), total_price, currency_code))
-            return cursor.lastrowid
+        return await run_query(shop_db.create_order, user_id, order_items, total_price, currency_code)
+
+def search_summaries(cursor: sqlite3.Cursor, query: str, currency_code: str, limit: int) -> List[sqlite3.Row]:
+    """Поиск для /search: id из shop_db.search_item_ids и краткие данные товаров"""
+    item_ids = shop_db.search_item_ids(cursor, query, limit, Config.SEARCH_RANK_WINDOW)
+    return shop_db.get_item_summaries(cursor, item_ids, currency_code) if item_ids else []
+
+# Фоновые вызовы Bot API, которых пользователь не ждет (удаления, ответы на callback)
+class BackgroundTasks:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.tasks = set()
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(self.run(coro))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self, coro):
+        # Фоновые вызовы не входят в замер update, который их запустил
+        current_update_stats.set(None)
+        async with self.semaphore:
+            try:
+                return await coro
+            except Exception as e:
+                logger.warning("Background task failed: %s", e)
+
+    async def drain(self):
+        """Дождаться всех запущенных задач (при остановке бота)"""
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+background_tasks = BackgroundTasks(Config.BACKGROUND_API_CONCURRENCY)
 
 # Утилиты для работы с сообщениями
 class MessageManager:
@@ -458,33 +642,78 @@ class MessageManager:
         """Обновить список ID сообщений для чата"""
         if chat_id not in MessageManager.message_ids:
             MessageManager.message_ids[chat_id] = []
-        MessageManager.message_ids[chat_id].append(message_id)
-        logger.debug(f"Updated message IDs for chat {chat_id}: {MessageManager.message_ids[chat_id]}")
+        # render() редактирует сообщение на месте и возвращает тот же message_id
+        if message_id not in MessageManager.message_ids[chat_id]:
+            MessageManager.message_ids[chat_id].append(message_id)
+        logger.debug("Updated message IDs for chat %s: %d tracked", chat_id, len(MessageManager.message_ids[chat_id]))
 
     @staticmethod
     async def delete_previous_messages(chat_id: int, exclude_ids: List[int] = None):
-        """Удалить предыдущие сообщения, кроме исключенных"""
+        """Удалить предыдущие сообщения, кроме исключенных.
+
+        Удаления выполняются в фоне: обработчику не нужно ждать их завершения.
+        """
+        # Альбом, который еще отправляется, удалит себя сам (см. send_album)
+        MessageManager.pending_albums.pop(chat_id, None)
         if chat_id not in MessageManager.message_ids:
             return
         for msg_id in MessageManager.message_ids[chat_id]:
             if exclude_ids and msg_id in exclude_ids:
                 continue
+            background_tasks.spawn(MessageManager.safe_delete_message(chat_id, msg_id))
+        MessageManager.message_ids[chat_id] = [msg_id for msg_id in dict.fromkeys(MessageManager.message_ids[chat_id])
+                                               if exclude_ids and msg_id in exclude_ids]
+        logger.debug("Remaining message IDs for chat %s: %d tracked", chat_id, len(MessageManager.message_ids[chat_id]))
+
+    pending_albums = {}  # chat_id -> задача отправки альбома к текущему экрану
+
+    @staticmethod
+    def send_album_later(chat_id: int, images: List[str]):
+        """Отправить дополнительные фото товара в фоне после основного сообщения"""
+        task = background_tasks.spawn(MessageManager.send_album(chat_id, images))
+        MessageManager.pending_albums[chat_id] = task
+
+    @staticmethod
+    async def send_album(chat_id: int, images: List[str]):
+        media = []
+        for img in images:
             try:
-                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                logger.debug(f"Deleted message {msg_id} in chat {chat_id}")
-            except TelegramBadRequest as e:
-                logger.warning(f"Failed to delete message {msg_id}: {e}")
-        MessageManager.message_ids[chat_id] = [msg_id for msg_id in MessageManager.message_ids[chat_id] if exclude_ids and msg_id in exclude_ids]
-        logger.debug(f"Remaining message IDs for chat {chat_id}: {MessageManager.message_ids[chat_id]}")
+                media.append(InputMediaPhoto(media=await photo_cache.photo(img)))
+            except Exception as e:
+                logger.warning("Failed to add image %s: %s", img, e)
+        if not media:
+            return
+
+        try:
+            media_messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        except TelegramBadRequest as e:
+            logger.warning("Failed to send media group: %s", e)
+            return
+
+        for img, msg in zip(images, media_messages):
+            await photo_cache.remember(img, msg)
+        if MessageManager.pending_albums.get(chat_id) is asyncio.current_task():
+            del MessageManager.pending_albums[chat_id]
+            for msg in media_messages:
+                await MessageManager.update_message_ids(chat_id, msg.message_id)
+        else:
+            # Пока альбом отправлялся, пользователь уже ушел с экрана товара
+            for msg in media_messages:
+                await MessageManager.safe_delete_message(chat_id, msg.message_id)
 
     @staticmethod
     async def safe_answer_callback(callback: types.CallbackQuery):
+        """Ответить на callback в фоне, не задерживая отрисовку экрана"""
+        background_tasks.spawn(MessageManager.answer_callback(callback))
+
+    @staticmethod
+    async def answer_callback(callback: types.CallbackQuery):
         """Безопасно ответить на callback"""
         try:
             await callback.answer()
         except TelegramBadRequest as e:
             if "query is too old" not in str(e):
-                logger.warning(f"Failed to answer callback query: {e}")
+                logger.warning("Failed to answer callback query: %s", e)
 
     @staticmethod
     async def safe_edit_message(
@@ -493,25 +722,108 @@ class MessageManager:
             reply_markup: Optional[InlineKeyboardMarkup] = None
     ) -> Optional[types.Message]:
         """Безопасно редактировать сообщение"""
+        return await MessageManager.render(callback, text, reply_markup)
+
+    # (chat_id, message_id) -> путь изображения, показанного в сообщении. Сообщения, которые
+    # пользователь просто оставил в чате, вытесняются давно не редактированными
+    shown_photos = OrderedDict()
+
+    @staticmethod
+    def shown_photo(key: Tuple[int, int]) -> Optional[str]:
+        image_path = MessageManager.shown_photos.get(key)
+        if image_path is not None:
+            MessageManager.shown_photos.move_to_end(key)
+        return image_path
+
+    @staticmethod
+    def remember_shown_photo(key: Tuple[int, int], image_path: str):
+        MessageManager.shown_photos[key] = image_path
+        MessageManager.shown_photos.move_to_end(key)
+        if len(MessageManager.shown_photos) > Config.SHOWN_PHOTOS_SIZE:
+            MessageManager.shown_photos.popitem(last=False)
+
+    @staticmethod
+    async def render(
+            callback: types.CallbackQuery,
+            text: str,
+            reply_markup: Optional[InlineKeyboardMarkup] = None,
+            image_path: Optional[str] = None
+    ) -> types.Message:
+        """Показать экран, по возможности отредактировав текущее сообщение.
+
+        Текст меняется через edit_message_text, подпись — через edit_message_caption
+        (если фото то же), фото — через edit_message_media. Заново отправляем только
+        когда тип сообщения не позволяет редактирование (текст <-> фото).
+        """
+        message = callback.message
+        chat_id = message.chat.id
+        key = (chat_id, message.message_id)
+
         try:
-            await callback.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
-            return callback.message
+            if image_path and message.photo:
+                if MessageManager.shown_photo(key) == image_path:
+                    await bot.edit_message_caption(
+                        chat_id=chat_id,
+                        message_id=message.message_id,
+                        caption=text,
+                        reply_markup=reply_markup,
+                        parse_mode="HTML"
+                    )
+                else:
+                    edited = await bot.edit_message_media(
+                        chat_id=chat_id,
+                        message_id=message.message_id,
+                        media=InputMediaPhoto(
+                            media=await photo_cache.photo(image_path),
+                            caption=text,
+                            parse_mode="HTML"
+                        ),
+                        reply_markup=reply_markup
+                    )
+                    if isinstance(edited, types.Message):
+                        await photo_cache.remember(image_path, edited)
+                    MessageManager.remember_shown_photo(key, image_path)
+                return message
+            if not image_path and not message.photo:
+                await message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+                return message
         except TelegramBadRequest as e:
-            logger.warning(f"Failed to edit message: {e}")
-            return await bot.send_message(
-                chat_id=callback.message.chat.id,
+            if "message is not modified" in str(e):
+                return message
+            logger.warning("Failed to edit message %s: %s", message.message_id, e)
+
+        sent_message = None
+        if image_path:
+            try:
+                sent_message = await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=await photo_cache.photo(image_path),
+                    caption=text,
+                    reply_markup=reply_markup,
+                    parse_mode="HTML"
+                )
+                await photo_cache.remember(image_path, sent_message)
+                MessageManager.remember_shown_photo((chat_id, sent_message.message_id), image_path)
+            except TelegramBadRequest as e:
+                logger.warning("Failed to send photo %s: %s", image_path, e)
+        if sent_message is None:
+            sent_message = await bot.send_message(
+                chat_id=chat_id,
                 text=text,
                 reply_markup=reply_markup,
                 parse_mode="HTML"
             )
+        background_tasks.spawn(MessageManager.safe_delete_message(chat_id, message.message_id))
+        return sent_message
 
     @staticmethod
     async def safe_delete_message(chat_id: int, message_id: int):
         """Безопасно удалить сообщение"""
+        MessageManager.shown_photos.pop((chat_id, message_id), None)
         try:
             await bot.delete_message(chat_id=chat_id, message_id=message_id)
         except TelegramBadRequest as e:
-            logger.warning(f"Failed to delete message {message_id}: {e}")
+            logger.warning("Failed to delete message %s: %s", message_id, e)
 
     @staticmethod
     def get_valid_images(images: List[str]) -> List[str]:
@@ -523,12 +835,144 @@ class MessageManager:
                 if os.path.exists(full_path):
                     valid_images.append(img)
                 else:
-                    logger.warning(f"Image not found: {full_path}")
+                    logger.warning("Image not found: %s", full_path)
         return valid_images
 
-# Клавиатуры
+# Подавление промежуточных inline-запросов, пока пользователь печатает
+class SearchDebouncer:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.latest = {}
+
+    async def wait(self, user_id: int) -> bool:
+        """Ждет паузу в наборе; False, если за это время пришел более новый запрос"""
+        token = object()
+        self.latest[user_id] = token
+        await asyncio.sleep(self.delay)
+        if self.latest.get(user_id) is not token:
+            return False
+        del self.latest[user_id]
+        return True
+
+search_debouncer = SearchDebouncer(Config.SEARCH_DEBOUNCE)
+
+# file_id изображений, уже загруженных в Telegram: повторно файл не отправляем
+class PhotoCache:
+    def __init__(self):
+        self.file_ids = None
+
+    async def load(self):
+        if self.file_ids is None:
+            self.file_ids = await DatabaseService.get_telegram_file_ids()
+
+    def get(self, image_path: str) -> Optional[str]:
+        return self.file_ids.get(image_path) if self.file_ids else None
+
+    async def photo(self, image_path: str):
+        """file_id, если изображение уже загружалось, иначе сам файл"""
+        await self.load()
+        return self.get(image_path) or FSInputFile(os.path.join(Config.STATIC_PATH, image_path))
+
+    async def remember(self, image_path: str, message: Optional[types.Message]):
+        """Сохранить file_id из отправленного сообщения с фото"""
+        if not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        await self.load()
+        if self.file_ids.get(image_path) != file_id:
+            self.file_ids[image_path] = file_id
+            await DatabaseService.save_telegram_file_id(image_path, file_id)
+
+photo_cache = PhotoCache()
+
+# Префиксный индекс каталога в памяти для inline-режима
+class CatalogIndex:
+    def __init__(self):
+        self.version = None
+        self.items = {}
+        self.postings = {}  # слово названия -> id товаров
+        self.vocabulary = []  # отсортированные слова для поиска по префиксу
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def tokenize(text: Optional[str]) -> List[str]:
+        return re.findall(r'\w+', (text or '').casefold())
+
+    async def refresh(self):
+        """Перестроить индекс, если каталог изменился"""
+        version = await DatabaseService.get_catalog_version()
+        if version == self.version:
+            return
+        async with self.lock:
+            if version == self.version:
+                return
+            snapshot = await DatabaseService.get_catalog_snapshot()
+            # Сборка занимает заметное время на больших каталогах — не блокируем цикл событий
+            self.items, self.postings, self.vocabulary = await asyncio.to_thread(self.build, *snapshot)
+            self.version = version
+            logger.info(f"Catalog index rebuilt: {len(self.items)} items, version {version}")
+
+    @classmethod
+    def build(cls, items: List[sqlite3.Row], prices: List[tuple], images: List[sqlite3.Row]):
+        index = {}
+        postings = {}
+        for row in items:
+            index[row['id']] = {
+                'id': row['id'],
+                'name': row['name'],
+                'description': row['description'],
+                'prices': {},
+                'image': None,
+            }
+            for token in set(cls.tokenize(row['name'])):
+                postings.setdefault(token, []).append(row['id'])
+        for item_id, currency_code, price in prices:
+            item = index.get(item_id)
+            if item:
+                item['prices'][currency_code] = price
+        for row in images:
+            item = index.get(row['item_id'])
+            if item and not item['image']:
+                item['image'] = row['image_path']
+        return index, postings, sorted(postings)
+
+    def prefix_matches(self, prefix: str) -> set:
+        matches = set()
+        for position in range(bisect_left(self.vocabulary, prefix), len(self.vocabulary)):
+            token = self.vocabulary[position]
+            if not token.startswith(prefix):
+                break
+            matches.update(self.postings[token])
+        return matches
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        """Товары, в названии которых каждое слово запроса начинает какое-либо слово"""
+        words = self.tokenize(query)[:8]
+        if not words:
+            return []
+        # Длинные слова отсекают больше, поэтому пересекаем начиная с них
+        candidates = None
+        for word in sorted(words, key=len, reverse=True):
+            matches = self.prefix_matches(word)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+
+        # Слишком общие запросы не сортируем по названию — хватает стабильного порядка по id
+        if len(candidates) > Config.SEARCH_RANK_WINDOW:
+            return [self.items[item_id] for item_id in heapq.nsmallest(limit, candidates)]
+        return heapq.nsmallest(
+            limit,
+            (self.items[item_id] for item_id in candidates),
+            key=lambda item: (item['name'].casefold(), item['id'])
+        )
+
+catalog_index = CatalogIndex()
+
+# Клавиатуры (неизменяемые меню строятся один раз и переиспользуются)
 class Keyboards:
     @staticmethod
+    @lru_cache(maxsize=None)
     def main_menu() -> InlineKeyboardMarkup:
         """Главное меню"""
         return InlineKeyboardMarkup(inline_keyboard=[
@@ -558,6 +1002,16 @@ class Keyboards:
         buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data='catalog')])
         return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+    @staticmethod
+    def search_results(items: List[sqlite3.Row]) -> InlineKeyboardMarkup:
+        """Результаты поиска"""
+        buttons = [
+            [InlineKeyboardButton(text=item['name'], callback_data=f'item_{item["id"]}')]
+            for item in items
+        ]
+        buttons.append([InlineKeyboardButton(text="🔙 В главное меню", callback_data='main')])
+        return InlineKeyboardMarkup(inline_keyboard=buttons)
+
     @staticmethod
     def sizes_menu(sizes: List[str], item_id: int, category_id: int) -> InlineKeyboardMarkup:
         """Меню размеров"""
@@ -569,6 +1023,7 @@ class Keyboards:
         return InlineKeyboardMarkup(inline_keyboard=buttons)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def cart_menu(has_items: bool = False) -> InlineKeyboardMarkup:
         """Меню корзины"""
         buttons = []
@@ -591,6 +1046,7 @@ class Keyboards:
         return InlineKeyboardMarkup(inline_keyboard=buttons)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def back_to_main() -> InlineKeyboardMarkup:
         """Кнопка назад в главное меню"""
         return InlineKeyboardMarkup(inline_keyboard=[
@@ -598,6 +1054,7 @@ class Keyboards:
         ])
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def confirm_order() -> InlineKeyboardMarkup:
         """Меню подтверждения заказа"""
         return InlineKeyboardMarkup(inline_keyboard=[
@@ -607,6 +1064,7 @@ class Keyboards:
         ])
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def order_success() -> InlineKeyboardMarkup:
         """Меню после успешного заказа"""
         return InlineKeyboardMarkup(inline_keyboard=[
@@ -614,12 +1072,109 @@ class Keyboards:
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data='main')]
         ])
 
+# Кэш готовых экранов каталога: текст, клавиатура и изображения
+class RenderCache:
+    """Ключ — (экран, валюта); весь кэш сбрасывается при смене версии каталога"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = OrderedDict()
+        self.loading = {}  # (ключ, версия) -> задача загрузки, общая для одновременных запросов
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, view: tuple, version: int, currency_code: Optional[str], loader):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        key = (view, currency_code)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        # После смены версии все пользователи промахиваются разом — экран строится один раз
+        self.misses += 1
+        task = self.loading.get((key, version))
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self.loading[(key, version)] = task
+            task.add_done_callback(lambda _: self.loading.pop((key, version), None))
+        value = await asyncio.shield(task)
+        if version == self.version:
+            self.entries[key] = value
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+render_cache = RenderCache(Config.RENDER_CACHE_SIZE)
+
+# Построение экранов каталога (результат кэшируется в render_cache)
+class Views:
+    @staticmethod
+    async def catalog() -> Tuple[str, InlineKeyboardMarkup]:
+        """Список категорий"""
+        categories = await DatabaseService.get_categories()
+        if not categories:
+            return "📂 Категории отсутствуют\n\nПока что в магазине нет категорий товаров.", Keyboards.back_to_main()
+        return "📂 Выберите категорию:", Keyboards.categories_menu(categories)
+
+    @staticmethod
+    async def category(category_id: int, currency_code: str) -> Optional[Tuple[str, InlineKeyboardMarkup, Optional[str]]]:
+        """Категория: текст со списком товаров, клавиатура и изображение"""
+        category, items = await asyncio.gather(
+            DatabaseService.get_category_by_id(category_id),
+            DatabaseService.get_items_by_category(category_id)
+        )
+        if not category:
+            return None
+
+        category_name = category['name']
+        category_image = category['image_path']
+        full_image_path = os.path.join(Config.STATIC_PATH, category_image.replace('/', os.sep)) if category_image else None
+        image_exists = os.path.exists(full_image_path) if full_image_path else False
+        logger.debug("Category %s image path: %s, exists: %s, full path: %s",
+                     category_name, category_image, image_exists, full_image_path)
+
+        if not items:
+            keyboard = Keyboards.back_to_main()
+            text = f"📂 Категория: {category_name}\n\n📦 В этой категории пока нет товаров."
+        else:
+            keyboard = Keyboards.items_menu(items, category_id)
+            prices = await DatabaseService.get_item_prices([item['id'] for item in items], currency_code)
+            items_text = [f"• {item['name']} - {prices[item['id']]:.2f} {currency_code}" for item in items]
+            text = f"📂 Категория: {category_name}\n\n" + "\n".join(items_text)
+        return text, keyboard, category_image if image_exists else None
+
+    @staticmethod
+    async def item(item_id: int, currency_code: str) -> Optional[Tuple[str, InlineKeyboardMarkup, List[str]]]:
+        """Карточка товара: текст, клавиатура размеров и существующие изображения"""
+        item, price, images = await asyncio.gather(
+            DatabaseService.get_item_by_id(item_id),
+            DatabaseService.get_item_price(item_id, currency_code),
+            DatabaseService.get_item_images(item_id)
+        )
+        if not item:
+            return None
+
+        sizes = [s.strip() for s in item['sizes'].split(',') if s.strip()]
+        text = (
+            f"🏷️ {item['name']}\n"
+            f"💰 Цена: {price:.2f} {currency_code}\n"
+            f"📝 {item['description'] or 'Нет описания'}\n\n"
+            f"📦 В наличии: {item['stock_quantity']}\n\n"
+            f"👕 Выберите размер:"
+        )
+        keyboard = Keyboards.sizes_menu(sizes, item_id, item['category_id'])
+        return text, keyboard, MessageManager.get_valid_images(images)
+
 # Обработчики команд
 @router.message(Command('start'))
 async def start_command(message: types.Message, state: FSMContext):
     """Обработчик команды /start"""
     user_id = message.from_user.id
-    logger.info(f"User {user_id} started the bot")
+    logger.info("User %s started the bot", user_id)
 
     if await DatabaseService.is_user_banned(user_id):
         await message.answer("🚫 Ваш аккаунт заблокирован. Обратитесь к администратору.")
@@ -636,6 +1191,92 @@ async def start_command(message: types.Message, state: FSMContext):
 
     await state.update_data(last_message_id=sent_message.message_id)
 
+@router.message(Command('search'))
+async def search_command(message: types.Message, state: FSMContext):
+    """Обработчик команды /search"""
+    user_id = message.from_user.id
+
+    if await DatabaseService.is_user_banned(user_id):
+        await message.answer("🚫 Ваш аккаунт заблокирован. Обратитесь к администратору.")
+        return
+
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.answer("🔎 Использование: /search <название товара>")
+        return
+
+    currency_code, _ = await DatabaseService.get_user_currency(user_id)
+    items = await DatabaseService.search_items(query, currency_code)
+
+    if not items:
+        await message.answer(
+            f"🔎 По запросу «{query}» ничего не найдено",
+            reply_markup=Keyboards.back_to_main()
+        )
+        return
+
+    items_text = [f"• {item['name']} - {item['price']:.2f} {currency_code}" for item in items]
+    await message.answer(
+        f"🔎 Результаты по запросу «{query}»:\n\n" + "\n".join(items_text),
+        reply_markup=Keyboards.search_results(items)
+    )
+
+@router.inline_query()
+async def inline_search_handler(inline_query: types.InlineQuery):
+    """Поиск товаров в inline-режиме (@bot запрос)"""
+    query = inline_query.query.strip()
+    user_id = inline_query.from_user.id
+    if not query:
+        await inline_query.answer([], cache_time=5, is_personal=True)
+        return
+
+    if not await search_debouncer.wait(user_id):
+        return
+
+    currency_code, _ = await DatabaseService.get_user_currency(user_id)
+    await catalog_index.refresh()
+    await photo_cache.load()
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    matches = catalog_index.search(query, offset + Config.INLINE_SEARCH_LIMIT + 1)
+    page = matches[offset:offset + Config.INLINE_SEARCH_LIMIT]
+    next_offset = str(offset + len(page)) if len(matches) > offset + len(page) else ''
+
+    results = []
+    for item in page:
+        price = item['prices'].get(currency_code, 0.0)
+        caption = (
+            f"🏷️ {item['name']}\n💰 Цена: {price:.2f} {currency_code}\n"
+            f"📝 {item['description'] or 'Нет описания'}"
+        )
+        file_id = photo_cache.get(item['image']) if item['image'] else None
+        if file_id:
+            results.append(InlineQueryResultCachedPhoto(
+                id=str(item['id']),
+                photo_file_id=file_id,
+                title=item['name'],
+                description=f"{price:.2f} {currency_code}",
+                caption=caption
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=str(item['id']),
+                title=item['name'],
+                description=f"{price:.2f} {currency_code}",
+                input_message_content=InputTextMessageContent(message_text=caption)
+            ))
+
+    try:
+        # Цены зависят от валюты пользователя, поэтому кэш Telegram персональный
+        await inline_query.answer(
+            results,
+            cache_time=Config.INLINE_CACHE_TIME,
+            is_personal=True,
+            next_offset=next_offset
+        )
+    except TelegramBadRequest as e:
+        logger.warning("Failed to answer inline query: %s", e)
+
 # Обработчики callback'ов
 @router.callback_query(F.data == 'main')
 async def main_menu_handler(callback: types.CallbackQuery, state: FSMContext):
@@ -655,23 +1296,9 @@ async def catalog_handler(callback: types.CallbackQuery, state: FSMContext):
     """Каталог товаров"""
     await MessageManager.safe_answer_callback(callback)
 
-    categories = await DatabaseService.get_categories()
-
-    if not categories:
-        keyboard = Keyboards.back_to_main()
-        await MessageManager.safe_edit_message(
-            callback,
-            "📂 Категории отсутствуют\n\nПока что в магазине нет категорий товаров.",
-            keyboard
-        )
-        return
-
-    keyboard = Keyboards.categories_menu(categories)
-    await MessageManager.safe_edit_message(
-        callback,
-        "📂 Выберите категорию:",
-        keyboard
-    )
+    version = await DatabaseService.get_catalog_version()
+    text, keyboard = await render_cache.get(('catalog',), version, None, Views.catalog)
+    await MessageManager.safe_edit_message(callback, text, keyboard)
 
 @router.callback_query(F.data.startswith('category_'))
 async def category_handler(callback: types.CallbackQuery, state: FSMContext):
@@ -679,9 +1306,16 @@ async def category_handler(callback: types.CallbackQuery, state: FSMContext):
     await MessageManager.safe_answer_callback(callback)
 
     category_id = int(callback.data.split('_')[1])
-    category = await DatabaseService.get_category_by_id(category_id)
+    version, (currency_code, _) = await asyncio.gather(
+        DatabaseService.get_catalog_version(),
+        DatabaseService.get_user_currency(callback.from_user.id)
+    )
+    view = await render_cache.get(
+        ('category', category_id), version, currency_code,
+        lambda: Views.category(category_id, currency_code)
+    )
 
-    if not category:
+    if not view:
         await MessageManager.safe_edit_message(
             callback,
             "❌ Категория не найдена",
@@ -689,58 +1323,10 @@ async def category_handler(callback: types.CallbackQuery, state: FSMContext):
         )
         return
 
-    category_name = category['name']
-    category_image = category['image_path']
-    full_image_path = os.path.join(Config.STATIC_PATH, category_image.replace('/', os.sep)) if category_image else None
-    image_exists = os.path.exists(full_image_path) if full_image_path else False
-    logger.debug(f"Category {category_name} image path: {category_image}, exists: {image_exists}, full path: {full_image_path}")
-
-    items = await DatabaseService.get_items_by_category(category_id)
-    currency_code, _ = await DatabaseService.get_user_currency(callback.from_user.id)
-
-    if not items:
-        keyboard = Keyboards.back_to_main()
-        text = f"📂 Категория: {category_name}\n\n📦 В этой категории пока нет товаров."
-    else:
-        keyboard = Keyboards.items_menu(items, category_id)
-        items_text = []
-        for item in items:
-            price = await DatabaseService.get_item_price(item['id'], currency_code)
-            items_text.append(f"• {item['name']} - {price:.2f} {currency_code}")
-        text = f"📂 Категория: {category_name}\n\n" + "\n".join(items_text)
-
-    await MessageManager.safe_delete_message(callback.message.chat.id, callback.message.message_id)
-
-    if category_image and image_exists:
-        try:
-            sent_message = await bot.send_photo(
-                chat_id=callback.message.chat.id,
-                photo=FSInputFile(full_image_path),
-                caption=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-            await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
-        except TelegramBadRequest as e:
-            logger.warning(f"Failed to send category photo {category_image}: {e}")
-            sent_message = await bot.send_message(
-                chat_id=callback.message.chat.id,
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-            await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
-    else:
-        sent_message = await bot.send_message(
-            chat_id=callback.message.chat.id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-        await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
+    text, keyboard, image_path = view
+    sent_message = await MessageManager.render(callback, text, keyboard, image_path)
+    await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
+    await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
 
 @router.callback_query(F.data.startswith('item_'))
 async def item_handler(callback: types.CallbackQuery, state: FSMContext):
@@ -748,90 +1334,34 @@ async def item_handler(callback: types.CallbackQuery, state: FSMContext):
     await MessageManager.safe_answer_callback(callback)
 
     item_id = int(callback.data.split('_')[1])
-    item = await DatabaseService.get_item_by_id(item_id)
+    version, (currency_code, _) = await asyncio.gather(
+        DatabaseService.get_catalog_version(),
+        DatabaseService.get_user_currency(callback.from_user.id)
+    )
+    view = await render_cache.get(
+        ('item', item_id), version, currency_code,
+        lambda: Views.item(item_id, currency_code)
+    )
 
-    if not item:
-        sent_message = await bot.send_message(
-            chat_id=callback.message.chat.id,
-            text="❌ Товар не найден",
-            reply_markup=Keyboards.back_to_main(),
-            parse_mode="HTML"
-        )
+    if not view:
+        sent_message = await MessageManager.render(callback, "❌ Товар не найден", Keyboards.back_to_main())
         await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
         await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
         return
 
-    currency_code, _ = await DatabaseService.get_user_currency(callback.from_user.id)
-    price = await DatabaseService.get_item_price(item_id, currency_code)
-    images = await DatabaseService.get_item_images(item_id)
-    valid_images = MessageManager.get_valid_images(images)
-
-    sizes = [s.strip() for s in item['sizes'].split(',') if s.strip()]
-
-    text = (
-        f"🏷️ {item['name']}\n"
-        f"💰 Цена: {price:.2f} {currency_code}\n"
-        f"📝 {item['description'] or 'Нет описания'}\n\n"
-        f"📦 В наличии: {item['stock_quantity']}\n\n"
-        f"👕 Выберите размер:"
+    text, keyboard, valid_images = view
+    chat_id = callback.message.chat.id
+    sent_message = await MessageManager.render(
+        callback,
+        text,
+        keyboard,
+        valid_images[0] if valid_images else None
     )
+    await MessageManager.update_message_ids(chat_id, sent_message.message_id)
+    await MessageManager.delete_previous_messages(chat_id, [sent_message.message_id])
 
-    keyboard = Keyboards.sizes_menu(sizes, item_id, item['category_id'])
-
-    await MessageManager.safe_delete_message(callback.message.chat.id, callback.message.message_id)
-
-    if valid_images:
-        try:
-            sent_message = await bot.send_photo(
-                chat_id=callback.message.chat.id,
-                photo=FSInputFile(os.path.join(Config.STATIC_PATH, valid_images[0])),
-                caption=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-            await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
-
-            if len(valid_images) > 1:
-                media = []
-                for img in valid_images[1:4]:
-                    try:
-                        media.append(InputMediaPhoto(
-                            media=FSInputFile(os.path.join(Config.STATIC_PATH, img))
-                        ))
-                    except Exception as e:
-                        logger.warning(f"Failed to add image {img}: {e}")
-
-                if media:
-                    try:
-                        media_messages = await bot.send_media_group(
-                            chat_id=callback.message.chat.id,
-                            media=media
-                        )
-                        for msg in media_messages:
-                            await MessageManager.update_message_ids(callback.message.chat.id, msg.message_id)
-                    except TelegramBadRequest as e:
-                        logger.warning(f"Failed to send media group: {e}")
-
-        except TelegramBadRequest as e:
-            logger.warning(f"Failed to send item photo {valid_images[0]}: {e}")
-            sent_message = await bot.send_message(
-                chat_id=callback.message.chat.id,
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-            await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
-    else:
-        sent_message = await bot.send_message(
-            chat_id=callback.message.chat.id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        await MessageManager.update_message_ids(callback.message.chat.id, sent_message.message_id)
-        await MessageManager.delete_previous_messages(callback.message.chat.id, [sent_message.message_id])
+    if len(valid_images) > 1:
+        MessageManager.send_album_later(chat_id, valid_images[1:4])
 
 @router.callback_query(F.data.startswith('size_'))
 async def size_handler(callback: types.CallbackQuery, state: FSMContext):
@@ -883,9 +1413,10 @@ async def cart_handler(callback: types.CallbackQuery, state: FSMContext):
     else:
         total = 0.0
         items_text = ["🛒 Ваша корзина:\n"]
+        prices = await DatabaseService.get_item_prices([item['id'] for item in cart_items], currency_code)
 
         for item in cart_items:
-            price = await DatabaseService.get_item_price(item['id'], currency_code)
+            price = prices[item['id']]
             total += price
             items_text.append(
                 f"• {item['name']} (📏 {item['size']}) - {price:.2f} {currency_code}"
@@ -1003,9 +1534,10 @@ async def checkout_handler(callback: types.CallbackQuery, state: FSMContext):
     currency_code, _ = await DatabaseService.get_user_currency(user_id)
     total = 0.0
     order_details = ["📋 Подтверждение заказа:\n"]
+    prices = await DatabaseService.get_item_prices([item['id'] for item in cart_items], currency_code)
 
     for item in cart_items:
-        price = await DatabaseService.get_item_price(item['id'], currency_code)
+        price = prices[item['id']]
         total += price
         order_details.append(
             f"• {item['name']} (📏 {item['size']}) - {price:.2f} {currency_code}"
@@ -1042,8 +1574,9 @@ async def confirm_order_handler(callback: types.CallbackQuery, state: FSMContext
         currency_code = data['currency_code']
 
         order_items = []
+        prices = await DatabaseService.get_item_prices([item['id'] for item in cart_items], currency_code)
         for item in cart_items:
-            price = await DatabaseService.get_item_price(item['id'], currency_code)
+            price = prices[item['id']]
             order_items.append({
                 'name': item['name'],
                 'size': item['size'],
@@ -1203,7 +1736,7 @@ async def unban_user_command(message: types.Message):
 async def unknown_callback_handler(callback: types.CallbackQuery, state: FSMContext):
     """Обработчик неизвестных callback'ов"""
     await MessageManager.safe_answer_callback(callback)
-    logger.warning(f"Unknown callback data: {callback.data}")
+    logger.warning("Unknown callback data: %s", callback.data)
 
     await MessageManager.safe_edit_message(
         callback,
@@ -1225,8 +1758,36 @@ async def text_message_handler(message: types.Message, state: FSMContext):
         reply_markup=Keyboards.main_menu()
     )
 
-# Подключение роутера
+# Подключение роутера и метрик
 dp.include_router(router)
+dp.update.outer_middleware(MetricsMiddleware())
+for observer in (router.message, router.callback_query, router.inline_query):
+    observer.middleware(HandlerNameMiddleware())
+bot.session.middleware(ApiMetricsMiddleware())
+metrics_registry.gauge('bot_render_cache_hits', 'Render cache hits', lambda: render_cache.hits)
+metrics_registry.gauge('bot_render_cache_misses', 'Render cache misses', lambda: render_cache.misses)
+metrics_registry.gauge('bot_currency_cache_hit_rate', 'Share of currency lookups served from memory',
+                       lambda: currency_cache.hit_rate)
+
+async def rates_refresh_loop(source):
+    """Периодически обновляет курсы валют.
+
+    Случайный сдвиг разносит обновления процессов во времени, а аренда в БД
+    (см. rates.refresh_rates) не дает им обновлять курсы повторно.
+    """
+    await asyncio.sleep(random.uniform(0, 30))
+    while True:
+        try:
+            changed = await asyncio.to_thread(
+                rates.refresh_rates, source, Config.DATABASE_PATH, Config.RATES_REFRESH_INTERVAL // 2
+            )
+            if changed:
+                currency_cache.clear()
+        except rates.RateSourceError as e:
+            logger.warning(f"Exchange rate refresh failed: {e}")
+        except sqlite3.Error as e:
+            logger.error(f"Database error during exchange rate refresh: {e}")
+        await asyncio.sleep(Config.RATES_REFRESH_INTERVAL * random.uniform(0.9, 1.1))
 
 # Основная функция
 async def main():
@@ -1235,10 +1796,15 @@ async def main():
     logger.info(f"Admin IDs: {Config.ADMIN_IDS}")
     logger.info(f"Orders Channel ID: {Config.ORDERS_CHANNEL_ID}")
     logger.info(f"Notifications Channel ID: {Config.NOTIFICATIONS_CHANNEL_ID}")
-    init_db()
+    ensure_schema()
     logger.info("Database initialized")
 
-    await notification_service.send_bot_started_notification()
+    # Уведомление о запуске не задерживает начало приема обновлений
+    background_tasks.spawn(notification_service.send_bot_started_notification())
+
+    metrics_runner = await start_metrics_server(Config.METRICS_PORT) if Config.METRICS_PORT else None
+    rates_source = rates.source_from_config(Config.RATES_URL, Config.RATES_FILE)
+    rates_task = asyncio.create_task(rates_refresh_loop(rates_source)) if rates_source else None
 
     try:
         await dp.start_polling(bot)
@@ -1246,7 +1812,13 @@ async def main():
         logger.error(f"Error in main: {e}")
         raise
     finally:
+        if rates_task:
+            rates_task.cancel()
+        await background_tasks.drain()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
+        database.close()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,534 @@
+"""Массовый импорт и экспорт каталога (CSV / JSONL).
+
+Использование из командной строки:
+
+    python catalog_io.py import catalog.csv
+    python catalog_io.py import catalog.jsonl --batch-size 2000
+    python catalog_io.py export catalog.jsonl
+
+Формат CSV: category, name, description, sizes, stock_quantity, images,
+price_<КОД ВАЛЮТЫ>... (images — пути относительно static через ';').
+Формат JSONL: по одному объекту на строку с теми же полями, где prices —
+словарь {код валюты: цена}, а images — список путей.
+
+Изображения принимаются только из static/uploads и только существующие:
+пути за пределами uploads и ссылки на отсутствующие файлы не попадают в
+item_images, а попадают в отчет импорта (rejected_images).
+
+Админка не импортирует в потоке запроса: она сохраняет файл и ставит
+задание import_catalog (jobs), а ход импорта пишется в catalog_imports.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import posixpath
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import jobs
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = 'shop.db'
+STATIC_PATH = 'static'
+CATEGORY_FOLDER_PREFIX = 'ct'
+THUMBNAIL_SIZE = (400, 400)
+THUMBNAIL_DIR = 'thumbs'
+DEFAULT_BATCH_SIZE = 1000
+UPLOADS_DIR = 'uploads'
+MAX_REJECTED_REPORT = 100  # сколько отклоненных изображений перечислить в отчете (счетчик — все)
+FOLDER_SEQUENCE = 'category_folder'
+SEQUENCES_TABLE_SQL = 'CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+IMPORTS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS catalog_imports
+                       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        filename TEXT,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        records INTEGER NOT NULL DEFAULT 0,
+                        stats TEXT,
+                        error TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+
+BASE_FIELDS = ['category', 'name', 'description', 'sizes', 'stock_quantity', 'images']
+
+
+class ImportTakenOver(Exception):
+    """Импорт продолжил другой запуск (задание снова выдано после истечения аренды)"""
+
+
+def thumbnail_path(image_path):
+    """Путь к миниатюре (относительно static) для изображения товара"""
+    folder, filename = os.path.split(image_path)
+    return f"{folder}/{THUMBNAIL_DIR}/{filename}" if folder else f"{THUMBNAIL_DIR}/{filename}"
+
+
+def make_thumbnail(image_path, static_path=STATIC_PATH):
+    """Создает миниатюру изображения. Возвращает путь к ней или None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    source = os.path.join(static_path, image_path.replace('/', os.sep))
+    relative_thumb = thumbnail_path(image_path)
+    target = os.path.join(static_path, relative_thumb.replace('/', os.sep))
+    if not os.path.exists(source):
+        return None
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return relative_thumb
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with Image.open(source) as img:
+            img.thumbnail(THUMBNAIL_SIZE)
+            img.save(target)
+        return relative_thumb
+    except Exception as e:
+        logger.warning("Failed to create thumbnail for %s: %s", image_path, e)
+        return None
+
+
+def pillow_available():
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def clean_image_path(image_path, static_path=STATIC_PATH):
+    """Нормализованный путь изображения относительно static.
+
+    ValueError, если путь абсолютный, выходит за пределы uploads или файла нет:
+    по этим путям потом строятся миниатюры и удаляются файлы.
+    """
+    path = posixpath.normpath(image_path.replace('\\', '/'))
+    parts = path.split('/')
+    if posixpath.isabs(path) or os.path.isabs(image_path) or ':' in parts[0] \
+            or '..' in parts or parts[0] != UPLOADS_DIR or len(parts) < 2:
+        raise ValueError(f"image path outside {UPLOADS_DIR}: {image_path!r}")
+    full_path = os.path.join(static_path, *parts)
+    uploads_root = os.path.realpath(os.path.join(static_path, UPLOADS_DIR))
+    if os.path.commonpath([uploads_root, os.path.realpath(full_path)]) != uploads_root:
+        raise ValueError(f"image path outside {UPLOADS_DIR}: {image_path!r}")
+    if not os.path.isfile(full_path):
+        raise ValueError(f"image file not found: {image_path!r}")
+    return path
+
+
+def _split_list(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if v and str(v).strip()]
+    return [v.strip() for v in str(value).split(';') if v.strip()]
+
+
+def _normalize_record(record):
+    """Приводит строку CSV или объект JSONL к единому виду"""
+    prices = dict(record.get('prices') or {})
+    for key, value in record.items():
+        if key.startswith('price_') and value not in (None, ''):
+            prices[key[len('price_'):].upper()] = value
+    sizes = record.get('sizes') or ''
+    if isinstance(sizes, list):
+        sizes = ','.join(sizes)
+    return {
+        'category': str(record.get('category') or '').strip(),
+        'name': str(record.get('name') or '').strip(),
+        'description': str(record.get('description') or '').strip(),
+        'sizes': str(sizes).strip(),
+        'stock_quantity': int(record.get('stock_quantity') or 0),
+        'prices': {code.upper(): float(price) for code, price in prices.items()},
+        'images': _split_list(record.get('images')),
+    }
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_records(stream, fmt):
+    """Построчно читает записи из текстового потока.
+
+    Для некорректных записей отдает None, чтобы импорт мог их пропустить.
+    """
+    rows = (line for line in stream if line.strip()) if fmt == 'jsonl' else csv.DictReader(stream)
+    for number, row in enumerate(rows, 1):
+        try:
+            yield _normalize_record(json.loads(row) if fmt == 'jsonl' else row)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning("Skipping invalid record %d: %s", number, e)
+            yield None
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _next_id(cursor, table):
+    """Следующий id для таблицы с AUTOINCREMENT (внутри BEGIN IMMEDIATE)"""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    row = cursor.fetchone()
+    seq = row[0] if row else 0
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    return max(seq, cursor.fetchone()[0]) + 1
+
+
+def _max_folder_number(cursor, static_path):
+    """Максимальный номер среди существующих папок ctN (разовый просмотр для старых баз)"""
+    upload_path = os.path.join(static_path, 'uploads')
+    names = os.listdir(upload_path) if os.path.isdir(upload_path) else []
+    cursor.execute("SELECT folder_name FROM categories WHERE folder_name IS NOT NULL")
+    names += [row[0] for row in cursor.fetchall()]
+    prefix_length = len(CATEGORY_FOLDER_PREFIX)
+    return max([int(name[prefix_length:]) for name in names
+                if name.startswith(CATEGORY_FOLDER_PREFIX) and name[prefix_length:].isdigit()] + [0])
+
+
+def seed_folder_sequence(cursor, static_path=STATIC_PATH):
+    """Засевает последовательность папок по уже существующим ctN, если ее еще нет"""
+    cursor.execute("SELECT 1 FROM sequences WHERE name = ?", (FOLDER_SEQUENCE,))
+    if not cursor.fetchone():
+        cursor.execute("INSERT INTO sequences (name, value) VALUES (?, ?)",
+                       (FOLDER_SEQUENCE, _max_folder_number(cursor, static_path)))
+
+
+def allocate_folder_name(cursor, static_path=STATIC_PATH):
+    """Выделяет имя папки категории из последовательности в БД.
+
+    Вызывается внутри пишущей транзакции: UPDATE берет блокировку на запись,
+    поэтому два админа не получат одну и ту же папку.
+    """
+    cursor.execute("UPDATE sequences SET value = value + 1 WHERE name = ?", (FOLDER_SEQUENCE,))
+    if cursor.rowcount == 0:
+        seed_folder_sequence(cursor, static_path)
+        cursor.execute("UPDATE sequences SET value = value + 1 WHERE name = ?", (FOLDER_SEQUENCE,))
+    cursor.execute("SELECT value FROM sequences WHERE name = ?", (FOLDER_SEQUENCE,))
+    return f'{CATEGORY_FOLDER_PREFIX}{cursor.fetchone()[0]}'
+
+
+def create_import(cursor, filename):
+    """Запись об импорте в catalog_imports (в транзакции, которая ставит задание); возвращает id"""
+    cursor.execute("INSERT INTO catalog_imports (filename) VALUES (?)", (filename,))
+    return cursor.lastrowid
+
+
+def get_import(cursor, import_id):
+    """(статус, прочитано записей, статистика) импорта или None"""
+    cursor.execute("SELECT status, records, stats FROM catalog_imports WHERE id = ?", (import_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2]) if row[2] else {}
+
+
+def recent_imports(cursor, limit=10):
+    """Последние импорты для страницы импорта, новые первыми"""
+    cursor.execute('''
+                   SELECT id, filename, status, records, stats, error, created_at, updated_at
+                   FROM catalog_imports
+                   ORDER BY id DESC
+                   LIMIT ?
+                   ''', (limit,))
+    columns = [column[0] for column in cursor.description]
+    result = []
+    for row in cursor.fetchall():
+        entry = dict(zip(columns, row))
+        entry['stats'] = json.loads(entry['stats']) if entry['stats'] else {}
+        result.append(entry)
+    return result
+
+
+def _insert_batch(cursor, batch, number, stats, static_path, thumbnail_jobs):
+    """Вставляет пачку записей в открытой транзакции; возвращает пути изображений пачки"""
+    # Справочники читаются заново: между пачками бот и админка могли их изменить
+    cursor.execute("SELECT id, name FROM currencies")
+    currency_ids = {name.upper(): currency_id for currency_id, name in cursor.fetchall()}
+    cursor.execute("SELECT id, name FROM categories")
+    category_ids = {name: category_id for category_id, name in cursor.fetchall()}
+    item_id = _next_id(cursor, 'items')
+
+    items, prices, images, image_paths = [], [], [], []
+    for record in batch:
+        number += 1
+        if not record or not record['name'] or not record['category'] or not record['sizes']:
+            stats['skipped'] += 1
+            continue
+
+        category_id = category_ids.get(record['category'])
+        if category_id is None:
+            folder_name = allocate_folder_name(cursor, static_path)
+            os.makedirs(os.path.join(static_path, 'uploads', folder_name), exist_ok=True)
+            cursor.execute("INSERT INTO categories (name, folder_name) VALUES (?, ?)",
+                           (record['category'], folder_name))
+            category_id = category_ids[record['category']] = cursor.lastrowid
+            stats['categories'] += 1
+
+        items.append((item_id, category_id, record['name'], record['description'],
+                      record['sizes'], record['stock_quantity']))
+        for code, price in record['prices'].items():
+            if code in currency_ids:
+                prices.append((item_id, currency_ids[code], price))
+        item_images = []
+        for path in record['images']:
+            try:
+                item_images.append(clean_image_path(path, static_path))
+            except ValueError as e:
+                logger.warning("Record %d: rejected image: %s", number, e)
+                stats['rejected_images'] += 1
+                if len(stats['rejected']) < MAX_REJECTED_REPORT:
+                    stats['rejected'].append({'record': number, 'image': path, 'error': str(e)})
+        for i, path in enumerate(dict.fromkeys(item_images)):
+            images.append((item_id, path, i == 0))
+            image_paths.append(path)
+        item_id += 1
+
+    cursor.executemany(
+        "INSERT INTO items (id, category_id, name, description, sizes, stock_quantity) VALUES (?, ?, ?, ?, ?, ?)",
+        items
+    )
+    cursor.executemany(
+        "INSERT OR REPLACE INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
+        prices
+    )
+    cursor.executemany(
+        "INSERT INTO item_images (item_id, image_path, is_primary) VALUES (?, ?, ?)",
+        images
+    )
+    stats['items'] += len(items)
+    stats['prices'] += len(prices)
+    stats['images'] += len(images)
+
+    image_paths = list(dict.fromkeys(image_paths))
+    if thumbnail_jobs:
+        for path in image_paths:
+            jobs.enqueue(cursor, 'make_thumbnail', {'path': path})
+        stats['thumbnails'] += len(image_paths)
+    return image_paths
+
+
+def import_catalog(stream, fmt='csv', db_path=DATABASE_PATH, static_path=STATIC_PATH,
+                   batch_size=DEFAULT_BATCH_SIZE, thumbnails=True, workers=None, import_id=None,
+                   thumbnail_jobs=False):
+    """Импортирует каталог из потока, по транзакции на пачку.
+
+    Записи читаются пачками по batch_size и вставляются через executemany;
+    каждая пачка — отдельная короткая транзакция BEGIN IMMEDIATE, так что бот
+    и админка пишут между пачками. Новые категории создаются по имени.
+    Изображения проверяются clean_image_path; отклоненные не вставляются, а
+    попадают в stats['rejected'] (номер записи, путь, причина).
+
+    С import_id число прочитанных записей и статистика сохраняются в
+    catalog_imports в транзакции пачки: повторный запуск продолжает с первой
+    незакоммиченной записи. Если прогресс успел сдвинуть другой запуск того
+    же импорта, поднимается ImportTakenOver. Без import_id пачки, закоммиченные
+    до ошибки, остаются в базе.
+
+    Миниатюры при thumbnail_jobs=True ставятся заданиями make_thumbnail в
+    транзакции пачки (так импортирует админка), иначе строятся после импорта
+    в пуле процессов. Возвращает словарь со статистикой.
+    """
+    stats = {'categories': 0, 'items': 0, 'prices': 0, 'images': 0, 'skipped': 0, 'thumbnails': 0,
+             'rejected_images': 0, 'rejected': []}
+    thumbnail_jobs = thumbnail_jobs and thumbnails and pillow_available()
+    image_paths = []
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SEQUENCES_TABLE_SQL)
+        cursor.execute(IMPORTS_TABLE_SQL)
+
+        number = 0
+        if import_id is not None:
+            status, number, saved_stats = get_import(cursor, import_id)
+            stats.update(saved_stats)
+            if status == 'done':
+                return stats
+            cursor.execute("UPDATE catalog_imports SET status = 'running', error = NULL, "
+                           "updated_at = CURRENT_TIMESTAMP WHERE id = ?", (import_id,))
+            if number:
+                logger.info("Resuming catalog import %s after record %d", import_id, number)
+
+        for batch in _batched(islice(read_records(stream, fmt), number, None), batch_size):
+            batch_stats = dict(stats, rejected=list(stats['rejected']))
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                paths = _insert_batch(cursor, batch, number, batch_stats, static_path, thumbnail_jobs)
+                if import_id is not None:
+                    cursor.execute('''
+                                   UPDATE catalog_imports
+                                   SET records = ?, stats = ?, updated_at = CURRENT_TIMESTAMP
+                                   WHERE id = ? AND records = ?
+                                   ''', (number + len(batch), json.dumps(batch_stats, ensure_ascii=False),
+                                         import_id, number))
+                    if cursor.rowcount == 0:
+                        raise ImportTakenOver(f"catalog import {import_id} was advanced by another run")
+                cursor.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            stats = batch_stats
+            number += len(batch)
+            if not thumbnail_jobs:
+                image_paths.extend(paths)
+
+        if import_id is not None:
+            cursor.execute("UPDATE catalog_imports SET status = 'done', updated_at = CURRENT_TIMESTAMP "
+                           "WHERE id = ?", (import_id,))
+    except ImportTakenOver:
+        raise
+    except Exception as e:
+        if import_id is not None:
+            cursor.execute("UPDATE catalog_imports SET status = 'failed', error = ?, "
+                           "updated_at = CURRENT_TIMESTAMP WHERE id = ?", (str(e), import_id))
+        raise
+    finally:
+        conn.close()
+
+    if thumbnails and not thumbnail_jobs and image_paths and pillow_available():
+        unique_paths = list(dict.fromkeys(image_paths))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(make_thumbnail, unique_paths,
+                                   [static_path] * len(unique_paths), chunksize=64)
+            stats['thumbnails'] = sum(1 for result in results if result)
+
+    logger.info("Catalog import finished: %s", stats)
+    return stats
+
+
+def _export_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM currencies ORDER BY name")
+        currency_codes = [row['name'] for row in cursor.fetchall()]
+        yield currency_codes
+        cursor.execute('''
+                       SELECT c.name AS category,
+                              i.name,
+                              i.description,
+                              i.sizes,
+                              i.stock_quantity,
+                              (SELECT GROUP_CONCAT(cur.name || '=' || ip.price, ';')
+                               FROM item_prices ip
+                                        JOIN currencies cur ON ip.currency_id = cur.id
+                               WHERE ip.item_id = i.id) AS prices,
+                              (SELECT GROUP_CONCAT(image_path, ';')
+                               FROM (SELECT image_path
+                                     FROM item_images
+                                     WHERE item_id = i.id
+                                     ORDER BY is_primary DESC, id)) AS images
+                       FROM items i
+                                JOIN categories c ON i.category_id = c.id
+                       ORDER BY i.id
+                       ''')
+        for row in cursor:
+            yield row
+    finally:
+        conn.close()
+
+
+def _parse_prices(value):
+    prices = {}
+    for pair in _split_list(value):
+        code, _, price = pair.partition('=')
+        prices[code] = float(price)
+    return prices
+
+
+def iter_export(fmt='csv', db_path=DATABASE_PATH):
+    """Построчно отдает каталог в формате CSV или JSONL"""
+    rows = _export_rows(db_path)
+    currency_codes = next(rows)
+
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps({
+                'category': row['category'],
+                'name': row['name'],
+                'description': row['description'] or '',
+                'sizes': row['sizes'],
+                'stock_quantity': row['stock_quantity'],
+                'prices': _parse_prices(row['prices']),
+                'images': _split_list(row['images']),
+            }, ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(BASE_FIELDS + [f'price_{code}' for code in currency_codes])
+    for row in rows:
+        prices = _parse_prices(row['prices'])
+        writer.writerow([row['category'], row['name'], row['description'] or '', row['sizes'],
+                         row['stock_quantity'], row['images'] or '']
+                        + [prices.get(code, '') for code in currency_codes])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_catalog(stream, fmt='csv', db_path=DATABASE_PATH):
+    """Записывает каталог в текстовый поток, возвращает число записанных фрагментов"""
+    chunks = 0
+    for chunk in iter_export(fmt, db_path):
+        stream.write(chunk)
+        chunks += 1
+    return chunks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Импорт и экспорт каталога магазина')
+    parser.add_argument('--db', default=DATABASE_PATH, help='путь к базе данных')
+    parser.add_argument('--static', default=STATIC_PATH, help='папка со статикой')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='импортировать каталог')
+    import_parser.add_argument('file', help='CSV или JSONL файл ("-" для stdin)')
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'])
+    import_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    import_parser.add_argument('--workers', type=int, default=None, help='процессов для миниатюр')
+    import_parser.add_argument('--no-thumbnails', action='store_true')
+
+    export_parser = subparsers.add_parser('export', help='экспортировать каталог')
+    export_parser.add_argument('file', help='CSV или JSONL файл ("-" для stdout)')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'])
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fmt = args.format or ('csv' if args.file == '-' else detect_format(args.file))
+
+    if args.command == 'import':
+        if args.file == '-':
+            stats = import_catalog(sys.stdin, fmt, args.db, args.static, args.batch_size,
+                                   not args.no_thumbnails, args.workers)
+        else:
+            with open(args.file, encoding='utf-8', newline='') as f:
+                stats = import_catalog(f, fmt, args.db, args.static, args.batch_size,
+                                       not args.no_thumbnails, args.workers)
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        if args.file == '-':
+            export_catalog(sys.stdout, fmt, args.db)
+        else:
+            with open(args.file, 'w', encoding='utf-8', newline='') as f:
+                export_catalog(f, fmt, args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Конфигурация gunicorn для админки.
+
+    gunicorn -c gunicorn.conf.py
+
+Код приложения загружается в мастере (preload_app), там же один раз
+проверяется и при необходимости создается схема БД — воркеры получают уже
+готовое приложение через fork. У каждого воркера свой пул соединений SQLite
+(Config.DB_POOL_SIZE, по умолчанию равен числу потоков).
+
+Настройки окружения: ADMIN_BIND (127.0.0.1:5000), GUNICORN_WORKER_CLASS
+(gthread, sync или gevent), GUNICORN_WORKERS (2 * CPU + 1),
+GUNICORN_THREADS (4), GUNICORN_WORKER_CONNECTIONS (100, для gevent),
+GUNICORN_TIMEOUT (30), GUNICORN_MAX_REQUESTS (0 — без перезапуска воркеров).
+"""
+import multiprocessing
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Патчить нужно до импорта приложения в мастере, иначе потоки и сокеты останутся блокирующими
+    from gevent import monkey
+    monkey.patch_all()
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+bind = os.getenv('ADMIN_BIND', '127.0.0.1:5000')
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Соединений в пуле — столько, сколько запросов воркер обслуживает одновременно
+os.environ.setdefault('DB_POOL_SIZE', str(worker_connections if worker_class == 'gevent' else threads))
+
+
+def post_fork(server, worker):
+    # Фоновые задания (jobs.py) выполняет каждый воркер; в мастере их нет
+    from app import job_runner
+    job_runner.start()
+    server.log.info("Worker %s started (%s, %s threads)", worker.pid, worker_class, threads)
+
+
+def worker_exit(server, worker):
+    from app import job_runner
+    job_runner.stop(timeout=graceful_timeout)
@@ -0,0 +1,203 @@
+"""Очередь фоновых заданий в SQLite, без внешнего брокера.
+
+Задание ставится в очередь курсором той транзакции, которая его порождает:
+откат транзакции отменяет и задание, а после commit оно переживет
+перезапуск процесса. JobRunner выполняет задания в пуле потоков. Задание
+забирается атомарным UPDATE ... RETURNING, поэтому одну очередь могут
+разбирать несколько процессов (воркеры gunicorn).
+
+Упавшее задание повторяется с задержкой RETRY_DELAY, 2 * RETRY_DELAY, ...
+(не больше MAX_RETRY_DELAY); после MAX_ATTEMPTS попыток оно остается в
+таблице со статусом failed. Задание, взятое процессом, который потом упал,
+возвращается в очередь через LEASE секунд — обработчики должны быть
+идемпотентными.
+
+    python jobs.py status
+    python jobs.py retry    # вернуть failed-задания в очередь
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = 'shop.db'
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2.0  # секунд до первой повторной попытки
+MAX_RETRY_DELAY = 600.0
+LEASE = 300.0  # секунд, после которых взятое, но не завершенное задание снова доступно
+POLL_INTERVAL = 5.0
+
+JOBS_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS jobs
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    "CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after)",
+)
+
+CLAIM_SQL = '''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, locked_until = :lease_end
+            WHERE id = (SELECT id
+                        FROM jobs
+                        WHERE (status = 'pending' AND run_after <= :now)
+                           OR (status = 'running' AND locked_until < :now)
+                        ORDER BY run_after, id
+                        LIMIT 1)
+            RETURNING id, kind, payload, attempts
+            '''
+
+
+def migrate(cursor):
+    """Создает таблицу заданий"""
+    for statement in JOBS_SCHEMA:
+        cursor.execute(statement)
+
+
+def enqueue(cursor, kind, payload, delay=0):
+    """Ставит задание в очередь в текущей транзакции курсора; возвращает id"""
+    cursor.execute("INSERT INTO jobs (kind, payload, run_after) VALUES (?, ?, ?)",
+                   (kind, json.dumps(payload, ensure_ascii=False), time.time() + delay))
+    return cursor.lastrowid
+
+
+class JobRunner:
+    """Потоки, выполняющие задания: handlers — {вид задания: функция(payload)}"""
+
+    def __init__(self, handlers, db_path=DATABASE_PATH, workers=2, poll_interval=POLL_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS):
+        self.handlers = handlers
+        self.db_path = db_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        os.register_at_fork(after_in_child=self.reset)
+
+    def start(self):
+        if self.threads:
+            return
+        self.stopping.clear()
+        self.threads = [threading.Thread(target=self.work, name=f'jobs-{number}', daemon=True)
+                        for number in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def notify(self):
+        """Будит потоки сразу после commit, не дожидаясь poll_interval"""
+        self.wakeup.set()
+
+    def stop(self, timeout=None):
+        """Дожидается текущих заданий; оставшиеся в очереди выполнит следующий запуск"""
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def reset(self):
+        # Потоки не переживают fork: в дочернем процессе их запускает start()
+        self.threads = []
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def work(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while not self.stopping.is_set():
+                self.wakeup.clear()
+                timeout = self.poll_interval
+                try:
+                    while not self.stopping.is_set() and self.run_next(conn):
+                        pass
+                    # Ближайший повтор может наступить раньше следующего опроса
+                    next_run = conn.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'pending'").fetchone()[0]
+                    if next_run is not None:
+                        timeout = min(timeout, max(next_run - time.time(), 0.01))
+                except sqlite3.Error as e:
+                    logger.warning("Job queue unavailable: %s", e)
+                self.wakeup.wait(timeout)
+        finally:
+            conn.close()
+
+    def run_next(self, conn):
+        """Выполняет одно готовое задание; False, если очередь пуста"""
+        now = time.time()
+        with conn:
+            claimed = conn.execute(CLAIM_SQL, {'now': now, 'lease_end': now + LEASE}).fetchall()
+        if not claimed:
+            return False
+        job_id, kind, payload, attempts = claimed[0]
+        started = time.perf_counter()
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No handler for job kind {kind!r}")
+            handler(json.loads(payload))
+        except Exception as e:
+            self.retry_or_fail(conn, job_id, kind, attempts, e)
+        else:
+            with conn:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            logger.debug("Job %s (%s) done in %.0fms", job_id, kind, (time.perf_counter() - started) * 1000)
+        return True
+
+    def retry_or_fail(self, conn, job_id, kind, attempts, error):
+        if attempts >= self.max_attempts:
+            with conn:
+                conn.execute("UPDATE jobs SET status = 'failed', locked_until = NULL, last_error = ? WHERE id = ?",
+                             (repr(error), job_id))
+            logger.error("Job %s (%s) failed after %d attempts: %r", job_id, kind, attempts, error)
+            return
+        delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        with conn:
+            conn.execute('''
+                         UPDATE jobs
+                         SET status = 'pending', run_after = ?, locked_until = NULL, last_error = ?
+                         WHERE id = ?
+                         ''', (time.time() + delay, repr(error), job_id))
+        logger.warning("Job %s (%s) failed, retry %d in %.0fs: %r", job_id, kind, attempts, delay, error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Очередь фоновых заданий')
+    parser.add_argument('command', choices=['status', 'retry'])
+    parser.add_argument('--db', default=DATABASE_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'retry':
+            with conn:
+                count = conn.execute("UPDATE jobs SET status = 'pending', attempts = 0, run_after = ? "
+                                     "WHERE status = 'failed'", (time.time(),)).rowcount
+            print(f"Requeued {count} failed jobs")
+            return 0
+        for kind, status, count in conn.execute(
+                "SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status"):
+            print(f"{kind:<20} {status:<8} {count}")
+        for job_id, kind, attempts, last_error in conn.execute(
+                "SELECT id, kind, attempts, last_error FROM jobs WHERE status = 'failed' ORDER BY id"):
+            print(f"failed #{job_id} {kind} after {attempts} attempts: {last_error}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
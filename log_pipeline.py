@@ -0,0 +1,154 @@
+"""Неблокирующее логирование для бота и админки.
+
+Вызовы logger только кладут запись в очередь (QueueHandler); форматирование
+и вывод выполняет поток QueueListener, поэтому ввод-вывод логов не происходит
+ни в цикле событий бота, ни в потоках запросов админки. Сообщения передаются
+в отложенном виде — logger.warning("Image not found: %s", path) — и
+собираются в строку только в потоке вывода.
+
+Повторяющиеся предупреждения и ошибки прореживаются: запись с тем же шаблоном
+из того же места выводится не больше LOG_SAMPLE_BURST раз за
+LOG_SAMPLE_INTERVAL секунд, а число пропущенных добавляется к первой записи
+следующего интервала (поле suppressed).
+
+Настройки окружения: LOG_LEVEL (INFO), LOG_FORMAT (json или text),
+LOG_SAMPLE_BURST (5), LOG_SAMPLE_INTERVAL (60).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_SAMPLE_BURST = 5
+DEFAULT_SAMPLE_INTERVAL = 60.0
+MAX_SAMPLE_KEYS = 10000
+
+# Стандартные атрибуты LogRecord; остальные пришли через extra= и попадают в JSON
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат с отметкой о прореженных записях"""
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f'{text} (+{suppressed} similar suppressed)' if suppressed else text
+
+
+class SamplingFilter(logging.Filter):
+    """Не больше burst записей с одним шаблоном и местом вызова за interval секунд"""
+
+    def __init__(self, burst=DEFAULT_SAMPLE_BURST, interval=DEFAULT_SAMPLE_INTERVAL, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.level = level
+        self.windows = {}  # (логгер, шаблон, строка) -> [начало интервала, выведено, пропущено]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.level <= record.levelno < logging.CRITICAL:
+            return True
+        key = (record.name, str(record.msg), record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self.windows) >= MAX_SAMPLE_KEYS:
+                    self.windows.clear()
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                self.windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Кладет запись в очередь как есть: сообщение форматирует поток вывода.
+
+    Аргументы сообщения должны быть неизменяемыми значениями — список,
+    измененный после вызова logger, попадет в лог уже измененным.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=None, log_format=None):
+    """Подключает очередь логов к корневому логгеру и запускает поток вывода"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler()
+    if (log_format or os.getenv('LOG_FORMAT', 'json')) == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(TextFormatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(
+        int(os.getenv('LOG_SAMPLE_BURST', DEFAULT_SAMPLE_BURST)),
+        float(os.getenv('LOG_SAMPLE_INTERVAL', DEFAULT_SAMPLE_INTERVAL)),
+    ))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO'))
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def _restart_after_fork():
+    # Поток вывода не переживает fork: в дочернем процессе запускаем свой на той же очереди
+    if _listener is not None:
+        _listener._thread = None  # унаследованный объект потока мертв; start() в 3.14+ проверяет его
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
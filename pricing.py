@@ -0,0 +1,81 @@
+"""Цены товаров в валютах магазина.
+
+Явная цена из item_prices используется как есть. Для валют без явной цены
+она выводится из курса: currencies.rate — сколько единиц валюты в одной
+единице базовой (у базовой rate = 1). Источником служит явная цена в базовой
+валюте, а если ее нет — в любой другой. Выведенная цена округляется до шага
+currencies.rounding (например, 1 для рублей, 0.01 для BYN).
+
+Цены вычисляются при чтении, поэтому смена курса — одно UPDATE currencies,
+без записи по каждому товару.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDING = 0.01
+CURRENCY_ROUNDING = {'RUB': 1.0}
+MAX_SQL_VARIABLES = 900
+
+
+def price_sql(item_column):
+    """SQL-выражение цены товара в валюте, код которой передается параметром"""
+    return f'''(SELECT COALESCE(
+                   (SELECT ip.price
+                    FROM item_prices ip
+                    WHERE ip.item_id = {item_column}
+                      AND ip.currency_id = tc.id),
+                   (SELECT ROUND(ROUND(ip.price / sc.rate * tc.rate / tc.rounding) * tc.rounding, 6)
+                    FROM item_prices ip
+                             JOIN currencies sc ON ip.currency_id = sc.id
+                    WHERE ip.item_id = {item_column}
+                    ORDER BY sc.rate = 1 DESC, sc.id
+                    LIMIT 1))
+               FROM currencies tc
+               WHERE tc.name = ?)'''
+
+
+def migrate(cursor):
+    """Добавляет столбец currencies.rounding и правила округления по умолчанию"""
+    cursor.execute("PRAGMA table_info(currencies)")
+    if any(column[1] == 'rounding' for column in cursor.fetchall()):
+        return
+    cursor.execute(f"ALTER TABLE currencies ADD COLUMN rounding REAL NOT NULL DEFAULT {DEFAULT_ROUNDING}")
+    cursor.executemany(
+        "UPDATE currencies SET rounding = ? WHERE name = ?",
+        [(rounding, code) for code, rounding in CURRENCY_ROUNDING.items()]
+    )
+    logger.info("Added column rounding to currencies")
+
+
+def prices_for(cursor, item_ids, currency_code):
+    """Цены группы товаров (например, страницы каталога) одним запросом.
+
+    Возвращает {item_id: цена или None, если у товара нет ни одной цены}.
+    """
+    item_ids = list(item_ids)
+    prices = {}
+    for start in range(0, len(item_ids), MAX_SQL_VARIABLES):
+        chunk = item_ids[start:start + MAX_SQL_VARIABLES]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(
+            f"SELECT i.id, {price_sql('i.id')} FROM items i WHERE i.id IN ({placeholders})",
+            (currency_code, *chunk)
+        )
+        prices.update((row[0], row[1]) for row in cursor.fetchall())
+    return prices
+
+
+def all_prices(cursor, currency_code):
+    """Цены всех товаров каталога в валюте: [(item_id, цена или None)]"""
+    cursor.execute(f"SELECT i.id, {price_sql('i.id')} FROM items i", (currency_code,))
+    return cursor.fetchall()
+
+
+def set_rate(cursor, currency_code, rate):
+    """Меняет курс валюты; все выведенные из него цены меняются вместе с ним"""
+    if rate <= 0:
+        raise ValueError(f"Rate for {currency_code} must be positive, got {rate}")
+    cursor.execute("UPDATE currencies SET rate = ? WHERE name = ?", (rate, currency_code))
+    return cursor.rowcount > 0
+
@@ -0,0 +1,177 @@
+"""Обновление курсов валют из внешнего источника.
+
+Источники возвращают курсы в формате {"base": "RUB", "rates": {"BYN": 0.037}}:
+HttpRateSource — по URL (JSON), FileRateSource — из локального файла
+(для офлайн-проверки и фикстур). Курсы пересчитываются к базовой валюте
+магазина (rate = 1) и записываются одной транзакцией. Меняются только
+действительно изменившиеся строки, поэтому версия каталога — и вместе с ней
+кэши бота и админки — сбрасывается лишь при реальном изменении курса.
+
+Несколько процессов (воркеры gunicorn, бот) могут запускать обновление
+одновременно: отметка времени последнего обновления в sequences работает как
+аренда, и внутри интервала повторное обновление пропускается.
+
+Использование из командной строки:
+
+    python rates.py refresh --file rates.example.json
+    python rates.py refresh --url https://example.com/rates.json --min-interval 0
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = 'shop.db'
+REFRESHED_AT = 'rates_refreshed_at'
+DEFAULT_MIN_INTERVAL = 3600
+HTTP_TIMEOUT = 10
+
+
+class RateSourceError(Exception):
+    """Источник курсов недоступен или вернул некорректные данные"""
+
+
+def parse_rates(payload):
+    """Проверяет ответ источника и возвращает (base, {код: курс})"""
+    try:
+        base = str(payload['base']).upper()
+        rates = {str(code).upper(): float(rate) for code, rate in payload['rates'].items()}
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise RateSourceError(f"Malformed rates payload: {e}") from e
+    if any(rate <= 0 for rate in rates.values()):
+        raise RateSourceError("Rates must be positive")
+    rates[base] = 1.0
+    return base, rates
+
+
+class FileRateSource:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return parse_rates(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            raise RateSourceError(f"Cannot read rates from {self.path}: {e}") from e
+
+    def __repr__(self):
+        return f"FileRateSource({self.path!r})"
+
+
+class HttpRateSource:
+    def __init__(self, url, timeout=HTTP_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                return parse_rates(json.load(response))
+        except (OSError, json.JSONDecodeError) as e:
+            raise RateSourceError(f"Cannot fetch rates from {self.url}: {e}") from e
+
+    def __repr__(self):
+        return f"HttpRateSource({self.url!r})"
+
+
+def source_from_config(url=None, path=None):
+    """Источник по настройкам: URL важнее файла; None, если не настроено"""
+    if url:
+        return HttpRateSource(url)
+    if path:
+        return FileRateSource(path)
+    return None
+
+
+def _refreshed_at(cursor):
+    cursor.execute("SELECT value FROM sequences WHERE name = ?", (REFRESHED_AT,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def refresh_rates(source, db_path=DATABASE_PATH, min_interval=DEFAULT_MIN_INTERVAL):
+    """Загружает курсы и обновляет currencies.
+
+    Возвращает {код: новый курс} изменившихся валют или None, если обновление
+    пропущено, потому что другой процесс уже обновил курсы внутри интервала.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+        if time.time() - _refreshed_at(cursor) < min_interval:
+            return None
+
+        # Сеть — вне транзакции, чтобы не держать блокировку записи
+        base, rates = source.fetch()
+
+        cursor.execute("BEGIN IMMEDIATE")
+        now = int(time.time())
+        if now - _refreshed_at(cursor) < min_interval:
+            conn.rollback()
+            return None
+
+        cursor.execute("SELECT name, rate FROM currencies")
+        current = dict(cursor.fetchall())
+        shop_base = next((code for code, rate in current.items() if rate == 1), base)
+        if shop_base not in rates:
+            conn.rollback()
+            raise RateSourceError(f"Source has no rate for shop base currency {shop_base}")
+
+        changed = {}
+        for code, old_rate in current.items():
+            if code not in rates:
+                continue
+            new_rate = round(rates[code] / rates[shop_base], 8)
+            if abs(new_rate - old_rate) > 1e-9 * max(new_rate, old_rate):
+                changed[code] = new_rate
+
+        # Триггеры версии каталога срабатывают только на измененных строках
+        cursor.executemany("UPDATE currencies SET rate = ? WHERE name = ?",
+                           [(rate, code) for code, rate in changed.items()])
+        cursor.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (REFRESHED_AT, now))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if changed:
+        logger.info(f"Exchange rates updated from {source}: {changed}")
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обновление курсов валют')
+    parser.add_argument('--db', default=DATABASE_PATH, help='путь к базе данных')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = subparsers.add_parser('refresh', help='загрузить курсы')
+    group = refresh_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--url', help='JSON с курсами по HTTP')
+    group.add_argument('--file', help='JSON с курсами из файла')
+    refresh_parser.add_argument('--min-interval', type=int, default=0,
+                                help='не обновлять, если курсы обновлялись раньше, секунд')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        changed = refresh_rates(source_from_config(args.url, args.file), args.db, args.min_interval)
+    except RateSourceError as e:
+        logger.error(str(e))
+        return 1
+    print(json.dumps({'changed': changed, 'skipped': changed is None}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
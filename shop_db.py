@@ -0,0 +1,491 @@
+"""Доступ к данным магазина, общий для бота и админки.
+
+Каждый запрос написан один раз — функцией, которая принимает курсор sqlite3
+(как pricing.prices_for). Синхронный фронтенд — вызов с курсором своего
+соединения: так работает DatabaseService админки. Асинхронный фронтенд —
+AsyncDatabase: функция выполняется в одном из потоков пула на соединении
+этого потока, а цикл событий (бот, ASGI-режим админки) тем временем
+обслуживает другие запросы.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pricing
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = 'shop.db'
+CATALOG_VERSION = 'catalog_version'
+CATALOG_TABLES = ('categories', 'items', 'item_images', 'item_prices', 'currencies')
+SEARCH_RANK_WINDOW = 1000
+
+# Полнотекстовый индекс товаров (FTS5), синхронизируется триггерами
+ITEMS_FTS_SCHEMA = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+           name, description,
+           content='items', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+           INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+           INSERT INTO items_fts(items_fts, rowid, name, description)
+           VALUES ('delete', old.id, old.name, old.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, description ON items BEGIN
+           INSERT INTO items_fts(items_fts, rowid, name, description)
+           VALUES ('delete', old.id, old.name, old.description);
+           INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+       END""",
+)
+
+# Товар с ценой в выбранной валюте и списком изображений (основное первым)
+ITEM_DETAILS_QUERY = '''
+                     SELECT i.id,
+                            i.category_id,
+                            i.name,
+                            i.description,
+                            i.sizes,
+                            i.stock_quantity,
+                            ''' + pricing.price_sql('i.id') + ''' AS price,
+                            (SELECT GROUP_CONCAT(image_path, ';')
+                             FROM (SELECT image_path
+                                   FROM item_images
+                                   WHERE item_id = i.id
+                                   ORDER BY is_primary DESC, id)) AS images
+                     FROM items i
+                     '''
+
+
+class AsyncDatabase:
+    """Асинхронный фронтенд: await db.run(shop_db.get_categories).
+
+    У каждого потока пула свое соединение, открытое при первом запросе.
+    После функции запроса выполняется commit, при исключении — rollback.
+    trace получает каждое SQL-выражение (sqlite3 set_trace_callback).
+    """
+
+    def __init__(self, path=DATABASE_PATH, workers=4, foreign_keys=False):
+        self.path = path
+        self.foreign_keys = foreign_keys
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False нужен только для close() из другого потока
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            if self.foreign_keys:
+                conn.execute("PRAGMA foreign_keys = ON")
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def call(self, query, args, trace):
+        conn = self.connection()
+        conn.set_trace_callback(trace)
+        try:
+            result = query(conn.cursor(), *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.set_trace_callback(None)
+
+    async def run(self, query, *args, trace=None):
+        loop = asyncio.get_running_loop()
+        # Контекст (например, счетчики текущего update) виден и в потоке пула
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, self.call, query, args, trace)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+
+
+def migrate_catalog_triggers(cursor):
+    """Триггеры каталога, общие для бота и админки (внутри транзакции миграции).
+
+    Версия каталога в sequences увеличивается при любом изменении таблиц
+    CATALOG_TABLES. Индекс items_fts создается и один раз заполняется; без
+    FTS5 поиск работает через LIKE.
+    """
+    cursor.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES (?, 1)", (CATALOG_VERSION,))
+    for table in CATALOG_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_catalog_version
+                               AFTER {event} ON {table}
+                               BEGIN
+                                   UPDATE sequences SET value = value + 1 WHERE name = '{CATALOG_VERSION}';
+                               END""")
+
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+        fts_exists = cursor.fetchone() is not None
+        for statement in ITEMS_FTS_SCHEMA:
+            cursor.execute(statement)
+        if not fts_exists:
+            cursor.execute("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
+            logger.info("Built full-text index for items")
+    except sqlite3.OperationalError as e:
+        logger.warning("FTS5 is not available, search will use LIKE: %s", e)
+
+
+def build_fts_query(query):
+    """Превращает пользовательский ввод в запрос FTS5: все слова, по префиксу"""
+    words = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{word}"*' for word in words[:8])
+
+
+def rows_by_ids(cursor, sql, item_ids, *params):
+    """Строки запроса sql (с плейсхолдером {ids} для id) в порядке item_ids"""
+    placeholders = ','.join('?' * len(item_ids))
+    cursor.execute(sql.format(ids=placeholders), (*params, *item_ids))
+    rows = {row['id']: row for row in cursor.fetchall()}
+    return [rows[item_id] for item_id in item_ids if item_id in rows]
+
+
+# Каталог
+
+def get_catalog_version(cursor):
+    cursor.execute("SELECT value FROM sequences WHERE name = ?", (CATALOG_VERSION,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_categories(cursor):
+    cursor.execute("SELECT * FROM categories ORDER BY name")
+    return cursor.fetchall()
+
+
+def get_category(cursor, category_id):
+    cursor.execute("SELECT * FROM categories WHERE id = ?", (category_id,))
+    return cursor.fetchone()
+
+
+def get_categories_page(cursor, after, limit):
+    cursor.execute("SELECT id, name, image_path FROM categories WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+    return cursor.fetchall()
+
+
+def get_item(cursor, item_id):
+    cursor.execute("SELECT * FROM items WHERE id = ?", (item_id,))
+    return cursor.fetchone()
+
+
+def get_category_item_names(cursor, category_id):
+    """id и названия товаров категории (список в боте)"""
+    cursor.execute("SELECT id, name FROM items WHERE category_id = ?", (category_id,))
+    return cursor.fetchall()
+
+
+def get_category_items(cursor, category_id, currency_code):
+    """Товары категории с ценой в валюте и изображениями через запятую (основное первым)"""
+    cursor.execute('''
+                   SELECT i.*,
+                          (SELECT GROUP_CONCAT(image_path, ',')
+                           FROM (SELECT image_path
+                                 FROM item_images
+                                 WHERE item_id = i.id
+                                 ORDER BY is_primary DESC, id)) as images,
+                          COALESCE(''' + pricing.price_sql('i.id') + ''', 0) as price
+                   FROM items i
+                   WHERE i.category_id = ?
+                   ORDER BY i.name''', (currency_code, category_id))
+    return cursor.fetchall()
+
+
+def get_items_page(cursor, category_id, currency_code, after, limit):
+    cursor.execute(ITEM_DETAILS_QUERY + " WHERE i.category_id = ? AND i.id > ? ORDER BY i.id LIMIT ?",
+                   (currency_code, category_id, after, limit))
+    return cursor.fetchall()
+
+
+def get_item_details(cursor, item_id, currency_code):
+    cursor.execute(ITEM_DETAILS_QUERY + " WHERE i.id = ?", (currency_code, item_id))
+    return cursor.fetchone()
+
+
+def get_items_details(cursor, item_ids, currency_code):
+    return rows_by_ids(cursor, ITEM_DETAILS_QUERY + " WHERE i.id IN ({ids})", item_ids, currency_code)
+
+
+def get_item_summaries(cursor, item_ids, currency_code):
+    """Название, описание и цена (0, если ее нет) товаров в порядке item_ids"""
+    return rows_by_ids(cursor, f'''
+                       SELECT items.id,
+                              items.name,
+                              items.description,
+                              COALESCE({pricing.price_sql('items.id')}, 0.0) AS price
+                       FROM items
+                       WHERE items.id IN ({{ids}})''', item_ids, currency_code)
+
+
+def get_item_images(cursor, item_id):
+    cursor.execute("SELECT * FROM item_images WHERE item_id = ? ORDER BY is_primary DESC", (item_id,))
+    return cursor.fetchall()
+
+
+def get_item_image_paths(cursor, item_id):
+    cursor.execute("SELECT image_path FROM item_images WHERE item_id = ? ORDER BY id", (item_id,))
+    return [row['image_path'] for row in cursor.fetchall()]
+
+
+def get_item_prices(cursor, item_id):
+    """Явные цены товара с названием и символом валюты"""
+    cursor.execute("""
+                   SELECT ip.*, c.name as currency_name, c.symbol
+                   FROM item_prices ip
+                            JOIN currencies c ON ip.currency_id = c.id
+                   WHERE ip.item_id = ?
+                   """, (item_id,))
+    return cursor.fetchall()
+
+
+def get_catalog_snapshot(cursor):
+    """Товары, цены во всех валютах и изображения для индекса в памяти"""
+    cursor.execute("SELECT id, name, description FROM items")
+    items = cursor.fetchall()
+    cursor.execute("SELECT name FROM currencies")
+    prices = [
+        (item_id, currency['name'], price)
+        for currency in cursor.fetchall()
+        for item_id, price in pricing.all_prices(cursor, currency['name'])
+        if price is not None
+    ]
+    cursor.execute("SELECT item_id, image_path FROM item_images ORDER BY item_id, id")
+    images = cursor.fetchall()
+    return items, prices, images
+
+
+def search_item_ids(cursor, query, limit, rank_window=SEARCH_RANK_WINDOW):
+    """id товаров по названию и описанию, лучшие совпадения первыми.
+
+    bm25 считается по всем совпадениям, поэтому ранжируем только если их
+    не больше rank_window. Для слишком общих запросов берем сначала
+    совпадения по названию без ранжирования — так время ответа ограничено.
+    """
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return []
+    try:
+        cursor.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH ? LIMIT ?", (fts_query, rank_window + 1))
+        if len(cursor.fetchall()) <= rank_window:
+            cursor.execute("""
+                           SELECT rowid
+                           FROM items_fts
+                           WHERE items_fts MATCH ?
+                           ORDER BY bm25(items_fts, 10.0, 1.0)
+                           LIMIT ?""", (fts_query, limit))
+        else:
+            cursor.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH ? LIMIT ?",
+                           (f'{{name}} : ({fts_query})', limit))
+    except sqlite3.OperationalError:
+        # FTS5 недоступен — медленный, но рабочий поиск
+        cursor.execute("SELECT id FROM items WHERE name LIKE ? OR description LIKE ? ORDER BY name LIMIT ?",
+                       (f'%{query}%', f'%{query}%', limit))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Изменения каталога (админка)
+
+def add_category(cursor, name, image_path, folder_name):
+    cursor.execute("INSERT INTO categories (name, image_path, folder_name) VALUES (?, ?, ?)",
+                   (name, image_path, folder_name))
+    return cursor.lastrowid
+
+
+def update_category(cursor, category_id, name, image_path):
+    cursor.execute("UPDATE categories SET name = ?, image_path = ? WHERE id = ?", (name, image_path, category_id))
+
+
+def add_item(cursor, category_id, name, description, sizes, stock_quantity):
+    cursor.execute("INSERT INTO items (category_id, name, description, sizes, stock_quantity) VALUES (?, ?, ?, ?, ?)",
+                   (category_id, name, description, sizes, stock_quantity))
+    return cursor.lastrowid
+
+
+def update_item(cursor, item_id, category_id, name, description, sizes, stock_quantity):
+    cursor.execute("UPDATE items SET category_id = ?, name = ?, description = ?, sizes = ?, stock_quantity = ? "
+                   "WHERE id = ?", (category_id, name, description, sizes, stock_quantity, item_id))
+
+
+def set_item_prices(cursor, item_id, prices, derived_currency_ids=()):
+    """Явные цены {id валюты: цена}; для derived_currency_ids цена снова выводится из курса"""
+    cursor.executemany("INSERT OR REPLACE INTO item_prices (item_id, currency_id, price) VALUES (?, ?, ?)",
+                       [(item_id, currency_id, price) for currency_id, price in prices.items()])
+    cursor.executemany("DELETE FROM item_prices WHERE item_id = ? AND currency_id = ?",
+                       [(item_id, currency_id) for currency_id in derived_currency_ids])
+
+
+def add_item_images(cursor, item_id, images):
+    """images — [(путь, основное ли)]"""
+    cursor.executemany("INSERT INTO item_images (item_id, image_path, is_primary) VALUES (?, ?, ?)",
+                       [(item_id, path, is_primary) for path, is_primary in images])
+
+
+def delete_item_images(cursor, item_id):
+    cursor.execute("DELETE FROM item_images WHERE item_id = ?", (item_id,))
+
+
+def count_image_references(cursor, image_path):
+    """Сколько строк в item_images и categories ссылаются на файл"""
+    cursor.execute("""
+                   SELECT (SELECT COUNT(*) FROM item_images WHERE image_path = ?)
+                              + (SELECT COUNT(*) FROM categories WHERE image_path = ?)
+                   """, (image_path, image_path))
+    return cursor.fetchone()[0]
+
+
+# Валюты
+
+def get_currencies(cursor):
+    cursor.execute("SELECT * FROM currencies ORDER BY name")
+    return cursor.fetchall()
+
+
+def get_active_currencies(cursor):
+    """Активные валюты; все, если активных нет или столбца is_active еще нет"""
+    try:
+        cursor.execute("SELECT * FROM currencies WHERE is_active = 1 ORDER BY name")
+        currencies = cursor.fetchall()
+        if currencies:
+            return currencies
+    except sqlite3.OperationalError:
+        pass
+    return get_currencies(cursor)
+
+
+def get_currency(cursor, currency_id):
+    cursor.execute("SELECT * FROM currencies WHERE id = ?", (currency_id,))
+    return cursor.fetchone()
+
+
+def get_user_currency(cursor, user_id):
+    """Название и курс сохраненной валюты пользователя или None"""
+    cursor.execute('''
+                   SELECT currencies.name, currencies.rate
+                   FROM user_preferences
+                            JOIN currencies ON user_preferences.currency_id = currencies.id
+                   WHERE user_preferences.user_id = ?
+                   ''', (user_id,))
+    return cursor.fetchone()
+
+
+def set_user_currency(cursor, user_id, currency_id):
+    """Сохраняет валюту пользователя и возвращает ее строку (None, если такой нет)"""
+    cursor.execute("INSERT OR REPLACE INTO user_preferences (user_id, currency_id) VALUES (?, ?)",
+                   (user_id, currency_id))
+    return get_currency(cursor, currency_id)
+
+
+# Пользователи, корзины и заказы
+
+def is_user_banned(cursor, user_id):
+    cursor.execute("SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,))
+    return cursor.fetchone() is not None
+
+
+def ban_user(cursor, user_id):
+    """False, если пользователь уже забанен"""
+    try:
+        cursor.execute("INSERT INTO banned_users (user_id) VALUES (?)", (user_id,))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+def unban_user(cursor, user_id):
+    cursor.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
+    return cursor.rowcount > 0
+
+
+def get_banned_users(cursor):
+    """(user_id, banned_at) забаненных пользователей; пусто, пока бот не создал таблицу"""
+    try:
+        cursor.execute("SELECT user_id, banned_at FROM banned_users ORDER BY banned_at DESC")
+    except sqlite3.OperationalError:
+        return []
+    return cursor.fetchall()
+
+
+def get_blocked_items(cursor):
+    """(id, name) заблокированных товаров; пусто, если в схеме нет items.is_blocked"""
+    try:
+        cursor.execute("SELECT id, name FROM items WHERE is_blocked = 1")
+    except sqlite3.OperationalError:
+        return []
+    return cursor.fetchall()
+
+
+def add_to_cart(cursor, user_id, item_id, size):
+    cursor.execute("INSERT INTO carts (user_id, item_id, size) VALUES (?, ?, ?)", (user_id, item_id, size))
+
+
+def get_cart_items(cursor, user_id):
+    cursor.execute('''
+                   SELECT items.id, items.name, carts.size
+                   FROM carts
+                            JOIN items ON carts.item_id = items.id
+                   WHERE carts.user_id = ?
+                   ''', (user_id,))
+    return cursor.fetchall()
+
+
+def clear_cart(cursor, user_id):
+    cursor.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+
+
+def remove_from_cart(cursor, user_id, item_id, size):
+    cursor.execute("DELETE FROM carts WHERE rowid = (SELECT rowid FROM carts "
+                   "WHERE user_id = ? AND item_id = ? AND size = ? LIMIT 1)", (user_id, item_id, size))
+
+
+def create_order(cursor, user_id, order_items, total_price, currency_code):
+    """Создает заказ в статусе pending и возвращает его id"""
+    order_data = {
+        "items": order_items,
+        "user_id": user_id,
+        "timestamp": datetime.now().isoformat()
+    }
+    cursor.execute('''
+                   INSERT INTO orders (user_id, order_data, total_price, currency_code, status, created_at)
+                   VALUES (?, ?, ?, ?, 'pending', CURRENT_TIMESTAMP)
+                   ''', (user_id, json.dumps(order_data, ensure_ascii=False), total_price, currency_code))
+    return cursor.lastrowid
+
+
+# Файлы, загруженные в Telegram
+
+def get_telegram_file_ids(cursor):
+    cursor.execute("SELECT image_path, file_id FROM telegram_files")
+    return {row['image_path']: row['file_id'] for row in cursor.fetchall()}
+
+
+def save_telegram_file_id(cursor, image_path, file_id):
+    cursor.execute("INSERT OR REPLACE INTO telegram_files (image_path, file_id) VALUES (?, ?)", (image_path, file_id))
+
+
+def forget_telegram_file(cursor, image_path):
+    """Забывает file_id удаленного файла; таблицу создает бот, без нее забывать нечего"""
+    try:
+        cursor.execute("DELETE FROM telegram_files WHERE image_path = ?", (image_path,))
+    except sqlite3.OperationalError:
+        pass
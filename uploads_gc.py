@@ -0,0 +1,285 @@
+"""Сборка мусора в static/uploads: файлы, на которые не ссылается каталог.
+
+Осиротевшие файлы остаются после замены и неудачной загрузки изображений,
+удаления товаров (ON DELETE CASCADE удаляет строки item_images, но не файлы)
+и категорий. Сборщик обходит static/uploads потоково (os.scandir), пачками
+складывает пути во временную таблицу SQLite и находит разницу с
+item_images.image_path и categories.image_path одним запросом. Временные
+таблицы хранятся на диске (temp_store = FILE), так что ни список файлов, ни
+список ссылок в память процесса не загружаются.
+
+Не удаляются файлы моложе --min-age (загрузка через /upload могла еще не
+попасть в форму товара) и placeholder.jpg. Миниатюра (thumbs/) живет, пока
+жив ее исходный файл. Незавершенные загрузки (.incoming) старше --min-age
+удаляются всегда. Папки ctN, которые не принадлежат ни одной категории,
+удаляются, когда в них не остается файлов.
+
+Удаление идет пачками по --batch-size: перед удалением пачки ссылки и
+mtime проверяются заново под блокировкой записи (BEGIN IMMEDIATE), поэтому
+не пропадет ни файл, на который сослались уже после обхода, ни файл, с
+которым только что совпала новая загрузка (админка обновляет его mtime до
+того, как ссылка на него будет закоммичена).
+
+    python uploads_gc.py                         # отчет без удаления
+    python uploads_gc.py --report orphans.tsv    # плюс полный список путей
+    python uploads_gc.py --delete --batch-size 500
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+import catalog_io
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = 'shop.db'
+STATIC_PATH = 'static'
+UPLOADS_DIR = 'uploads'
+INCOMING_PREFIX = 'uploads/objects/.incoming/'
+KEEP_PATHS = {'uploads/placeholder.jpg'}
+CATEGORY_FOLDER_RE = re.compile(rf'^{catalog_io.CATEGORY_FOLDER_PREFIX}\d+$')
+DEFAULT_MIN_AGE = 24 * 3600
+DEFAULT_BATCH_SIZE = 1000
+SAMPLE_SIZE = 20
+
+GC_SCHEMA = (
+    '''CREATE TEMP TABLE gc_files
+       (path TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL)''',
+    "CREATE TEMP TABLE gc_refs (path TEXT PRIMARY KEY) WITHOUT ROWID",
+)
+
+ORPHANS_SQL = '''
+              SELECT f.path, f.source, f.kind, f.size
+              FROM temp.gc_files f
+              WHERE f.mtime < :cutoff
+                AND (f.kind = 'incoming'
+                  OR NOT EXISTS (SELECT 1 FROM temp.gc_refs r WHERE r.path = f.source))
+              ORDER BY f.path
+              '''
+
+
+def iter_files(static_path):
+    """(путь относительно static, размер, mtime) каждого файла в uploads; в памяти — только стек папок"""
+    stack = [os.path.join(static_path, UPLOADS_DIR)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        relative_path = os.path.relpath(entry.path, static_path).replace(os.sep, '/')
+                        yield relative_path, stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            continue
+
+
+def classify(path):
+    """(путь, ссылка на который держит файл живым; вид файла)"""
+    if path.startswith(INCOMING_PREFIX):
+        return path, 'incoming'
+    folder, filename = os.path.split(path)
+    if os.path.basename(folder) == catalog_io.THUMBNAIL_DIR:
+        return f"{os.path.dirname(folder)}/{filename}", 'thumbnail'
+    parts = path.split('/')
+    if parts[1] == 'objects':
+        return path, 'object'
+    if len(parts) > 2 and CATEGORY_FOLDER_RE.match(parts[1]):
+        return path, 'category_folder'
+    return path, 'other'
+
+
+def load_files(conn, static_path, batch_size):
+    """Обходит uploads и пачками пишет пути во временную таблицу; возвращает число файлов"""
+    scanned = 0
+    rows = ((path, *classify(path), size, mtime)
+            for path, size, mtime in iter_files(static_path) if path not in KEEP_PATHS)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return scanned
+        conn.executemany("INSERT OR REPLACE INTO temp.gc_files (path, source, kind, size, mtime) "
+                         "VALUES (?, ?, ?, ?, ?)", batch)
+        scanned += len(batch)
+
+
+def load_references(conn):
+    """Все пути, на которые ссылается каталог, — внутри SQLite, без выборки в Python"""
+    conn.execute('''
+                 INSERT OR IGNORE INTO temp.gc_refs (path)
+                 SELECT image_path FROM item_images WHERE image_path IS NOT NULL
+                 UNION
+                 SELECT image_path FROM categories WHERE image_path IS NOT NULL
+                 ''')
+
+
+def still_referenced(conn, sources):
+    placeholders = ','.join('?' * len(sources))
+    cursor = conn.execute(f'''
+                          SELECT image_path FROM item_images WHERE image_path IN ({placeholders})
+                          UNION
+                          SELECT image_path FROM categories WHERE image_path IN ({placeholders})
+                          ''', (*sources, *sources))
+    return {row[0] for row in cursor}
+
+
+def modified_since(full_path, cutoff):
+    try:
+        return os.stat(full_path).st_mtime >= cutoff
+    except FileNotFoundError:
+        return False
+
+
+def delete_batch(conn, static_path, batch, cutoff):
+    """Удаляет пачку файлов под блокировкой записи; возвращает (удалено, байт, пропущено)"""
+    deleted = freed = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        sources = list({source for _, source, kind, _ in batch if kind != 'incoming'})
+        referenced = still_referenced(conn, sources) if sources else set()
+        removed = []
+        for path, source, kind, size in batch:
+            if kind != 'incoming' and source in referenced:
+                continue
+            full_path = os.path.join(static_path, path.replace('/', os.sep))
+            source_path = os.path.join(static_path, source.replace('/', os.sep))
+            # Повторная загрузка того же содержимого обновила mtime уже после обхода
+            if modified_since(full_path, cutoff) or modified_since(source_path, cutoff):
+                continue
+            try:
+                os.remove(full_path)
+            except FileNotFoundError:
+                continue
+            removed.append((path,))
+            deleted += 1
+            freed += size
+        try:
+            conn.executemany("DELETE FROM telegram_files WHERE image_path = ?", removed)
+        except sqlite3.OperationalError:
+            pass  # таблицу создает бот
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return deleted, freed, len(batch) - deleted
+
+
+def abandoned_folders(conn, static_path):
+    """Папки ctN в uploads, которые не указаны в categories.folder_name"""
+    owned = {row[0] for row in conn.execute("SELECT folder_name FROM categories WHERE folder_name IS NOT NULL")}
+    uploads_path = os.path.join(static_path, UPLOADS_DIR)
+    try:
+        with os.scandir(uploads_path) as entries:
+            names = [entry.name for entry in entries
+                     if entry.is_dir(follow_symlinks=False) and CATEGORY_FOLDER_RE.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name not in owned)
+
+
+def remove_empty_folder(path):
+    """Удаляет папку, если в ней (включая вложенные) не осталось файлов"""
+    for root, _, files in os.walk(path, topdown=False):
+        if files:
+            return False
+        try:
+            os.rmdir(root)
+        except OSError:
+            return False
+    return True
+
+
+def collect(db_path=DATABASE_PATH, static_path=STATIC_PATH, delete=False, min_age=DEFAULT_MIN_AGE,
+            batch_size=DEFAULT_BATCH_SIZE, report=None):
+    """Находит (и при delete=True удаляет) осиротевшие файлы; возвращает сводку"""
+    started = time.perf_counter()
+    scan_conn = sqlite3.connect(db_path)
+    write_conn = sqlite3.connect(db_path, isolation_level=None) if delete else None
+    summary = {'dry_run': not delete, 'scanned': 0, 'orphans': {}, 'orphan_files': 0, 'orphan_bytes': 0,
+               'young_skipped': 0, 'sample': []}
+    try:
+        scan_conn.execute("PRAGMA temp_store = FILE")
+        for statement in GC_SCHEMA:
+            scan_conn.execute(statement)
+        summary['scanned'] = load_files(scan_conn, static_path, batch_size)
+        load_references(scan_conn)
+        scan_conn.commit()
+
+        cutoff = time.time() - min_age
+        summary['young_skipped'] = scan_conn.execute(
+            "SELECT COUNT(*) FROM temp.gc_files f WHERE f.mtime >= ? "
+            "AND NOT EXISTS (SELECT 1 FROM temp.gc_refs r WHERE r.path = f.source)", (cutoff,)
+        ).fetchone()[0]
+
+        if delete:
+            summary.update(deleted=0, freed_bytes=0, kept_referenced=0)
+        cursor = scan_conn.execute(ORPHANS_SQL, {'cutoff': cutoff})
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for path, _, kind, size in batch:
+                stats = summary['orphans'].setdefault(kind, {'files': 0, 'bytes': 0})
+                stats['files'] += 1
+                stats['bytes'] += size
+                if len(summary['sample']) < SAMPLE_SIZE:
+                    summary['sample'].append(path)
+                if report:
+                    report.write(f"{kind}\t{size}\t{path}\n")
+            summary['orphan_files'] += len(batch)
+            summary['orphan_bytes'] += sum(size for *_, size in batch)
+            if delete:
+                deleted, freed, kept = delete_batch(write_conn, static_path, batch, cutoff)
+                summary['deleted'] += deleted
+                summary['freed_bytes'] += freed
+                summary['kept_referenced'] += kept
+                logger.info("Deleted %d files (%d bytes) in batch, %d kept", deleted, freed, kept)
+
+        folders = abandoned_folders(scan_conn, static_path)
+        summary['abandoned_folders'] = folders
+        if delete:
+            summary['removed_folders'] = [name for name in folders
+                                          if remove_empty_folder(os.path.join(static_path, UPLOADS_DIR, name))]
+    finally:
+        scan_conn.close()
+        if write_conn is not None:
+            write_conn.close()
+    summary['elapsed_s'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Удаление файлов uploads, на которые не ссылается каталог')
+    parser.add_argument('--db', default=DATABASE_PATH)
+    parser.add_argument('--static', default=STATIC_PATH)
+    parser.add_argument('--delete', action='store_true', help='удалить найденное (по умолчанию только отчет)')
+    parser.add_argument('--min-age', type=float, default=DEFAULT_MIN_AGE,
+                        help='не трогать файлы моложе, секунд (по умолчанию сутки)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--report', help='записать все найденные пути (вид, размер, путь через TAB)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report:
+            summary = collect(args.db, args.static, args.delete, args.min_age, args.batch_size, report)
+    else:
+        summary = collect(args.db, args.static, args.delete, args.min_age, args.batch_size)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())